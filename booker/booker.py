@@ -1,33 +1,32 @@
 from pathlib import Path
-from typing import List
+from typing import Iterable, List, Union
 
 import typer
 
 from booker import config
-from booker.bookerdataclasses import Book, Status, Ordering, ExportFormat
-from booker.config import config_file_path
+from booker.bookerdataclasses import Book, Status, Ordering, ExportFormat, Backend
+from booker.bulk import import_books, DEFAULT_BATCH_SIZE
 from booker.control import Outcome, Pipeline
 from booker.database import (
-    read_books,
-    export_yaml,
+    stream_books,
+    export_file,
     export_pantry,
-    append_book,
-    write_books,
-    _update_status,
-    incr_id,
-    database_path,
-    delete_book_id,
+    insert_book,
+    find_book,
+    search_books,
+    update_books,
+    remove_books,
 )
 from booker.listbooks import fmt_table
 
 
-def init(db_path) -> None:
+def init(db_path, backend: Backend = Backend.JSON) -> None:
     db_path = Path(db_path)
     pipeline = Pipeline(
         finalizer=lambda: typer.secho(
             f"The book database is {db_path.absolute()}", fg=typer.colors.GREEN
         ),
-        initial_args={"db_path": db_path},
+        initial_args={"db_path": db_path, "backend": backend},
     )
     return ~(pipeline << config.init_app)
 
@@ -53,44 +52,88 @@ def add(
             finalizer=lambda: f"{' '.join(title)} was added to the database",
             initial_args={"book": book},
         )
-        << read_books
-        << incr_id
-        << append_book
-        << write_books
+        << insert_book
     )
     return ~pipeline
 
 
-def get_list(ordering: Ordering, **kwargs) -> Outcome:
-    return ~(Pipeline(initial_args={"ordering": ordering}) << read_books << fmt_table)
+def get_list(
+    ordering: Ordering, limit: int = None, offset: int = 0, **kwargs
+) -> Outcome:
+    return ~(
+        Pipeline(initial_args={"ordering": ordering, "limit": limit, "offset": offset})
+        << stream_books
+        << fmt_table
+    )
 
 
-def update_status(id: int, status: Status, **kwargs) -> Outcome:
+def get_book(isbn: str, **kwargs) -> Outcome:
     return ~(
-        Pipeline(initial_args={"id": id, "status": status})
-        << read_books
-        << _update_status
-        << write_books
+        Pipeline(initial_args={"isbn": isbn, "ordering": Ordering.DEFAULT})
+        << find_book
+        << fmt_table
     )
 
 
-def delete_book(id: int, **kwargs) -> Outcome:
+def search(query: str, **kwargs) -> Outcome:
     return ~(
-        Pipeline(initial_args={"id": id})
-        << config_file_path
-        << database_path
-        << read_books
-        << delete_book_id
-        << write_books
+        Pipeline(initial_args={"query": query, "ordering": Ordering.DEFAULT})
+        << search_books
+        << fmt_table
     )
 
 
-def export(
-    fmt: ExportFormat, pantry_id: str = "", basket_id: str = "", **kwargs
+def _ids(id: Union[int, Iterable[int]]) -> List[int]:
+    # -1 stands in for a missing --id flag, which the storage reports as such
+    ids = [id] if isinstance(id, int) else list(id)
+    return ids or [-1]
+
+
+def update_status(id: Union[int, Iterable[int]], status: Status, **kwargs) -> Outcome:
+    return ~(Pipeline(initial_args={"ids": _ids(id), "status": status}) << update_books)
+
+
+def delete_book(id: Union[int, Iterable[int]], **kwargs) -> Outcome:
+    return ~(Pipeline(initial_args={"ids": _ids(id)}) << remove_books)
+
+
+def _report_import(outcome: Outcome) -> None:
+    imported, rejected = outcome.resolve()
+    typer.secho(f"{imported} books were added to the database", fg=typer.colors.GREEN)
+    for line, reason in rejected:
+        typer.secho(f"skipped line {line}: {reason}", fg=typer.colors.YELLOW)
+
+
+def bulk_import(
+    csv_path: Path, batch_size: int = DEFAULT_BATCH_SIZE, **kwargs
 ) -> Outcome:
-    action = {
-        ExportFormat.YAML: lambda: export_yaml(),
-        ExportFormat.PANTRY: lambda: export_pantry(pantry_id, basket_id),
-    }[fmt]
+    return ~(
+        Pipeline(
+            finalizer=_report_import,
+            initial_args={"csv_path": csv_path, "batch_size": batch_size},
+        )
+        << import_books
+    )
+
 
-    return action()
+def export(
+    fmt: ExportFormat,
+    pantry_id: str = "",
+    basket_id: str = None,
+    full: bool = False,
+    compress: bool = False,
+    write_path: Union[Path, str] = None,
+    **kwargs,
+) -> Outcome:
+    action = export_pantry if fmt == ExportFormat.PANTRY else export_file
+    pipeline = Pipeline(
+        initial_args={
+            "fmt": fmt,
+            "pantry_id": pantry_id,
+            "basket_id": basket_id,
+            "full": full,
+            "compress": compress,
+            "write_path": write_path,
+        }
+    )
+    return ~(pipeline << action)
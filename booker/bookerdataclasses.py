@@ -1,5 +1,16 @@
+import sys
 from enum import Enum
-from typing import TypedDict, List, NamedTuple, Callable, Any, Dict
+from typing import (
+    TypedDict,
+    List,
+    NamedTuple,
+    Callable,
+    Any,
+    Dict,
+    Tuple,
+    Iterator,
+    Optional,
+)
 
 from booker.control import Outcome
 
@@ -23,9 +34,17 @@ class Ordering(str, Enum):
     STATUS = "status"
 
 
+class Backend(str, Enum):
+    JSON = "json"
+    SQLITE = "sqlite"
+
+
 class ExportFormat(str, Enum):
     PANTRY = "pantry"
     YAML = "yaml"
+    CSV = "csv"
+    NDJSON = "ndjson"
+    PARQUET = "parquet"
 
 
 class Book(TypedDict):
@@ -39,6 +58,84 @@ class Book(TypedDict):
 
 BookList = List[Book]
 
+STATUSES = tuple(Status)
+STATUS_CODES = {status.value: code for code, status in enumerate(STATUSES)}
+
+
+class BookRecord:
+    """
+    compact in-memory form of a Book for long lived catalogs. author names are
+    interned, and statuses are stored as an index into STATUSES (statuses that
+    are not a known Status are kept as the raw string). convert to and from
+    the Book dict at the i/o boundary.
+    """
+
+    __slots__ = ("id", "isbn", "title", "author_fname", "author_lname", "status")
+
+    def __init__(self, id, isbn, title, author_fname, author_lname, status):
+        self.id = id
+        self.isbn = isbn
+        self.title = title
+        self.author_fname = author_fname
+        self.author_lname = author_lname
+        self.status = status
+
+    @classmethod
+    def from_book(cls, book: Book) -> "BookRecord":
+        return cls(
+            book["id"],
+            book["isbn"],
+            book["title"],
+            _intern(book["author_fname"]),
+            _intern(book["author_lname"]),
+            status_code(book["status"]),
+        )
+
+    def to_book(self) -> Book:
+        return Book(
+            id=self.id,
+            isbn=self.isbn,
+            title=self.title,
+            author_fname=self.author_fname,
+            author_lname=self.author_lname,
+            status=(
+                STATUSES[self.status].value if type(self.status) is int else self.status
+            ),
+        )
+
+
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if type(value) is str else value
+
+
+def status_code(status: str):
+    status = getattr(status, "value", status)
+    return STATUS_CODES.get(status, status)
+
+
+class OrderedBookList(list):
+    """a book list that the storage backend has already sorted by `ordering`."""
+
+    def __init__(self, books, ordering: Ordering):
+        super().__init__(books)
+        self.ordering = ordering
+
+
+class BookStream:
+    """books read lazily from the storage backend, already sorted by `ordering` if set."""
+
+    def __init__(self, books: Iterator[Book], ordering: Optional[Ordering] = None):
+        self.books = books
+        self.ordering = ordering
+
+    def __iter__(self) -> Iterator[Book]:
+        return iter(self.books)
+
+
+class ImportReport(NamedTuple):
+    imported: int
+    rejected: List[Tuple[int, str]]  # (csv line number, reason)
+
 
 class CurrentBook(NamedTuple):
     book: Book
@@ -0,0 +1,111 @@
+import csv
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+from booker.bookerdataclasses import Book, BookList, ImportReport, Status
+from booker.catalog import isbn_error
+from booker.control import outcome, Argument
+from booker.config import MissingConfigError
+from booker.database import storage
+from booker.error import EXISTENCE_ERROR, VALIDATION_ERROR
+
+DEFAULT_BATCH_SIZE = 1000
+REQUIRED_COLUMNS = ("title", "isbn", "author_fname", "author_lname")
+
+
+def read_rows(csv_path: Path) -> Iterator[Tuple[int, Dict[str, str]]]:
+    with Path(csv_path).open("r", newline="") as csv_file:
+        reader = csv.DictReader(csv_file)
+        columns = reader.fieldnames or ()
+        missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+        if missing:
+            raise ValueError(f"{csv_path} is missing the columns {', '.join(missing)}")
+        for row in reader:
+            yield reader.line_num, row
+
+
+def validate_row(row: Dict[str, str]) -> Book:
+    values = {key: (value or "").strip() for key, value in row.items() if key}
+    missing = [column for column in REQUIRED_COLUMNS if not values.get(column)]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    return Book(
+        isbn=values["isbn"],
+        title=values["title"],
+        author_fname=values["author_fname"],
+        author_lname=values["author_lname"],
+        status=Status(values.get("status") or Status.UNREAD),
+    )
+
+
+def parse_books(
+    rows: Iterable[Tuple[int, Dict[str, str]]], rejected: List[Tuple[int, str]]
+) -> Iterator[Tuple[int, Book]]:
+    for line, row in rows:
+        try:
+            yield line, validate_row(row)
+        except ValueError as e:
+            rejected.append((line, str(e)))
+
+
+def batched(books: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    books = iter(books)
+    while batch := list(islice(books, batch_size)):
+        yield batch
+
+
+def unique_books(
+    batch: List[Tuple[int, Book]],
+    known: Dict[str, int],
+    seen: Set[str],
+    rejected: List[Tuple[int, str]],
+) -> BookList:
+    """
+    the books in the batch whose isbn is neither known to be stored nor
+    already seen in this import, which are rejected instead.
+    """
+    books = []
+    for line, book in batch:
+        isbn = book["isbn"]
+        if isbn in known or isbn in seen:
+            rejected.append((line, str(isbn_error(isbn, known.get(isbn)))))
+            continue
+        seen.add(isbn)
+        books.append(book)
+    return books
+
+
+@outcome(
+    requires=(
+        "csv_path",
+        Argument("batch_size", optional=True),
+        Argument("db_path", optional=True),
+    ),
+    returns="import_report",
+    registers={
+        ValueError: VALIDATION_ERROR,
+        csv.Error: VALIDATION_ERROR,
+        MissingConfigError: EXISTENCE_ERROR,
+    },
+)
+def import_books(
+    csv_path: Path, batch_size: int = DEFAULT_BATCH_SIZE, db_path: Path = None
+) -> ImportReport:
+    if batch_size < 1:
+        raise ValueError("the batch size must be at least 1.")
+    store = storage(db_path)
+    imported = 0
+    rejected = []
+    seen = set()
+    for rows in batched(parse_books(read_rows(csv_path), rejected), batch_size):
+        # each batch is checked, given a contiguous block of ids and written in
+        # one locked write, so writers running alongside the import can neither
+        # take the same ids nor add the same isbns in between.
+        batch = store.insert(
+            [book for _, book in rows],
+            lambda books, known: unique_books(rows, known, seen, rejected),
+        )
+        imported += len(batch)
+    rejected.sort()
+    return ImportReport(imported, rejected)
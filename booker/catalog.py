@@ -0,0 +1,254 @@
+import os
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from functools import cached_property
+from itertools import islice
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from booker.bookerdataclasses import (
+    Book,
+    BookList,
+    BookRecord,
+    Ordering,
+    STATUSES,
+    Status,
+    status_code,
+)
+from booker.search import SearchIndex, terms_of
+
+MAX_CACHED_CATALOGS = 4
+
+
+def id_error(id: int) -> KeyError:
+    err_str = "include the --id flag." if id == -1 else f"there is no book with id {id}"
+    return KeyError(err_str)
+
+
+def isbn_error(isbn: str, id: Optional[int] = None) -> ValueError:
+    err_str = f"there is already a book with isbn {isbn}"
+    return ValueError(err_str if id is None else f"{err_str} (id {id})")
+
+
+def check_unique(books: BookList, known: Dict[str, int]) -> BookList:
+    """the books, unless one's isbn is already known or repeated within books."""
+    seen = dict(known)
+    for book in books:
+        isbn = book.get("isbn")
+        if not isbn:
+            continue
+        if isbn in seen:
+            raise isbn_error(isbn, seen[isbn])
+        seen[isbn] = book.get("id")
+    return books
+
+
+def sort_key(record: BookRecord, ordering: Ordering) -> Any:
+    """the key listbooks.lookup_ordering_key would sort the record's book by."""
+    if ordering is Ordering.AUTHOR:
+        return f"{record.author_lname}, {record.author_fname}"
+    if ordering is Ordering.STATUS and type(record.status) is int:
+        return STATUSES[record.status].value
+    return getattr(record, ordering.value)
+
+
+def record_terms(record: BookRecord) -> Set[str]:
+    return terms_of(record.title, record.author_fname, record.author_lname)
+
+
+def stat_fingerprint(path: Union[Path, int]) -> Optional[Hashable]:
+    # a path, or the descriptor of a file that is already open
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class Catalog:
+    """
+    the parsed book list held in memory as compact BookRecords, keyed by id in
+    file order. the isbn index and a sorted (key, id) index per Ordering are
+    built the first time they are needed and are kept up to date by every
+    change after that, so listing in any order is a walk rather than a sort.
+    the search index is built and maintained the same way.
+    books go in and come out as Book dicts; the dicts handed out are always
+    fresh, so callers are free to mutate them.
+    """
+
+    def __init__(self, book_list: Iterable[Book]):
+        self.by_id: Dict[int, BookRecord] = {
+            book["id"]: BookRecord.from_book(book) for book in book_list
+        }
+        self.orderings: Dict[Ordering, List[Tuple[Any, int]]] = {}
+        # the high-water mark for ids. it only ever goes up, so the id of a
+        # deleted book is never handed out again.
+        self.next_id = max(self.by_id, default=-1) + 1
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    @cached_property
+    def by_isbn(self) -> Dict[str, List[int]]:
+        by_isbn = {}
+        for record in self.by_id.values():
+            by_isbn.setdefault(record.isbn, []).append(record.id)
+        return by_isbn
+
+    @cached_property
+    def search_index(self) -> SearchIndex:
+        postings = {}
+        for record in self.by_id.values():
+            for term in record_terms(record):
+                postings.setdefault(term, []).append(record.id)
+        return SearchIndex(postings)
+
+    def ordered(self, ordering: Ordering) -> List[Tuple[Any, int]]:
+        ordering = Ordering(ordering)
+        if ordering not in self.orderings:
+            self.orderings[ordering] = sorted(
+                (sort_key(record, ordering), record.id)
+                for record in self.by_id.values()
+            )
+        return self.orderings[ordering]
+
+    def books(self, ordering: Optional[Ordering] = None) -> BookList:
+        return list(self.iter_books(ordering))
+
+    def iter_books(
+        self, ordering: Optional[Ordering] = None, offset: int = 0, limit: int = None
+    ) -> Iterator[Book]:
+        # iterate over a snapshot of the records so that writes made while the
+        # books are being consumed do not break the iteration.
+        stop = None if limit is None else offset + limit
+        if ordering:
+            records = [self.by_id[id] for _, id in self.ordered(ordering)[offset:stop]]
+        else:
+            records = list(islice(self.by_id.values(), offset, stop))
+        return (record.to_book() for record in records)
+
+    def get(self, id: int) -> Book:
+        return self._record(id).to_book()
+
+    def find_isbn(self, isbn: str) -> BookList:
+        return [self.by_id[id].to_book() for id in self.by_isbn.get(isbn, ())]
+
+    def search(self, query: str) -> BookList:
+        """the books matching every term of the query, in id order."""
+        return [
+            self.by_id[id].to_book() for id in sorted(self.search_index.search(query))
+        ]
+
+    def isbn_ids(self, isbns: Iterable[str]) -> Dict[str, int]:
+        """the id of the first book with each of these isbns that is catalogued."""
+        by_isbn = self.by_isbn
+        return {isbn: by_isbn[isbn][0] for isbn in isbns if isbn in by_isbn}
+
+    def add(self, books: Iterable[Book]) -> None:
+        for book in books:
+            record = BookRecord.from_book(book)
+            if record.id in self.by_id:
+                self._unindex(self.by_id[record.id])
+            self.by_id[record.id] = record
+            self._index(record)
+            self.next_id = max(self.next_id, record.id + 1)
+
+    def reserve(self, count: int) -> int:
+        """set aside the next `count` ids, returning the first of them."""
+        next_id = self.next_id
+        self.next_id += count
+        return next_id
+
+    def update_status(self, id: int, status: Status) -> Book:
+        record = self._record(id)
+        self._unindex(record, (Ordering.STATUS,))
+        record.status = status_code(status)
+        self._index(record, (Ordering.STATUS,))
+        return record.to_book()
+
+    def remove(self, id: int) -> Book:
+        record = self._record(id)
+        self._unindex(record)
+        del self.by_id[id]
+        return record.to_book()
+
+    def _record(self, id: int) -> BookRecord:
+        if id not in self.by_id:
+            raise id_error(id)
+        return self.by_id[id]
+
+    def _index(self, record: BookRecord, orderings: Iterable[Ordering] = None):
+        if orderings is None and "by_isbn" in self.__dict__:
+            self.by_isbn.setdefault(record.isbn, []).append(record.id)
+        if orderings is None and "search_index" in self.__dict__:
+            self.search_index.add(record.id, record_terms(record))
+        for ordering in self.orderings if orderings is None else orderings:
+            if ordering in self.orderings:
+                insort(
+                    self.orderings[ordering], (sort_key(record, ordering), record.id)
+                )
+
+    def _unindex(self, record: BookRecord, orderings: Iterable[Ordering] = None):
+        if orderings is None and "by_isbn" in self.__dict__:
+            ids = self.by_isbn[record.isbn]
+            ids.remove(record.id)
+            if not ids:
+                del self.by_isbn[record.isbn]
+        if orderings is None and "search_index" in self.__dict__:
+            self.search_index.remove(record.id, record_terms(record))
+        for ordering in self.orderings if orderings is None else orderings:
+            if ordering in self.orderings:
+                index = self.orderings[ordering]
+                del index[bisect_left(index, (sort_key(record, ordering), record.id))]
+
+
+class CatalogCache:
+    """
+    parsed catalogs kept for the life of the process, keyed by database path.
+    an entry is only served while the fingerprint of the files it was read from
+    (mtime_ns, size and inode) is unchanged, so writes from other processes
+    are picked up on the next read.
+    """
+
+    def __init__(self, maxsize: int = MAX_CACHED_CATALOGS):
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[Path, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: Path, fingerprint: Hashable) -> Optional[Catalog]:
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != fingerprint:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(path)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, path: Path, fingerprint: Hashable, catalog: Catalog) -> Catalog:
+        self.entries[path] = (fingerprint, catalog)
+        self.entries.move_to_end(path)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return catalog
+
+    def discard(self, path: Path) -> None:
+        self.entries.pop(path, None)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+
+CATALOG_CACHE = CatalogCache()
@@ -1,14 +1,19 @@
-from datetime import datetime
-from typing import Optional
+from pathlib import Path
+from typing import List, Optional, TYPE_CHECKING
 
 import typer
-from rich.console import Console
-from rich.table import Table
 from typer import Option
 
 from booker import __app_name__, __version__, database, booker
-from booker.booker import update_status, delete_book, export
-from booker.bookerdataclasses import Status, Ordering, ExportFormat
+from booker.booker import update_status, delete_book, export, bulk_import
+from booker.bulk import DEFAULT_BATCH_SIZE
+from booker.control import Profiler
+from booker.bookerdataclasses import Status, Ordering, ExportFormat, Backend
+
+if TYPE_CHECKING:
+    # rich is imported when a table is rendered, not when the cli starts.
+    from rich.console import Console
+    from rich.table import Table
 
 app = typer.Typer()
 export_app = typer.Typer()  # nested sub app for export commands
@@ -25,20 +30,26 @@ def init(
         "-db",
         prompt="book database location?",
     ),
+    backend: Backend = Option(Backend.JSON, help="storage backend for the database."),
 ) -> None:
     """Initialize the reading list."""
-    booker.init(db_path)
+    booker.init(db_path, backend)
 
 
 @app.command()
-def update(id: int = Option(-1), status: Status = Option(Status.FINISHED)) -> None:
-    """Update a book's status in the reading list."""
+def update(
+    id: List[int] = Option([], help="A book to update. Repeat it to update several."),
+    status: Status = Option(Status.FINISHED),
+) -> None:
+    """Update the status of books in the reading list."""
     update_status(id, status)
 
 
 @app.command()
-def delete(id: int = Option(-1)) -> None:
-    """Delete a book from the reading list."""
+def delete(
+    id: List[int] = Option([], help="A book to delete. Repeat it to delete several.")
+) -> None:
+    """Delete books from the reading list."""
     delete_book(id)
 
 
@@ -54,22 +65,98 @@ def add(
     booker.add(**locals())
 
 
+@app.command()
+def get(isbn: str = Option(..., help="The isbn of the book to show.")) -> None:
+    """Show the book with the given isbn."""
+    from rich.console import Console
+
+    header, body = booker.get_book(isbn).get_key("table_args")
+    Console().print(_table(header, body))
+
+
+@app.command()
+def search(
+    terms: List[str] = typer.Argument(..., help="Words from a title or author.")
+) -> None:
+    """Show the books whose title or author contains every one of the terms."""
+    from rich.console import Console
+
+    header, body = booker.search(" ".join(terms)).get_key("table_args")
+    if len(body) == 0:
+        typer.secho("No books match the search", fg=typer.colors.RED)
+        raise typer.Exit()
+    Console().print(_table(header, body))
+
+
+# rows taken up by the table borders, the header and the "more" prompt
+PAGE_CHROME = 5
+
+
 @app.command(name="list")
-def list_all(ordering: Ordering = Option(Ordering.DEFAULT)) -> None:
+def list_all(
+    ordering: Ordering = Option(Ordering.DEFAULT),
+    limit: Optional[int] = Option(None, help="Show at most this many books."),
+    offset: int = Option(0, help="Skip this many books first."),
+    lazy: bool = Option(False, help="Fetch and render one screen at a time."),
+) -> None:
     """List all the books in the reading list in the order specified by Ordering. Defaults to ID sorting."""
-    header, body = booker.get_list(ordering).get_key("table_args")
+    from rich.console import Console
+
+    console = Console()
+    if lazy:
+        _list_pages(console, ordering, limit, offset)
+        return
 
+    header, body = booker.get_list(ordering, limit, offset).get_key("table_args")
     if len(body) == 0:
-        typer.secho("There are no books in the reading list yet", fg=typer.colors.RED)
-        raise typer.Exit()
+        _no_books(offset)
+
+    with console.pager():
+        console.print(_table(header, body))
+
+
+def _list_pages(
+    console: "Console", ordering: Ordering, limit: Optional[int], offset: int
+) -> None:
+    # every screen is its own query, so the first rows show up as soon as one
+    # page has been read and formatted, however large the reading list is.
+    page_size = max(console.height - PAGE_CHROME, 1)
+    shown = 0
+    while limit is None or shown < limit:
+        size = page_size if limit is None else min(page_size, limit - shown)
+        header, body = booker.get_list(ordering, size, offset + shown).get_key(
+            "table_args"
+        )
+        if len(body) == 0:
+            break
+        console.print(_table(header, body))
+        shown += len(body)
+        if len(body) < size:
+            break
+        if (
+            console.is_terminal
+            and console.input("[dim]more? (q to quit)[/dim] ") == "q"
+        ):
+            break
+    if shown == 0:
+        _no_books(offset)
+
+
+def _table(header, body) -> "Table":
+    from rich.table import Table
 
     table = Table(*header)
     for row in body:
         table.add_row(*row)
+    return table
 
-    console = Console()
-    with console.pager():
-        console.print(table)
+
+def _no_books(offset: int) -> None:
+    if offset == 0:
+        typer.secho("There are no books in the reading list yet", fg=typer.colors.RED)
+    else:
+        typer.secho(f"There are no books after the first {offset}", fg=typer.colors.RED)
+    raise typer.Exit()
 
 
 def _version(version_flag: bool) -> None:
@@ -80,6 +167,7 @@ def _version(version_flag: bool) -> None:
 
 @app.callback()
 def main(
+    ctx: typer.Context,
     version: Optional[bool] = Option(
         None,
         "--version",
@@ -87,23 +175,86 @@ def main(
         help="Show the application's version then exit.",
         callback=_version,
         is_eager=True,
-    )
+    ),
+    profile: bool = Option(
+        False, help="Print the time and memory spent in each pipeline stage."
+    ),
+    profile_trace: Optional[Path] = Option(
+        None, help="Write the pipeline stage timings to this chrome trace file."
+    ),
 ) -> None:
-    return
+    if profile or profile_trace:
+        profiler = Profiler().start()
+        ctx.call_on_close(lambda: _report_profile(profiler, profile, profile_trace))
+
+
+def _report_profile(
+    profiler: Profiler, profile: bool, profile_trace: Optional[Path]
+) -> None:
+    profiler.stop()
+    if profile:
+        typer.echo(profiler.report(), err=True)
+    if profile_trace:
+        profiler.write_chrome_trace(profile_trace)
+
+
+def _output(fmt: ExportFormat):
+    return Option(
+        str(Path.home() / f"book_export.{fmt.value}"),
+        "--output",
+        "-o",
+        help="The file to write, or - for stdout.",
+    )
 
 
 @export_app.command()
-def yaml():
-    """Export the reading list to $HOME/book_export.yaml"""
-    export(ExportFormat.YAML)
+def yaml(output: str = _output(ExportFormat.YAML)):
+    """Export the reading list as yaml, to $HOME/book_export.yaml by default."""
+    export(ExportFormat.YAML, write_path=output)
+
+
+@export_app.command()
+def csv(output: str = _output(ExportFormat.CSV)):
+    """Export the reading list as csv, to $HOME/book_export.csv by default."""
+    export(ExportFormat.CSV, write_path=output)
+
+
+@export_app.command()
+def ndjson(output: str = _output(ExportFormat.NDJSON)):
+    """Export the reading list as one json book per line, to $HOME/book_export.ndjson by default."""
+    export(ExportFormat.NDJSON, write_path=output)
+
+
+@export_app.command()
+def parquet(output: str = _output(ExportFormat.PARQUET)):
+    """Export the reading list as parquet, to $HOME/book_export.parquet by default. Needs pyarrow."""
+    export(ExportFormat.PARQUET, write_path=output)
 
 
 @export_app.command()
 def pantry(
     pantry_id: str = Option(""),
-    basket_id: str = Option(
-        lambda: f'book_export_{datetime.now().strftime("%Y-%m-%d_%H:%M:%S")}.json'
+    basket_id: Optional[str] = Option(
+        None,
+        help="Defaults to the basket of the last export, or a new timestamped one.",
+    ),
+    full: bool = Option(
+        False, help="Upload the whole reading list, not just what changed."
+    ),
+    gzip: bool = Option(
+        False, help="Compress the upload. Only for endpoints that accept gzip bodies."
     ),
 ):
     """Export the reading list to Pantry."""
-    export(ExportFormat.PANTRY, pantry_id, basket_id)
+    export(ExportFormat.PANTRY, pantry_id, basket_id, full, gzip)
+
+
+@bulk_app.command(name="import")
+def import_csv(
+    csv_file: Path = typer.Argument(..., exists=True, dir_okay=False),
+    batch_size: int = Option(
+        DEFAULT_BATCH_SIZE, help="number of books written to the database at once."
+    ),
+):
+    """Add books from a csv file with title, isbn, author_fname, author_lname and status columns."""
+    bulk_import(csv_file, batch_size)
@@ -0,0 +1,109 @@
+import json
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Optional, Union
+
+
+UNESCAPED = re.compile("[\x7f-\U0010ffff]")
+
+
+def _escape(match: re.Match) -> str:
+    code = ord(match.group())
+    if code > 0xFFFF:
+        code -= 0x10000
+        return "\\u%04x\\u%04x" % (0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+    return "\\u%04x" % code
+
+
+def ensure_ascii(data: bytes) -> bytes:
+    """escape the characters json.dumps escapes and the native encoders do not."""
+    if data.isascii() and b"\x7f" not in data:
+        return data
+    return UNESCAPED.sub(_escape, data.decode()).encode()
+
+
+class Codec(ABC):
+    """
+    encodes and decodes the json that booker reads and writes. every codec
+    writes byte for byte the same documents: compact output has no whitespace
+    and indented output matches json.dumps(..., indent=2). decode errors are
+    always raised as json.JSONDecodeError.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def loads(self, data: Union[bytes, str]) -> Any:
+        pass
+
+    @abstractmethod
+    def dumps(self, obj: Any, indent: bool = False) -> bytes:
+        pass
+
+
+class StdlibCodec(Codec):
+    name = "json"
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+    def dumps(self, obj: Any, indent: bool = False) -> bytes:
+        if indent:
+            return json.dumps(obj, indent=2).encode()
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+
+class OrjsonCodec(Codec):
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self.orjson = orjson
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        # orjson.JSONDecodeError is already a subclass of json.JSONDecodeError
+        return self.orjson.loads(data)
+
+    def dumps(self, obj: Any, indent: bool = False) -> bytes:
+        option = self.orjson.OPT_INDENT_2 if indent else 0
+        return ensure_ascii(self.orjson.dumps(obj, option=option))
+
+
+class MsgspecCodec(Codec):
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+
+        self.msgspec = msgspec
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder()
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        try:
+            return self.decoder.decode(data)
+        except self.msgspec.DecodeError as e:
+            raise json.JSONDecodeError(str(e), "", 0) from e
+
+    def dumps(self, obj: Any, indent: bool = False) -> bytes:
+        data = self.encoder.encode(obj)
+        data = self.msgspec.json.format(data, indent=2) if indent else data
+        return ensure_ascii(data)
+
+
+CODECS = {codec.name: codec for codec in (OrjsonCodec, MsgspecCodec, StdlibCodec)}
+
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    """the named codec, or the fastest one installed when no name is given."""
+    if name:
+        return CODECS[name]()
+    for codec in CODECS.values():
+        try:
+            return codec()
+        except ImportError:
+            continue
+
+
+CODEC = get_codec()
@@ -1,5 +1,7 @@
 import configparser
+import os
 from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Tuple, Hashable
 import typer
 from booker import __app_name__
 from booker.error import (
@@ -8,7 +10,23 @@ from booker.error import (
     EXISTENCE_ERROR,
     DB_WRITE_ERROR,
 )
-from booker.control import Outcome, SUCCESS, outcome, Argument, Pipeline
+from booker.bookerdataclasses import Backend
+from booker.catalog import stat_fingerprint
+from booker.codec import CODEC, Codec, get_codec
+from booker.control import (
+    Outcome,
+    SUCCESS,
+    outcome,
+    Argument,
+    Pipeline,
+    StageCache,
+    fail_stage,
+)
+from booker.storage import open_storage
+
+# the database to use, instead of the one in config.ini. the config file is
+# then never looked for or read, and the backend is detected from the file.
+DATABASE_ENV_VAR = "BOOKER_DATABASE"
 
 
 def config_dir_path(path: Path) -> Path:
@@ -17,11 +35,87 @@ def config_dir_path(path: Path) -> Path:
     return Path(typer.get_app_dir(__app_name__))
 
 
-@outcome(requires=(Argument("path", optional=True),), returns="config_file")
+# every command looks the config file up, some of them several times. the
+# default app dir is worked out once per process, like the settings it names.
+@outcome(
+    requires=(Argument("path", optional=True),),
+    returns="config_file",
+    cache=StageCache(maxsize=8),
+)
 def config_file_path(path: Path = None) -> Path:
     return config_dir_path(path) / "config.ini"
 
 
+class Settings(NamedTuple):
+    database: Path
+    backend: Optional[Backend] = None
+    codec: Codec = CODEC
+    compact: bool = False
+
+    @property
+    def storage_options(self) -> Dict[str, Any]:
+        return {"codec": self.codec, "compact": self.compact}
+
+
+class MissingConfigError(FileNotFoundError):
+    """there is no config file, or it does not name a database."""
+
+    def __init__(self, config_file: Path):
+        super().__init__(
+            f"config file {config_file} does not exist. run `{__app_name__} init`"
+        )
+
+
+def read_settings(config_file: Path) -> Settings:
+    config_parser = configparser.ConfigParser()
+    if not config_parser.read(config_file) or "General" not in config_parser:
+        raise MissingConfigError(config_file)
+    general = config_parser["General"]
+    backend, codec = general.get("backend"), general.get("codec")
+    return Settings(
+        Path(general["database"]),
+        Backend(backend) if backend else None,
+        get_codec(codec) if codec else CODEC,
+        general.getboolean("compact", fallback=False),
+    )
+
+
+class SettingsCache:
+    """
+    the settings from config.ini, read once per process and read again only
+    when the file's fingerprint (mtime_ns, size and inode) changes. setting
+    BOOKER_DATABASE skips the config file altogether.
+    """
+
+    def __init__(self):
+        self.entry: Optional[Tuple[Path, Hashable, Settings]] = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, config_file: Path = None) -> Settings:
+        database = os.environ.get(DATABASE_ENV_VAR)
+        if database:
+            return Settings(Path(database))
+        if config_file is None:
+            config_file = config_file_path(None)
+        fingerprint = stat_fingerprint(config_file)
+        if self.entry and self.entry[:2] == (config_file, fingerprint):
+            self.hits += 1
+            return self.entry[2]
+        self.misses += 1
+        settings = read_settings(config_file)
+        if fingerprint is not None:
+            self.entry = config_file, fingerprint, settings
+        return settings
+
+    def clear(self) -> None:
+        self.entry = None
+        self.hits = self.misses = 0
+
+
+SETTINGS = SettingsCache()
+
+
 @outcome(
     requires=(Argument("path", optional=True),),
     returns="config_file",
@@ -32,23 +126,40 @@ def config_file_exists(path: Path = None, **kwargs) -> Outcome:
     if config_file_path(path).exists():
         return config_file_path(path)
     else:
-        err_str = f"config file {config_file_path(path)} does not exist. run `{__app_name__} init`"
-        raise FileNotFoundError(err_str)
+        raise MissingConfigError(config_file_path(path))
 
 
-@outcome(requires=("db_path", Argument("config_dir", optional=True)))
-def init_app(db_path: Path, config_dir: Path = None) -> Outcome:
+@outcome(
+    requires=(
+        "db_path",
+        Argument("config_dir", optional=True),
+        Argument("backend", optional=True),
+    )
+)
+def init_app(
+    db_path: Path, config_dir: Path = None, backend: Backend = Backend.JSON
+) -> Outcome:
     return ~(
-        Pipeline(initial_args={"db_path": db_path, "config_dir": config_dir})
+        Pipeline(
+            error_handler=fail_stage,
+            initial_args={
+                "db_path": db_path,
+                "config_dir": config_dir,
+                "backend": backend,
+            },
+        )
         << init_config_file
         << _add_database_config
         << init_database
     )
 
 
-@outcome(requires=("db_path",), registers={OSError: DB_WRITE_ERROR})
-def init_database(db_path: Path) -> None:
-    db_path.write_text("[]")
+@outcome(
+    requires=("db_path", Argument("backend", optional=True)),
+    registers={OSError: DB_WRITE_ERROR},
+)
+def init_database(db_path: Path, backend: Backend = Backend.JSON) -> None:
+    open_storage(db_path, backend).create()
 
 
 @outcome(
@@ -61,12 +172,21 @@ def init_config_file(config_path: Path = None) -> None:
 
 
 @outcome(
-    requires=("db_path", Argument("config_path", optional=True)),
+    requires=(
+        "db_path",
+        Argument("config_path", optional=True),
+        Argument("backend", optional=True),
+    ),
     returns="",
     registers={OSError: CONFIG_FILE_ERROR},
 )
-def _add_database_config(db_path: Path, config_dir: Path = None) -> None:
+def _add_database_config(
+    db_path: Path, config_dir: Path = None, backend: Backend = Backend.JSON
+) -> None:
     config_parser = configparser.ConfigParser()
-    config_parser["General"] = {"database": db_path}
+    config_parser["General"] = {
+        "database": db_path,
+        "backend": Backend(backend).value,
+    }
     with config_file_path(config_dir).open("w") as file:
         config_parser.write(file)
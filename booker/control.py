@@ -1,10 +1,39 @@
 import functools
+import json
+import threading
+import time
+import tracemalloc
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Callable, List, Tuple, Union
+from collections import ChainMap, OrderedDict
+from concurrent.futures import (
+    Executor,
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from pathlib import Path
+from typing import (
+    Dict,
+    Any,
+    Callable,
+    List,
+    Tuple,
+    Union,
+    NamedTuple,
+    Optional,
+    Set,
+    Collection,
+    Hashable,
+)
 
 import typer
 import inspect
 
+
 # this is just an "Either", but I prefer the name Outcome as it reads much better
 class Outcome(ABC):
     def __init__(
@@ -52,6 +81,175 @@ def default_error_handler(outcome: Outcome) -> None:
         raise typer.Exit(1)
 
 
+class StageFailed(Exception):
+    """a pipeline run inside a stage failed, with this outcome."""
+
+    def __init__(self, outcome: Outcome):
+        super().__init__(str(outcome))
+        self.outcome = outcome
+
+
+def fail_stage(outcome: Outcome) -> None:
+    """
+    the error handler for a pipeline run inside a stage. the stage fails with
+    the pipeline's outcome, which the outer pipeline then reports, once.
+    """
+    if outcome.failed():
+        raise StageFailed(outcome)
+
+
+class StageRecord(NamedTuple):
+    name: str
+    depth: int
+    start: float  # seconds since the profiler started
+    wall: float  # seconds
+    cpu: float  # seconds
+    peak: int  # bytes allocated above the stage's starting point, at most
+
+
+class Profiler:
+    """
+    records the wall time, cpu time and tracemalloc peak of every pipeline stage
+    run while it is active. pipelines started from inside a stage (init_app,
+    export_yaml, ...) are recorded one level deeper, so a stage's numbers
+    include the pipelines it runs.
+    """
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.records: List[StageRecord] = []
+        self._stack: List[Dict[str, Any]] = []
+        self._origin = 0.0
+        self._token = None
+        self._started_tracing = False
+
+    def start(self) -> "Profiler":
+        self._origin = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._token = ACTIVE_PROFILER.set(self)
+        return self
+
+    def stop(self) -> "Profiler":
+        if self._token is not None:
+            ACTIVE_PROFILER.reset(self._token)
+            self._token = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return self
+
+    def __enter__(self) -> "Profiler":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    @contextmanager
+    def stage(self, name: str):
+        frame = {"peak": 0, "memory": 0}
+        if self.trace_memory:
+            memory, peak = tracemalloc.get_traced_memory()
+            # resetting the peak for this stage loses the enclosing stage's
+            # peak so far, so hold on to it in the enclosing frame.
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            frame["memory"] = memory
+        depth = len(self._stack)
+        self._stack.append(frame)
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu_start
+            # stages of an AsyncPipeline can finish out of order
+            self._stack.remove(frame)
+            if self.trace_memory:
+                frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            self.records.append(
+                StageRecord(
+                    name,
+                    depth,
+                    start - self._origin,
+                    wall,
+                    cpu,
+                    max(frame["peak"] - frame["memory"], 0),
+                )
+            )
+
+    def report(self) -> str:
+        lines = [f"{'stage':<40}{'wall ms':>10}{'cpu ms':>10}{'peak KiB':>10}"]
+        # records are appended as stages finish, so sort by start time to
+        # print each stage above the stages nested inside it.
+        for record in sorted(self.records, key=lambda r: r.start):
+            name = "  " * record.depth + record.name
+            lines.append(
+                f"{name:<40}{record.wall * 1e3:>10.2f}{record.cpu * 1e3:>10.2f}"
+                f"{record.peak / 1024:>10.1f}"
+            )
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """the records as complete events for chrome://tracing or perfetto."""
+        return {
+            "traceEvents": [
+                {
+                    "name": record.name,
+                    "ph": "X",
+                    "ts": record.start * 1e6,
+                    "dur": record.wall * 1e6,
+                    "pid": 1,
+                    "tid": 1,
+                    "args": {"cpu_ms": record.cpu * 1e3, "peak_bytes": record.peak},
+                }
+                for record in self.records
+            ]
+        }
+
+    def write_chrome_trace(self, path: Path) -> None:
+        Path(path).write_text(json.dumps(self.chrome_trace()))
+
+
+ACTIVE_PROFILER: ContextVar[Optional[Profiler]] = ContextVar(
+    "active_profiler", default=None
+)
+
+
+def call_stage(action: Callable[..., "Outcome"], scope: Dict[str, Any]) -> "Outcome":
+    # @outcome stages pick their arguments out of the scope themselves, which
+    # saves expanding the whole scope into keyword arguments.
+    if hasattr(action, "from_context"):
+        return action.from_context(scope)
+    return action(**scope)
+
+
+def run_stage(action: Callable[..., "Outcome"], scope: Dict[str, Any]) -> "Outcome":
+    profiler = ACTIVE_PROFILER.get()
+    if profiler is None:
+        return call_stage(action, scope)
+    with profiler.stage(getattr(action, "__name__", repr(action))):
+        return call_stage(action, scope)
+
+
+async def run_stage_async(
+    action: Callable[..., "Outcome"], scope: Dict[str, Any]
+) -> "Outcome":
+    import asyncio  # only async pipelines need it, so keep it off the cli's startup
+
+    if not inspect.iscoroutinefunction(action):
+        # the worker thread runs in a copy of this context, so it sees the
+        # active profiler.
+        return await asyncio.to_thread(run_stage, action, scope)
+    profiler = ACTIVE_PROFILER.get()
+    if profiler is None:
+        return await call_stage(action, scope)
+    with profiler.stage(getattr(action, "__name__", repr(action))):
+        return await call_stage(action, scope)
+
+
 class Pipeline:
     def __init__(
         self,
@@ -64,9 +262,8 @@ class Pipeline:
         self.error_handler = error_handler
         self.finalizer = finalizer
         self.pending: List[Tuple[Callable[[Any], Outcome], Dict[str, Any]]] = []
-        self.initial_args = initial_args
         self.completed: List[Outcome] = [
-            SUCCESS(self.initial_args)
+            SUCCESS(dict(self.initial_args))
         ]  # always begin with the minimal context
         self.executed: bool = False
         self.success: bool = False
@@ -74,14 +271,19 @@ class Pipeline:
     def execute(self) -> Outcome:
         if self.executed:
             return self.completed[-1]
-        for i, thunk in enumerate(self.pending):
-            prev_context = self.completed[i].get_context()
-            action, args = thunk
-            # expand the argument to the next call with the context from the previous call
-            args = {**prev_context, **args}
-            outcome = action(**args)
-            # update the context of the outcome so that arguments are propagated
-            outcome.context = {**outcome.context, **args}
+        # every stage reads from and writes to the one scope rather than a copy
+        # of everything before it, so the cost of a stage does not depend on how
+        # much context the pipeline has built up. the outcomes all share it.
+        scope = self.completed[0].get_context()
+        for action, args in self.pending:
+            # arguments given to a stage override the context from previous calls
+            scope.update(args)
+            outcome = run_stage(action, scope)
+            # what the stage returned is propagated, without replacing the
+            # arguments it was called with
+            for key, value in outcome.context.items():
+                scope.setdefault(key, value)
+            outcome.context = scope
             self.completed.append(outcome)
             if outcome.failed():
                 # if the action fails, run the error handler.
@@ -93,6 +295,9 @@ class Pipeline:
                     self.executed = True
                     self.success = False
                     return outcome
+        return self.finalize()
+
+    def finalize(self) -> Outcome:
         if self.finalizer:
             if self.finalizer.__code__.co_argcount == 1:
                 self.finalizer(self.completed[-1])
@@ -119,6 +324,224 @@ class Pipeline:
         return self.execute()
 
 
+class AsyncPipeline(Pipeline):
+    """
+    a Pipeline that runs on asyncio. each stage waits only for the earlier
+    stages that return something it requires (see stage_dependencies), so
+    independent stages run concurrently. coroutine stages are awaited and
+    regular stages run in a worker thread, so a blocking stage like an http
+    upload does not hold up the others. the outcome is that of the last stage
+    added, as with Pipeline. use it with `await ~pipeline`.
+    """
+
+    async def execute(self) -> Outcome:
+        import asyncio
+
+        if self.executed:
+            return self.completed[-1]
+        scope = self.completed[0].get_context()
+        dependencies = stage_dependencies(self.pending, scope)
+        outcomes: List[Optional[Outcome]] = [None] * len(self.pending)
+        tasks: List[asyncio.Task] = []
+
+        async def run(i: int) -> Outcome:
+            await asyncio.gather(*(tasks[j] for j in dependencies[i]))
+            action, args = self.pending[i]
+            # a stage's own arguments apply to it without touching the scope
+            # the stages running alongside it read from.
+            outcome = await run_stage_async(action, ChainMap(args, scope))
+            scope.update(args)
+            for key, value in outcome.context.items():
+                scope.setdefault(key, value)
+            outcome.context = scope
+            outcomes[i] = outcome
+            return outcome
+
+        for i in range(len(self.pending)):
+            tasks.append(asyncio.ensure_future(run(i)))
+        try:
+            for finished in asyncio.as_completed(tasks):
+                outcome = await finished
+                if outcome.failed():
+                    if self.error_handler:
+                        self.error_handler(outcome)
+                    else:
+                        self.completed.extend(o for o in outcomes if o is not None)
+                        self.executed = True
+                        self.success = False
+                        return outcome
+        finally:
+            for task in tasks:
+                task.cancel()
+        self.completed.extend(outcomes)
+        return self.finalize()
+
+
+def stage_dependencies(
+    pending: List[Tuple[Callable[..., Outcome], Dict[str, Any]]],
+    initial: Collection[str] = (),
+) -> List[Set[int]]:
+    """
+    the indexes of the earlier stages each stage has to wait for: the stage
+    that provides each key it requires, and any earlier stage that provides one
+    of the keys it provides, so the scope ends up as Pipeline would leave it.
+    a stage that is not an @outcome declares nothing, so it waits for every
+    stage before it and every stage after it waits for it.
+    """
+    providers: Dict[str, int] = {}
+    barrier: Optional[int] = None
+    dependencies = []
+    for i, (action, args) in enumerate(pending):
+        requires = getattr(action, "requires", None)
+        if requires is None:
+            dependencies.append(set(range(i)))
+            barrier = i
+            continue
+        needs = {providers[arg.key] for arg in requires if arg.key in providers}
+        # values already in the scope are never replaced by a returned value,
+        # while a stage's own arguments always replace them.
+        provides = [action.returns] if action.returns not in initial else []
+        for key in [*provides, *args]:
+            if key in providers:
+                needs.add(providers[key])
+        for key in provides:
+            providers.setdefault(key, i)
+        for key in args:
+            providers[key] = i
+        if barrier is not None:
+            needs.add(barrier)
+        needs.discard(i)
+        dependencies.append(needs)
+    return dependencies
+
+
+class GraphError(ValueError):
+    """the stages given to a DagPipeline cannot be scheduled."""
+
+
+class DagPipeline(Pipeline):
+    """
+    a Pipeline whose stages are scheduled from what they require and return
+    rather than from the order they were added in. the graph is checked before
+    anything runs, then every stage whose inputs are ready is handed to the
+    executor: a ThreadPoolExecutor by default, or a ProcessPoolExecutor for cpu
+    bound stages, in which case the stages and the values they exchange have to
+    be picklable. arguments given to a stage with `+` apply to that stage only.
+    the outcome is that of the last stage added, as with Pipeline.
+    """
+
+    def __init__(self, *, executor: Executor = None, **kwargs):
+        super().__init__(**kwargs)
+        self.executor = executor
+
+    def validate(self) -> List[Set[int]]:
+        """the stages each stage waits for, or a GraphError if they cannot run."""
+        return stage_graph(self.pending, self.completed[0].get_context())
+
+    def execute(self) -> Outcome:
+        if self.executed:
+            return self.completed[-1]
+        dependencies = self.validate()
+        if self.executor is None:
+            with ThreadPoolExecutor() as executor:
+                return self._run(executor, dependencies)
+        return self._run(self.executor, dependencies)
+
+    def _run(self, executor: Executor, dependencies: List[Set[int]]) -> Outcome:
+        scope = self.completed[0].get_context()
+        waiting = {i: set(needs) for i, needs in enumerate(dependencies)}
+        outcomes: List[Optional[Outcome]] = [None] * len(self.pending)
+        running: Dict[Future, int] = {}
+        try:
+            while waiting or running:
+                for i in [i for i, needs in waiting.items() if not needs]:
+                    del waiting[i]
+                    running[self._submit(executor, i, scope)] = i
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    outcome = future.result()
+                    for key, value in outcome.context.items():
+                        scope.setdefault(key, value)
+                    outcome.context = scope
+                    outcomes[i] = outcome
+                    for needs in waiting.values():
+                        needs.discard(i)
+                    if outcome.failed():
+                        if self.error_handler:
+                            self.error_handler(outcome)
+                        else:
+                            self.completed.extend(o for o in outcomes if o)
+                            self.executed = True
+                            self.success = False
+                            return outcome
+        finally:
+            for future in running:
+                future.cancel()
+        self.completed.extend(outcomes)
+        return self.finalize()
+
+    def _submit(self, executor: Executor, i: int, scope: Dict[str, Any]) -> Future:
+        action, args = self.pending[i]
+        # only send what the stage reads, which keeps what a process pool has
+        # to pickle small.
+        context = {
+            arg.key: scope[arg.key] for arg in action.requires if arg.key in scope
+        }
+        context.update(args)
+        if isinstance(executor, ProcessPoolExecutor):
+            return executor.submit(run_stage, action, context)
+        # worker threads do not inherit context variables, like the profiler
+        return executor.submit(copy_context().run, run_stage, action, context)
+
+
+def stage_graph(
+    pending: List[Tuple[Callable[..., Outcome], Dict[str, Any]]],
+    initial: Collection[str] = (),
+) -> List[Set[int]]:
+    """
+    the indexes of the stages each stage waits for, whatever order they were
+    added in: the stage that returns each key it requires. raises a GraphError
+    if a stage declares nothing, two stages return the same key, a required key
+    is never provided, or the stages depend on each other in a cycle.
+    """
+    providers: Dict[str, int] = {}
+    for i, (action, _) in enumerate(pending):
+        if getattr(action, "requires", None) is None:
+            raise GraphError(f"{action!r} is not an @outcome stage")
+        if not action.returns or action.returns in initial:
+            continue
+        if action.returns in providers:
+            other = pending[providers[action.returns]][0]
+            raise GraphError(
+                f"{other.__name__} and {action.__name__} both return {action.returns}"
+            )
+        providers[action.returns] = i
+    dependencies = []
+    for action, args in pending:
+        needs = set()
+        for arg in action.requires:
+            if arg.key in args or arg.key in initial:
+                continue
+            if arg.key in providers:
+                needs.add(providers[arg.key])
+            elif not (arg.optional or arg.use_default):
+                raise GraphError(f"nothing provides {arg.key} for {action.__name__}")
+        dependencies.append(needs)
+    # kahn's algorithm: whatever cannot be ordered is part of a cycle
+    remaining = {i: set(needs) for i, needs in enumerate(dependencies)}
+    while remaining:
+        ready = [i for i, needs in remaining.items() if not needs]
+        if not ready:
+            names = sorted(pending[i][0].__name__ for i in remaining)
+            raise GraphError(f"these stages depend on each other: {', '.join(names)}")
+        for i in ready:
+            del remaining[i]
+        for needs in remaining.values():
+            needs.difference_update(ready)
+    return dependencies
+
+
 class SUCCESS(Outcome):
     def __init__(self, context: Dict[str, Any] = {}):
         super().__init__("success", "", context)
@@ -161,42 +584,169 @@ class Argument:
         return None
 
 
+def argument_key(arguments: Dict[str, Any]) -> Hashable:
+    # hashable arguments are compared by value and anything else by identity
+    key = []
+    for name, value in sorted(arguments.items()):
+        try:
+            hash(value)
+        except TypeError:
+            value = (id, id(value))
+        key.append((name, value))
+    return tuple(key)
+
+
+class StageCache:
+    """
+    what a pure @outcome stage returned, by the arguments it was called with.
+    the least recently used entries are evicted past maxsize, and only values
+    are cached, never errors. by default the key is argument_key; pass key= to
+    build it some other way, e.g. from the fingerprint of a file the stage
+    reads. a stage keyed by identity must not have its arguments mutated.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 128,
+        key: Callable[[Dict[str, Any]], Hashable] = argument_key,
+    ):
+        self.maxsize = maxsize
+        self.key = key
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def wrap(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def cached(**kwargs):
+            key = self.key(kwargs)
+            with self._lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+            value = func(**kwargs)
+            with self._lock:
+                # the arguments are kept with the value so that the objects an
+                # identity key refers to stay alive, and their ids unique.
+                self.entries[key] = (value, kwargs)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+            return value
+
+        return cached
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+
 def outcome(
-    *, requires: Tuple[Union[Argument, str], ...] = None, returns=None, registers=None
+    *,
+    requires: Tuple[Union[Argument, str], ...] = None,
+    returns=None,
+    registers=None,
+    cache: Union[bool, StageCache] = None,
 ):
     requires = () if requires is None else requires
     returns = "" if returns is None else returns
     registers = {} if registers is None else registers
+    cache = StageCache() if cache is True else cache or None
 
     def outcome_shell(func):
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-
-            # if the function is called with arguments, then treat it as a regular function call.
-            calling_file = inspect.currentframe().f_back.f_code.co_name
-            # this has a very weird edge case with functions that have one default argument.
-            if len(args) > 0:
-                return func(*args)
-
+        raw_func = func
+        if cache is not None and inspect.iscoroutinefunction(func):
+            raise TypeError("coroutine stages cannot be cached")
+        if cache is not None:
+            func = cache.wrap(raw_func)
+            signature = inspect.signature(raw_func)
+        # resolve everything about the arguments once, so a call is a handful of
+        # dict lookups: (key, value used when the key is missing).
+        bindings = tuple(
+            (arg.key, arg.default if arg.use_default else None) for arg in requires
+        )
+
+        def handler_for(e: Exception) -> Callable[[Exception], Outcome]:
+            for cls in type(e).__mro__:
+                if cls in registers:
+                    return registers[cls]
+            return GenericError
+
+        def bind(context: Dict[str, Any]) -> Dict[str, Any]:
             new_args = {}
-            for arg in requires:
-                val = arg.get(kwargs)
+            for key, missing in bindings:
+                val = context.get(key, missing)
                 if val is not None:
-                    new_args[arg.key] = val
-            try:
-                temp = func(**new_args)
-            except Exception as e:
-                if e in registers.keys():
-                    handler = registers[type(e)]
-                else:
-                    handler = GenericError
-                return handler(e)
+                    new_args[key] = val
+            return new_args
+
+        def succeed(temp: Any) -> Outcome:
             if returns == "":
                 return SUCCESS()
             o = SUCCESS({returns: temp})
             o.set_resolve_key(returns)
             return o
 
+        if inspect.iscoroutinefunction(func):
+
+            async def from_context(context: Dict[str, Any]) -> Outcome:
+                try:
+                    temp = await func(**bind(context))
+                except StageFailed as e:
+                    return e.outcome
+                except Exception as e:
+                    return handler_for(e)(e)
+                return succeed(temp)
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                if args:
+                    return await raw_func(*args)
+                return await from_context(kwargs)
+
+        else:
+
+            def from_context(context: Dict[str, Any]) -> Outcome:
+                # bind and succeed inlined, as this is the hot path
+                new_args = {}
+                for key, missing in bindings:
+                    val = context.get(key, missing)
+                    if val is not None:
+                        new_args[key] = val
+                try:
+                    temp = func(**new_args)
+                except StageFailed as e:
+                    return e.outcome
+                except Exception as e:
+                    return handler_for(e)(e)
+                if returns == "":
+                    return SUCCESS()
+                o = SUCCESS({returns: temp})
+                o.set_resolve_key(returns)
+                return o
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                # if the function is called with arguments, then treat it as a regular function call.
+                # this has a very weird edge case with functions that have one default argument.
+                if args:
+                    if cache is None:
+                        return func(*args)
+                    # bind by name so both kinds of call share cache entries
+                    bound = signature.bind(*args).arguments
+                    return func(**{k: v for k, v in bound.items() if v is not None})
+                return from_context(kwargs)
+
+        wrapper.from_context = from_context
+        # what the stage reads from and adds to a pipeline's context, for the
+        # schedulers that work out which stages depend on which.
+        wrapper.requires = tuple(requires)
+        wrapper.returns = returns
+        wrapper.cache = cache
         return wrapper
 
     requires = [Argument(key) if type(key) == str else key for key in requires]
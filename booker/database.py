@@ -1,13 +1,14 @@
-import configparser
-import json
+import sqlite3
+import sys
+from contextlib import nullcontext
+from itertools import islice
 from json import JSONDecodeError
 from pathlib import Path
-from typing import Callable
+from typing import IO, Iterable, List, Union
 
 import typer
-import yaml
 
-from booker.bookerdataclasses import BookList, Book, Status
+from booker.bookerdataclasses import BookList, Book, Status, Ordering, ExportFormat
 from booker.error import (
     DB_WRITE_ERROR,
     DB_READ_ERROR,
@@ -15,115 +16,307 @@ from booker.error import (
     ID_ERROR,
     EXPORT_ERROR,
     EXISTENCE_ERROR,
+    DUPLICATE_ERROR,
 )
-from booker.control import Pipeline, outcome, Argument
-from booker.config import config_file_path
-from booker.pantry import upload
+from booker.control import Pipeline, outcome, Argument, fail_stage
+from booker.config import SETTINGS, MissingConfigError
+from booker.codec import CODEC
+from booker.storage import BOOK_COLUMNS, Storage, open_storage
 
 DEFAULT_DB_FILE_PATH = Path.home().joinpath("." + Path.home().stem + "_books.json")
 
 
 @outcome(
-    requires=("config_file",), returns="db_path", registers={KeyError: EXISTENCE_ERROR}
+    requires=("config_file",),
+    returns="db_path",
+    registers={KeyError: EXISTENCE_ERROR, MissingConfigError: EXISTENCE_ERROR},
 )
 def database_path(config_file: Path) -> Path:
-    config_parser = configparser.ConfigParser()
-    config_parser.read(config_file)
-    return Path(config_parser["General"]["database"])
+    return SETTINGS.get(config_file).database
 
 
-@outcome(requires=("book_list",), returns="next_id")
-def incr_id(book_list: BookList, **kwargs) -> int:
-    ids: Callable[[Book], int] = lambda x: x["id"]
-    max_book: Book = max(book_list, key=ids, default=Book(id=-1))
-    return max_book["id"] + 1
+def storage(db_path: Path = None) -> Storage:
+    if db_path:
+        return open_storage(db_path)
+    settings = SETTINGS.get()
+    return open_storage(settings.database, settings.backend, **settings.storage_options)
 
 
-@outcome(requires=("book_list", "book", "next_id"), returns="book_list")
-def append_book(book_list: BookList, book: Book, next_id: int) -> BookList:
-    book["id"] = next_id
-    book_list.append(book)
-    return book_list
+@outcome(
+    requires=(Argument("db_path", optional=True), Argument("ordering", optional=True)),
+    returns="book_list",
+    registers={
+        MissingConfigError: EXISTENCE_ERROR,
+        OSError: DB_READ_ERROR,
+        JSONDecodeError: JSON_ERROR,
+        sqlite3.Error: DB_READ_ERROR,
+    },
+)
+def read_books(db_path: Path = None, ordering: Ordering = None) -> BookList:
+    return storage(db_path).load(ordering)
 
 
 @outcome(
-    requires=(Argument("db_path", optional=True),),
+    requires=(
+        Argument("db_path", optional=True),
+        Argument("ordering", optional=True),
+        Argument("offset", optional=True),
+        Argument("limit", optional=True),
+    ),
     returns="book_list",
-    registers={OSError: DB_READ_ERROR, JSONDecodeError: JSON_ERROR},
+    registers={
+        MissingConfigError: EXISTENCE_ERROR,
+        OSError: DB_READ_ERROR,
+        JSONDecodeError: JSON_ERROR,
+        sqlite3.Error: DB_READ_ERROR,
+    },
 )
-def read_books(db_path: Path = None) -> BookList:
-    db_path = db_path if db_path else database_path(config_file_path(None))
-    with db_path.open("r") as db:
-        book_list = json.load(db, object_hook=lambda d: Book(**d))
-        return book_list
+def stream_books(
+    db_path: Path = None, ordering: Ordering = None, offset: int = 0, limit: int = None
+) -> Iterable[Book]:
+    return storage(db_path).iter_books(ordering, offset, limit)
 
 
 @outcome(
     requires=("book_list", Argument("db_path", optional=True)),
     returns="book_list",
     registers={
+        MissingConfigError: EXISTENCE_ERROR,
         OSError: DB_WRITE_ERROR,
         ValueError: DB_WRITE_ERROR,
+        sqlite3.Error: DB_WRITE_ERROR,
     },
 )
 def write_books(book_list: BookList, db_path: Path = None) -> BookList:
-    db_path = db_path if db_path else database_path(config_file_path(None))
     if book_list is None:
         raise ValueError("empty json file supplied")
-    with db_path.open("w") as db:
-        json.dump(book_list, db, indent=2)
-        return book_list
+    return storage(db_path).save(book_list)
 
 
 @outcome(
-    requires=("book_list", "write_path"), returns="", registers={OSError: EXPORT_ERROR}
+    requires=("book", Argument("db_path", optional=True)),
+    returns="book_list",
+    registers={
+        MissingConfigError: EXISTENCE_ERROR,
+        OSError: DB_WRITE_ERROR,
+        JSONDecodeError: JSON_ERROR,
+        ValueError: DUPLICATE_ERROR,
+        sqlite3.Error: DB_WRITE_ERROR,
+    },
 )
-def json_to_yaml(book_list: BookList, write_path: Path) -> None:
-    with open(write_path, "w") as outfile:
-        yaml.dump(book_list, outfile, default_flow_style=False)
+def insert_book(book: Book, db_path: Path = None) -> BookList:
+    return storage(db_path).insert([book])
 
 
-@outcome()
-def export_yaml() -> None:
-    write_path = Path().home() / "book_export.yaml"
-    ~(Pipeline(initial_args={"write_path": write_path}) << read_books << json_to_yaml)
+@outcome(
+    requires=("isbn", Argument("db_path", optional=True)),
+    returns="book_list",
+    registers={
+        MissingConfigError: EXISTENCE_ERROR,
+        KeyError: EXISTENCE_ERROR,
+        OSError: DB_READ_ERROR,
+        JSONDecodeError: JSON_ERROR,
+        sqlite3.Error: DB_READ_ERROR,
+    },
+)
+def find_book(isbn: str, db_path: Path = None) -> BookList:
+    book = storage(db_path).find_isbn(isbn)
+    if book is None:
+        raise KeyError(f"there is no book with isbn {isbn}")
+    return [book]
 
 
-@outcome()
-def export_pantry(pantry_id: str, basket_id: str) -> None:
-    ~(
-        Pipeline(
-            initial_args={"pantry_id": pantry_id, "basket_id": basket_id},
-            finalizer=lambda response: typer.secho(
-                response.get_key("response"), fg=typer.colors.GREEN
-            ),
-        )
-        << read_books
-        << upload
-    )
+@outcome(
+    requires=("query", Argument("db_path", optional=True)),
+    returns="book_list",
+    registers={
+        MissingConfigError: EXISTENCE_ERROR,
+        OSError: DB_READ_ERROR,
+        JSONDecodeError: JSON_ERROR,
+        sqlite3.Error: DB_READ_ERROR,
+    },
+)
+def search_books(query: str, db_path: Path = None) -> BookList:
+    return storage(db_path).search(query)
 
 
 @outcome(
-    requires=("book_list", "id", "status"),
+    requires=("ids", "status", Argument("db_path", optional=True)),
     returns="book_list",
-    registers={KeyError: ID_ERROR},
+    registers={
+        MissingConfigError: EXISTENCE_ERROR,
+        KeyError: ID_ERROR,
+        OSError: DB_WRITE_ERROR,
+        sqlite3.Error: DB_WRITE_ERROR,
+    },
 )
-def _update_status(book_list: BookList, id: int, status: Status) -> BookList:
-    for book in book_list:
-        if book["id"] == id:
-            book["status"] = status
-            return book_list
-    err_str = "include the --id flag." if id == -1 else f"there is no book with id {id}"
-    raise KeyError(err_str)
+def update_books(ids: List[int], status: Status, db_path: Path = None) -> BookList:
+    return storage(db_path).update_statuses(ids, status)
 
 
 @outcome(
-    requires=("book_list", "id"), returns="book_list", registers={KeyError: ID_ERROR}
+    requires=("ids", Argument("db_path", optional=True)),
+    returns="book_list",
+    registers={
+        MissingConfigError: EXISTENCE_ERROR,
+        KeyError: ID_ERROR,
+        OSError: DB_WRITE_ERROR,
+        sqlite3.Error: DB_WRITE_ERROR,
+    },
 )
-def delete_book_id(book_list: BookList, id: int) -> BookList:
-    for idx, book in enumerate(book_list[:]):
-        if book["id"] == id:
-            book_list.pop(idx)
-            return book_list
-    err_str = "include the --id flag." if id == -1 else f"there is no book with id {id}"
-    raise KeyError(err_str)
+def remove_books(ids: List[int], db_path: Path = None) -> BookList:
+    return storage(db_path).delete_many(ids)
+
+
+EXPORT_STDOUT = "-"
+# books dumped per yaml.dump call. each call builds a dumper, so dumping one
+# book at a time spends most of an export on setup, and all of them at once
+# holds the whole document in memory.
+YAML_BATCH_SIZE = 100
+# rows per parquet row group.
+PARQUET_BATCH_SIZE = 65536
+
+
+def export_output(write_path: Union[Path, str], mode: str = "w", **kwargs) -> IO:
+    """the file to export to, or stdout when the path is -."""
+    if str(write_path) == EXPORT_STDOUT:
+        return nullcontext(sys.stdout.buffer if "b" in mode else sys.stdout)
+    return open(write_path, mode, **kwargs)
+
+
+def default_export_path(fmt: ExportFormat) -> Path:
+    return Path().home() / f"book_export.{fmt.value}"
+
+
+@outcome(
+    requires=("book_list", "write_path"), returns="", registers={OSError: EXPORT_ERROR}
+)
+def json_to_yaml(book_list: Iterable[Book], write_path: Union[Path, str]) -> None:
+    import yaml  # only exports need yaml, so keep it off the startup path
+
+    # libyaml's emitter is several times faster than the pure python one.
+    dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    books = iter(book_list)
+    with export_output(write_path) as outfile:
+        empty = True
+        # each batch is dumped as its own list so the concatenation is still
+        # a single yaml list, without building the whole document in memory.
+        while batch := list(islice(books, YAML_BATCH_SIZE)):
+            yaml.dump(batch, outfile, Dumper=dumper, default_flow_style=False)
+            empty = False
+        if empty:
+            yaml.dump([], outfile, Dumper=dumper)
+
+
+@outcome(
+    requires=("book_list", "write_path"), returns="", registers={OSError: EXPORT_ERROR}
+)
+def books_to_csv(book_list: Iterable[Book], write_path: Union[Path, str]) -> None:
+    import csv
+
+    with export_output(write_path, newline="") as outfile:
+        writer = csv.DictWriter(outfile, BOOK_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(book_list)
+
+
+@outcome(
+    requires=("book_list", "write_path"), returns="", registers={OSError: EXPORT_ERROR}
+)
+def books_to_ndjson(book_list: Iterable[Book], write_path: Union[Path, str]) -> None:
+    with export_output(write_path, "wb") as outfile:
+        for book in book_list:
+            outfile.write(CODEC.dumps(book) + b"\n")
+
+
+@outcome(
+    requires=("book_list", "write_path"),
+    returns="",
+    registers={OSError: EXPORT_ERROR, ImportError: EXPORT_ERROR},
+)
+def books_to_parquet(book_list: Iterable[Book], write_path: Union[Path, str]) -> None:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "parquet exports need pyarrow, which is not installed."
+        ) from e
+
+    # authors and statuses repeat across many books, so they are stored once
+    # per row group and referenced by index.
+    category = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("isbn", pa.string()),
+            ("title", pa.string()),
+            ("author_fname", category),
+            ("author_lname", category),
+            ("status", category),
+        ]
+    )
+    books = iter(book_list)
+    with export_output(write_path, "wb") as outfile:
+        with pq.ParquetWriter(outfile, schema) as writer:
+            while batch := list(islice(books, PARQUET_BATCH_SIZE)):
+                columns = {
+                    column: [book[column] for book in batch] for column in BOOK_COLUMNS
+                }
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+
+FILE_EXPORTERS = {
+    ExportFormat.YAML: json_to_yaml,
+    ExportFormat.CSV: books_to_csv,
+    ExportFormat.NDJSON: books_to_ndjson,
+    ExportFormat.PARQUET: books_to_parquet,
+}
+
+
+@outcome(requires=("fmt", Argument("write_path", optional=True)))
+def export_file(fmt: ExportFormat, write_path: Union[Path, str] = None) -> None:
+    write_path = write_path or default_export_path(fmt)
+    ~(
+        Pipeline(error_handler=fail_stage, initial_args={"write_path": write_path})
+        << stream_books
+        << FILE_EXPORTERS[fmt]
+    )
+
+
+@outcome(requires=(Argument("write_path", optional=True),))
+def export_yaml(write_path: Union[Path, str] = None) -> None:
+    export_file(ExportFormat.YAML, write_path)
+
+
+@outcome(
+    requires=(
+        "pantry_id",
+        Argument("basket_id", optional=True),
+        Argument("full", optional=True),
+        Argument("compress", optional=True),
+    ),
+    registers={MissingConfigError: EXISTENCE_ERROR},
+)
+def export_pantry(
+    pantry_id: str, basket_id: str = None, full: bool = False, compress: bool = False
+) -> None:
+    from booker.pantry import manifest_path, sync
+
+    ~(
+        Pipeline(
+            error_handler=fail_stage,
+            initial_args={
+                "pantry_id": pantry_id,
+                "basket_id": basket_id,
+                "full": full,
+                "compress": compress,
+                "manifest_path": manifest_path(storage().db_path),
+            },
+            finalizer=lambda response: typer.secho(
+                response.get_key("response"), fg=typer.colors.GREEN
+            ),
+        )
+        << read_books
+        << sync
+    )
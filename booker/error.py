@@ -41,6 +41,11 @@ class EXISTENCE_ERROR(ERROR):
         super().__init__("the resource you are looking for does not exist.", cause)
 
 
+class DUPLICATE_ERROR(ERROR):
+    def __init__(self, cause: Exception):
+        super().__init__("that book is already in the reading list.", cause)
+
+
 class EXPORT_ERROR(ERROR):
     def __init__(self, cause: Exception):
         super().__init__("Something went wrong when exporting the reading list.", cause)
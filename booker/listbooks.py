@@ -1,12 +1,15 @@
 # misc utils. to be moved to their own file soon.
-from typing import Callable, Any, Dict
+from typing import Callable, Any, Dict, Iterable
 
 from booker.bookerdataclasses import BookList, Book, Ordering
 from booker.control import Outcome, outcome
 from booker.error import DB_READ_ERROR
 
 
-def order_books(book_list: BookList, ordering: Ordering) -> BookList:
+def order_books(book_list: Iterable[Book], ordering: Ordering) -> Iterable[Book]:
+    if getattr(book_list, "ordering", None) == ordering:
+        # the storage backend already returned the books in this order.
+        return book_list
     return sorted(book_list, key=lookup_ordering_key(ordering))
 
 
@@ -31,7 +34,7 @@ def fmt_book(book: Book) -> Dict[str, str]:
     )
 
 
-def fmt_books(book_list: BookList):
+def fmt_books(book_list: Iterable[Book]):
     return [fmt_book(book) for book in book_list]
 
 
@@ -44,7 +47,7 @@ def table_header():
     returns="table_args",
     registers={Exception: DB_READ_ERROR},
 )
-def fmt_table(book_list: BookList, ordering: str) -> Outcome:
+def fmt_table(book_list: Iterable[Book], ordering: str) -> Outcome:
     bl = order_books(book_list, ordering)
     formatted_table = table_header(), fmt_books(bl)
     return formatted_table
@@ -1,36 +1,181 @@
-import json
+import gzip
+import hashlib
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple, Union
 
-import requests
-
-from bs4 import BeautifulSoup
-
-from booker.bookerdataclasses import BookList
-from booker.control import outcome
+from booker.bookerdataclasses import Book, BookList
+from booker.codec import CODEC
+from booker.control import outcome, Argument
 from booker.error import EXPORT_ERROR
 
+if TYPE_CHECKING:
+    # requests is imported on the first upload, not when the cli starts.
+    from requests import Response, Session
+
 BASE_URL = "https://getpantry.cloud/apiv1/pantry"
 headers = {"Content-Type": "application/json"}
 
+# seconds to wait for the connection, then for each read of the response
+TIMEOUT = (3.05, 30)
+RETRIES = 3
+# retries wait 0s, then 2 * BACKOFF_FACTOR, 4 * BACKOFF_FACTOR, ... seconds
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+# bodies smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+
+_session: Optional["Session"] = None
+
+# books keyed by their id, as they are stored in a basket. a delta maps the
+# ids of deleted books to None.
+BookMap = Dict[str, Optional[Book]]
+# sent with every id-keyed reading list, so that readers of a basket can tell
+# it from the plain list of books that a basket holds otherwise.
+BASKET_VERSION = 2
+# pantry merges a delta into the basket and cannot remove keys from it, so
+# deleted books are left in it as nulls. once there are more of them than this
+# share of the books, the whole reading list is posted again without them.
+MAX_TOMBSTONES = 0.25
+
 
 def get_url(pantry_id: str, basket_id: str) -> str:
     return f"{BASE_URL}/{pantry_id}/basket/{basket_id}"
 
 
+def session() -> "Session":
+    """
+    the process wide session, so that uploads reuse pooled keep-alive
+    connections and retry server errors with exponential backoff.
+    """
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=RETRIES,
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=RETRY_STATUSES,
+            # posting replaces the basket and putting merges the same values
+            # into it again, so repeating either is safe.
+            allowed_methods=frozenset({"POST", "PUT"}),
+            raise_on_status=False,
+        )
+        _session = requests.Session()
+        _session.headers.update(headers)
+        adapter = HTTPAdapter(max_retries=retry)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+
+def close_session() -> None:
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+
+
+def encode_body(
+    book_list: Union[BookList, BookMap], compress: bool = False
+) -> Tuple[bytes, Dict[str, str]]:
+    """the request body and its extra headers."""
+    body = {"reading_list": book_list}
+    if isinstance(book_list, dict):
+        body["version"] = BASKET_VERSION
+    contents = CODEC.dumps(body)
+    if compress and len(contents) >= GZIP_MIN_BYTES:
+        return gzip.compress(contents, compresslevel=6), {"Content-Encoding": "gzip"}
+    return contents, {}
+
+
+def response_text(res: "Response") -> str:
+    text = res.text
+    if "html" in res.headers.get("Content-Type", ""):
+        # bs4 is only needed to flatten html error pages.
+        from bs4 import BeautifulSoup
+
+        text = BeautifulSoup(text, features="html.parser").getText()
+    return ". ".join(text.split("\n"))
+
+
+def new_basket_id() -> str:
+    return f'book_export_{datetime.now().strftime("%Y-%m-%d_%H:%M:%S")}.json'
+
+
+def manifest_path(db_path: Path) -> Path:
+    return db_path.with_name(db_path.name + ".pantry")
+
+
+def read_manifest(path: Path) -> Dict[str, Any]:
+    """
+    the basket of the last successful export to each pantry and the content
+    hash of every book it sent, or nothing if there has not been one.
+    """
+    try:
+        return CODEC.loads(path.read_bytes())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(path: Path, manifest: Dict[str, Any]) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(CODEC.dumps(manifest))
+    os.replace(tmp_path, path)
+
+
+def book_hash(book: Book) -> str:
+    return hashlib.blake2b(
+        CODEC.dumps(dict(sorted(book.items()))), digest_size=16
+    ).hexdigest()
+
+
+def diff_books(
+    book_list: BookList, hashes: Dict[str, str]
+) -> Tuple[BookMap, Dict[str, str]]:
+    """the books added, changed or deleted since `hashes`, and the new hashes."""
+    changes, current = {}, {}
+    for book in book_list:
+        key = str(book["id"])
+        current[key] = digest = book_hash(book)
+        if hashes.get(key) != digest:
+            changes[key] = book
+    for key in hashes.keys() - current.keys():
+        changes[key] = None
+    return changes, current
+
+
 @outcome(
-    requires=("pantry_id", "basket_id", "book_list"),
+    requires=(
+        "pantry_id",
+        "basket_id",
+        "book_list",
+        Argument("compress", optional=True),
+        Argument("method", optional=True),
+    ),
     returns="response",
     registers={Exception: EXPORT_ERROR},
 )
-def upload(pantry_id: str, basket_id: str, book_list: BookList) -> str:
+def upload(
+    pantry_id: str,
+    basket_id: str,
+    book_list: Union[BookList, BookMap],
+    compress: bool = False,
+    method: str = "POST",
+) -> str:
     if pantry_id.strip() == "":
         raise Exception(f"no pantry id. Provide a pantry id with the --pantry-id flag.")
 
-    contents = json.dumps({"reading_list": book_list})
+    contents, extra_headers = encode_body(book_list, compress)
     url = get_url(pantry_id, basket_id)
-    res = requests.post(url, headers=headers, data=contents)
+    res = session().request(
+        method, url, headers=extra_headers, data=contents, timeout=TIMEOUT
+    )
     status_code = res.status_code
-    text = BeautifulSoup(res.text, features="html.parser").getText().split("\n")
-    response = ". ".join(text)
+    response = response_text(res)
 
     if 200 <= status_code <= 399:
         return response
@@ -40,3 +185,60 @@ def upload(pantry_id: str, basket_id: str, book_list: BookList) -> str:
         )
     else:
         raise Exception(f"{response}. Error Code: {status_code}")
+
+
+@outcome(
+    requires=(
+        "pantry_id",
+        "book_list",
+        "manifest_path",
+        Argument("basket_id", optional=True),
+        Argument("full", optional=True),
+        Argument("compress", optional=True),
+    ),
+    returns="response",
+    registers={Exception: EXPORT_ERROR},
+)
+def sync(
+    pantry_id: str,
+    book_list: BookList,
+    manifest_path: Path,
+    basket_id: Optional[str] = None,
+    full: bool = False,
+    compress: bool = False,
+) -> str:
+    """
+    bring the basket of the last export up to date by sending only the books
+    that changed since then, which pantry merges into the basket. the whole
+    reading list is posted instead for a first export, a different basket, a
+    full resync, or to drop the nulls that deletes have left in the basket.
+    """
+    if pantry_id.strip() == "":
+        raise Exception(f"no pantry id. Provide a pantry id with the --pantry-id flag.")
+
+    manifest = read_manifest(manifest_path)
+    last = manifest.get(pantry_id)
+    delta = last and not full and basket_id in (None, last["basket"])
+    if delta:
+        basket_id = last["basket"]
+        changes, hashes = diff_books(book_list, last["books"])
+        if not changes:
+            return f"Nothing changed since the last export to {basket_id}."
+        tombstones = last.get("tombstones", 0) + len(last["books"].keys() - hashes)
+        delta = tombstones <= len(hashes) * MAX_TOMBSTONES
+    if delta:
+        upload(pantry_id, basket_id, changes, compress, "PUT")
+        # pantry answers a merge with the whole basket, which is not worth showing.
+        response = f"Exported {len(changes)} changed books to {basket_id}."
+    else:
+        basket_id = basket_id or new_basket_id()
+        books, hashes = diff_books(book_list, {})
+        tombstones = 0
+        response = upload(pantry_id, basket_id, books, compress, "POST")
+    manifest[pantry_id] = {
+        "basket": basket_id,
+        "books": hashes,
+        "tombstones": tombstones,
+    }
+    write_manifest(manifest_path, manifest)
+    return response
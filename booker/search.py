@@ -0,0 +1,118 @@
+import re
+from typing import Dict, Iterable, List, Set
+
+from booker.bookerdataclasses import Book
+
+SEARCH_FIELDS = ("title", "author_fname", "author_lname")
+TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall((text or "").casefold())
+
+
+def terms_of(*texts: str) -> Set[str]:
+    return {term for text in texts for term in tokenize(text)}
+
+
+def book_terms(book: Book) -> Set[str]:
+    """the terms a book is found by."""
+    return terms_of(*(book.get(field) for field in SEARCH_FIELDS))
+
+
+def terms_text(book: Book) -> str:
+    """
+    the terms of a book in one string, for sql to search. a token is part of
+    it exactly when it is part of one of the terms, as tokens never span the
+    spaces between them.
+    """
+    return " ".join(sorted(book_terms(book)))
+
+
+def grams(term: str) -> Set[str]:
+    """every substring of the term of up to three characters."""
+    return {term[i : i + n] for n in (1, 2, 3) for i in range(len(term) - n + 1)}
+
+
+def trigrams(term: str) -> Set[str]:
+    return {term[i : i + 3] for i in range(len(term) - 2)}
+
+
+class SearchIndex:
+    """
+    an inverted index from the casefolded title and author terms of books to
+    their ids. a query matches the books that have, for every query token, a
+    term containing that token, so prefixes and infixes both match. terms are
+    found through an index of their substrings of up to three characters: a
+    short token is looked up directly, and a longer one by intersecting the
+    terms of its trigrams, so a lookup never walks the whole vocabulary.
+    """
+
+    def __init__(self, postings: Dict[str, Iterable[int]] = None):
+        self.postings: Dict[str, Set[int]] = {
+            term: set(ids) for term, ids in (postings or {}).items()
+        }
+        self.by_gram: Dict[str, Set[str]] = {}
+        for term in self.postings:
+            self._add_term(term)
+
+    def add(self, id: int, terms: Iterable[str]) -> None:
+        for term in terms:
+            if term not in self.postings:
+                self.postings[term] = set()
+                self._add_term(term)
+            self.postings[term].add(id)
+
+    def remove(self, id: int, terms: Iterable[str]) -> None:
+        for term in terms:
+            ids = self.postings.get(term)
+            if ids is None:
+                continue
+            ids.discard(id)
+            if not ids:
+                del self.postings[term]
+                self._remove_term(term)
+
+    def search(self, query: str) -> Set[int]:
+        found = None
+        for token in set(tokenize(query)):
+            ids = set()
+            for term in self.matching_terms(token):
+                ids |= self.postings[term]
+            found = ids if found is None else found & ids
+            if not found:
+                break
+        return found or set()
+
+    def matching_terms(self, token: str) -> Iterable[str]:
+        if len(token) <= 3:
+            return self.by_gram.get(token, ())
+        candidates = None
+        for trigram in trigrams(token):
+            terms = self.by_gram.get(trigram, set())
+            candidates = terms if candidates is None else candidates & terms
+            if not candidates:
+                return ()
+        return [term for term in candidates if token in term]
+
+    def to_postings(self) -> Dict[str, List[int]]:
+        return {term: sorted(ids) for term, ids in self.postings.items()}
+
+    def _add_term(self, term: str) -> None:
+        for gram in grams(term):
+            self.by_gram.setdefault(gram, set()).add(term)
+
+    def _remove_term(self, term: str) -> None:
+        for gram in grams(term):
+            terms = self.by_gram[gram]
+            terms.discard(term)
+            if not terms:
+                del self.by_gram[gram]
+
+
+def index_books(books: Iterable[Book]) -> SearchIndex:
+    postings = {}
+    for book in books:
+        for term in book_terms(book):
+            postings.setdefault(term, []).append(book["id"])
+    return SearchIndex(postings)
@@ -0,0 +1,238 @@
+import json
+import os
+import sqlite3
+from contextlib import closing
+from json.decoder import WHITESPACE
+from operator import itemgetter
+from pathlib import Path
+from typing import BinaryIO, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+from booker.bookerdataclasses import Book, Ordering
+from booker.codec import Codec
+from booker.listbooks import lookup_ordering_key
+from booker.search import terms_text
+
+# bumped whenever the layout of the index changes, so older indexes are rebuilt.
+SNAPSHOT_INDEX_VERSION = 4
+
+SNAPSHOT_INDEX_SCHEMA = """
+CREATE TABLE books (
+    id INTEGER PRIMARY KEY,
+    isbn TEXT,
+    title TEXT,
+    author_fname TEXT,
+    author_lname TEXT,
+    status TEXT,
+    author_key TEXT,
+    terms TEXT,
+    offset INTEGER,
+    length INTEGER
+);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+"""
+
+# created once the rows are in, which is quicker than keeping them up to date.
+SNAPSHOT_INDEX_INDEXES = """
+CREATE INDEX books_isbn ON books (isbn);
+CREATE INDEX books_author ON books (author_key);
+CREATE INDEX books_title ON books (title);
+CREATE INDEX books_status ON books (status);
+"""
+
+# a trigram full text index of the books' casefolded terms. it is only built
+# once a search needs it, and is then rebuilt with the index on every save.
+SNAPSHOT_INDEX_SEARCH = """
+CREATE VIRTUAL TABLE books_search USING fts5(
+    terms, content='books', content_rowid='id', tokenize='trigram case_sensitive 1'
+);
+INSERT INTO books_search (books_search) VALUES ('rebuild');
+"""
+
+# the fields of each book that are kept in the index, after its id.
+INDEXED_FIELDS = ("isbn", "title", "author_fname", "author_lname", "status")
+# the author is sorted by the key python sorts it by, which sql could only
+# approximate: "Doe, None" for a book without a first name, rather than NULL.
+author_key = lookup_ordering_key(Ordering.AUTHOR)
+
+# a book and where it is in the snapshot: the offset of its first byte and
+# its length in bytes.
+Position = Tuple[Book, int, int]
+
+
+def write_snapshot(
+    fp: BinaryIO, books: Iterable[Book], codec: Codec, indent: bool = False
+) -> List[Position]:
+    """
+    write the books as a json array, byte for byte as codec.dumps(books, indent)
+    would, and return where each one was written.
+    """
+    start, separator, end = (
+        (b"[\n  ", b",\n  ", b"\n]") if indent else (b"[", b",", b"]")
+    )
+    positions, parts = [], []
+    offset = 0
+    for book in books:
+        data = codec.dumps(book, indent=indent)
+        if indent:
+            # nest the book one level into the array
+            data = data.replace(b"\n", b"\n  ")
+        prefix = separator if parts else start
+        offset += len(prefix)
+        positions.append((book, offset, len(data)))
+        offset += len(data)
+        parts += (prefix, data)
+    parts.append(end if parts else b"[]")
+    fp.write(b"".join(parts))
+    return positions
+
+
+def scan_snapshot(data: bytes) -> Iterator[Position]:
+    """the books of a json array and where each of them is in it."""
+    text = data.decode()
+    # the codecs write ascii, so character and byte offsets normally agree.
+    # otherwise the bytes up to each book are counted as the scan goes.
+    ascii = data.isascii()
+    decoder = json.JSONDecoder(object_hook=lambda d: Book(**d))
+    pos = WHITESPACE.match(text).end()
+    if text[pos : pos + 1] != "[":
+        raise json.JSONDecodeError("Expecting '['", text, pos)
+    pos = WHITESPACE.match(text, pos + 1).end()
+    if text[pos : pos + 1] == "]":
+        return
+    char, byte = 0, 0
+    while True:
+        book, end = decoder.raw_decode(text, pos)
+        if ascii:
+            yield book, pos, end - pos
+        else:
+            byte += len(text[char:pos].encode())
+            length = len(text[pos:end].encode())
+            yield book, byte, length
+            char, byte = end, byte + length
+        pos = WHITESPACE.match(text, end).end()
+        if text[pos : pos + 1] == "]":
+            return
+        if text[pos : pos + 1] != ",":
+            raise json.JSONDecodeError("Expecting ',' delimiter", text, pos)
+        pos = WHITESPACE.match(text, pos + 1).end()
+
+
+class SnapshotIndex:
+    """
+    a sqlite index of a json snapshot, kept beside it: the fields of every
+    book that it is looked up, sorted or searched by, where it is in the file,
+    and the id high-water mark. there is an index for each Ordering, so
+    listing in any order is an index walk. it records the fingerprint of the
+    snapshot it was built from, so an index left behind by an interrupted save
+    is never trusted. it is written whole, to a temporary file that then
+    replaces the old index; only the search table is added in place.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def write(
+        self,
+        snapshot: Hashable,
+        positions: Iterable[Position],
+        next_id: int,
+        search: bool = False,
+    ) -> None:
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.unlink(missing_ok=True)
+        with closing(sqlite3.connect(tmp_path)) as conn:
+            # a half written index is never used, so there is nothing to recover
+            conn.executescript(
+                "PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;"
+                + SNAPSHOT_INDEX_SCHEMA
+            )
+            with conn:
+                # a repeated id is kept once, as the catalog keeps the last one
+                fields = itemgetter("id", *INDEXED_FIELDS)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        (
+                            *fields(book),
+                            author_key(book),
+                            terms_text(book),
+                            offset,
+                            length,
+                        )
+                        for book, offset, length in positions
+                    ),
+                )
+                conn.executemany(
+                    "INSERT INTO meta VALUES (?, ?)",
+                    (
+                        ("version", SNAPSHOT_INDEX_VERSION),
+                        ("snapshot", json.dumps(snapshot)),
+                        ("next_id", next_id),
+                    ),
+                )
+            conn.executescript(SNAPSHOT_INDEX_INDEXES)
+            if search:
+                self._add_search(conn)
+        os.replace(tmp_path, self.path)
+
+    def open(self, snapshot: Hashable) -> Optional[sqlite3.Connection]:
+        """a connection to the index, or None if it was not built from this snapshot."""
+        if not self.path.exists():
+            return None
+        conn = self._connect()
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+        except sqlite3.DatabaseError:
+            meta = {}
+        current = meta.get("version") == SNAPSHOT_INDEX_VERSION
+        if not current or meta.get("snapshot") != json.dumps(snapshot):
+            conn.close()
+            return None
+        return conn
+
+    def next_id(self) -> int:
+        """the high-water mark in the index, even one that is stale."""
+        if not self.path.exists():
+            return 0
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT value FROM meta WHERE key = 'next_id'"
+                ).fetchone()
+        except sqlite3.DatabaseError:
+            return 0
+        return 0 if row is None else row[0]
+
+    @staticmethod
+    def searchable(conn: sqlite3.Connection) -> bool:
+        row = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'books_search'"
+        ).fetchone()
+        return row is not None
+
+    def has_search(self) -> bool:
+        """whether the index, current or not, has its search table."""
+        if not self.path.exists():
+            return False
+        try:
+            with closing(self._connect()) as conn:
+                return self.searchable(conn)
+        except sqlite3.DatabaseError:
+            return False
+
+    def add_search(self) -> None:
+        """build the search table in the index as it is."""
+        with closing(sqlite3.connect(self.path)) as conn:
+            self._add_search(conn)
+
+    @staticmethod
+    def _add_search(conn: sqlite3.Connection) -> None:
+        try:
+            conn.executescript("BEGIN IMMEDIATE;" + SNAPSHOT_INDEX_SEARCH + "COMMIT;")
+        except sqlite3.OperationalError:
+            # sqlite builds without fts5 or the trigram tokenizer (3.34+) have
+            # no search table, and another process may have built it first.
+            conn.rollback()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"{self.path.absolute().as_uri()}?mode=ro", uri=True)
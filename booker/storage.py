@@ -0,0 +1,1038 @@
+import json
+import os
+import re
+import sqlite3
+from abc import ABC, abstractmethod
+import heapq
+from contextlib import ExitStack, closing, contextmanager, nullcontext
+from itertools import islice
+from operator import itemgetter
+from pathlib import Path
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    ContextManager,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+)
+
+try:
+    import fcntl
+except ImportError:  # windows: writers are not serialized across processes
+    fcntl = None
+
+from booker.bookerdataclasses import (
+    BookList,
+    Book,
+    Status,
+    Backend,
+    Ordering,
+    OrderedBookList,
+    BookStream,
+)
+from booker.codec import CODEC, Codec
+from booker.listbooks import lookup_ordering_key
+from booker.search import index_books, terms_text, tokenize
+from booker.snapshot import SnapshotIndex, scan_snapshot, write_snapshot
+from booker.catalog import (
+    CATALOG_CACHE,
+    Catalog,
+    check_unique,
+    id_error,
+    stat_fingerprint,
+)
+
+# the journal is folded back into the snapshot once it outgrows both this floor
+# and the snapshot itself, which keeps compaction amortized O(1) per mutation.
+COMPACT_AFTER_BYTES = 64 * 1024
+# every cold read replays the whole journal, so it is also compacted once it
+# outgrows this cap, however large the snapshot is. that bounds the replay a
+# cold mutation pays for, at the cost of compacting a large catalog every few
+# thousand mutations.
+MAX_JOURNAL_BYTES = 512 * 1024
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# the column the snapshot index is walked by for each ordering, holding the
+# key listbooks.lookup_ordering_key gives. ties are broken by id.
+SNAPSHOT_ORDER_BY = {
+    Ordering.DEFAULT: "id",
+    Ordering.AUTHOR: "author_key",
+    Ordering.TITLE: "title",
+    Ordering.ISBN: "isbn",
+    Ordering.STATUS: "status",
+}
+
+# picks the books to insert, given the ids of the isbns that are already stored.
+IsbnCheck = Callable[[BookList, Dict[str, int]], BookList]
+
+# journal marker for a book that has been deleted since the snapshot.
+DELETED = object()
+
+
+def _added(change: Any) -> bool:
+    """whether a journal change is a whole book, rather than DELETED or a status."""
+    return change is not None and change is not DELETED and "id" in change
+
+
+def _replaced(change: Any) -> bool:
+    """whether a journal change hides the snapshot's book with the same id."""
+    return change is DELETED or _added(change)
+
+
+def iter_json_array(
+    fp: TextIO, object_hook: Callable = None, chunk_size: int = CHUNK_SIZE
+) -> Iterator[Any]:
+    """
+    decode a top level json array one element at a time. at most one chunk of
+    the file plus the element being decoded are held in memory.
+    """
+    decoder = json.JSONDecoder(object_hook=object_hook)
+    buffer, pos = "", 0
+    expecting = "["
+    while True:
+        pos = WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer):
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                raise json.JSONDecodeError("Expecting value", buffer, pos)
+            buffer, pos = chunk, 0
+            continue
+        char = buffer[pos]
+        if expecting == "[":
+            if char != "[":
+                raise json.JSONDecodeError("Expecting '['", buffer, pos)
+            expecting, pos = "first", pos + 1
+        elif expecting == "first" and char == "]":
+            return
+        elif expecting in ("first", "value"):
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                end = None
+            # the value may be cut off at the end of the chunk, so read more
+            # and decode it again from the start.
+            if end is None or end == len(buffer):
+                chunk = fp.read(chunk_size)
+                if chunk:
+                    buffer, pos = buffer[pos:] + chunk, 0
+                    continue
+                if end is None:
+                    decoder.raw_decode(buffer, pos)
+            yield value
+            expecting, pos = "delimiter", end
+        elif char == ",":
+            expecting, pos = "value", pos + 1
+        elif char == "]":
+            return
+        else:
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+
+
+class Storage(ABC):
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+
+    @abstractmethod
+    def create(self) -> None:
+        pass
+
+    @abstractmethod
+    def load(self, ordering: Optional[Ordering] = None) -> BookList:
+        pass
+
+    @abstractmethod
+    def iter_books(
+        self, ordering: Optional[Ordering] = None, offset: int = 0, limit: int = None
+    ) -> Iterable[Book]:
+        """
+        yield books one at a time without loading the whole catalog, skipping
+        the first `offset` books and stopping after `limit` of them.
+        """
+        pass
+
+    @abstractmethod
+    def save(self, book_list: BookList) -> BookList:
+        pass
+
+    @abstractmethod
+    def next_id(self) -> int:
+        """the persisted high-water mark for ids, which deletes never lower."""
+        pass
+
+    @abstractmethod
+    def reserve_ids(self, count: int) -> int:
+        """
+        move the high-water mark past `count` ids and return the first, so the
+        block stays unique however many other writers there are.
+        """
+        pass
+
+    def locked(self) -> ContextManager[None]:
+        """a lock, held across processes, for reading and then writing the database."""
+        return nullcontext()
+
+    @abstractmethod
+    def append(self, books: BookList) -> BookList:
+        """persist books that have already been given ids."""
+        pass
+
+    def insert(self, books: BookList, check: IsbnCheck = check_unique) -> BookList:
+        """
+        give books ids and persist them in one write, unless one of their isbns
+        is taken. pass check to insert only some of them instead.
+        """
+        with self.locked():
+            books = check(books, self.isbn_ids(book.get("isbn") for book in books))
+            if not books:
+                return books
+            next_id = self.next_id()
+            for offset, book in enumerate(books):
+                book["id"] = next_id + offset
+            return self.append(books)
+
+    @abstractmethod
+    def isbn_ids(self, isbns: Iterable[str]) -> Dict[str, int]:
+        """the id of the first book with each of these isbns that is stored."""
+        pass
+
+    @abstractmethod
+    def find_isbn(self, isbn: str) -> Optional[Book]:
+        """the book with this isbn, looked up through an index."""
+        pass
+
+    @abstractmethod
+    def search(self, query: str) -> BookList:
+        """
+        the books, in id order, with a title or author term containing each
+        of the query's terms, looked up through a search index.
+        """
+        pass
+
+    def update_status(self, id: int, status: Status) -> Book:
+        return self.update_statuses([id], status)[0]
+
+    @abstractmethod
+    def update_statuses(self, ids: Iterable[int], status: Status) -> BookList:
+        """
+        set the status of every book in one write. if any of the ids is
+        missing, a KeyError is raised and none of the books change.
+        """
+        pass
+
+    def delete(self, id: int) -> Book:
+        return self.delete_many([id])[0]
+
+    @abstractmethod
+    def delete_many(self, ids: Iterable[int]) -> BookList:
+        """delete the books in one write, or none of them if an id is missing."""
+        pass
+
+
+class JournalStorage(Storage):
+    """
+    a json snapshot (the database file itself) plus an append-only journal of
+    the adds, status updates and deletes made since the snapshot was written.
+    mutations only ever append to the journal; the snapshot is rewritten when
+    the journal is compacted or when a full book list is saved. each snapshot
+    is written with a SnapshotIndex, <db>.index, holding the id high-water mark
+    and the isbn and position of each of its books, so that a book is looked
+    up by reading just that book. writers hold a lock on <db>.lock.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        compact_after: int = COMPACT_AFTER_BYTES,
+        codec: Codec = CODEC,
+        compact: bool = False,
+        max_journal: int = MAX_JOURNAL_BYTES,
+    ):
+        super().__init__(db_path)
+        self.journal_path = self.db_path.with_name(self.db_path.name + ".journal")
+        self.index_path = self.db_path.with_name(self.db_path.name + ".index")
+        self.index = SnapshotIndex(self.index_path)
+        self.lock_path = self.db_path.with_name(self.db_path.name + ".lock")
+        self._locked = False
+        self.compact_after = compact_after
+        self.max_journal = max_journal
+        # the last replay of the journal, by the fingerprints of the journal and
+        # the index it was replayed over, so an operation replays it only once.
+        self._replayed: Optional[Tuple[Hashable, Dict[int, Any], int]] = None
+        self.codec = codec
+        # compact snapshots are written without indentation. both read back the same.
+        self.indent = not compact
+
+    def create(self) -> None:
+        self.db_path.write_text("[]")
+        self.index.write(stat_fingerprint(self.db_path), [], 0)
+        self._truncate_journal()
+        CATALOG_CACHE.discard(self._key)
+
+    def load(self, ordering: Optional[Ordering] = None) -> BookList:
+        book_list = self._catalog().books(ordering)
+        return OrderedBookList(book_list, ordering) if ordering else book_list
+
+    def iter_books(
+        self, ordering: Optional[Ordering] = None, offset: int = 0, limit: int = None
+    ) -> Iterable[Book]:
+        catalog = CATALOG_CACHE.get(self._key, self._fingerprint())
+        if catalog is not None:
+            books = catalog.iter_books(ordering, offset, limit)
+            return BookStream(books, ordering) if ordering else books
+        if ordering:
+            # the snapshot index has an index for each ordering, so the first
+            # page does not wait for the whole catalog to be read and sorted.
+            return BookStream(self._iter_indexed(ordering, offset, limit), ordering)
+        # open eagerly so that a missing database fails here rather than
+        # part way through whichever stage consumes the books.
+        db = self.db_path.open("r")
+        stop = None if limit is None else offset + limit
+        return islice(self._stream(db, self._overlay()), offset, stop)
+
+    def save(self, book_list: BookList) -> BookList:
+        with self.locked():
+            catalog = Catalog(book_list)
+            catalog.next_id = max(catalog.next_id, self._high_water())
+            tmp_path = self.db_path.with_name(self.db_path.name + ".tmp")
+            with tmp_path.open("wb") as db:
+                positions = write_snapshot(db, book_list, self.codec, self.indent)
+            os.replace(tmp_path, self.db_path)
+            # the search table is only kept up once something has searched
+            self.index.write(
+                stat_fingerprint(self.db_path),
+                positions,
+                catalog.next_id,
+                search=self.index.has_search(),
+            )
+            self._truncate_journal()
+            CATALOG_CACHE.put(self._key, self._fingerprint(), catalog)
+        return book_list
+
+    def next_id(self) -> int:
+        catalog = CATALOG_CACHE.get(self._key, self._fingerprint())
+        if catalog is not None:
+            return catalog.next_id
+        # opening the index rebuilds it if it is stale, so that its high-water
+        # mark covers every book in the snapshot.
+        with self._indexed_snapshot():
+            return self._replay()[1]
+
+    def reserve_ids(self, count: int) -> int:
+        with self.locked():
+            next_id = self.next_id()
+            self._commit(
+                [{"op": "ids", "next_id": next_id + count}],
+                lambda catalog: catalog.reserve(count),
+            )
+        return next_id
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        if self._locked or fcntl is None:
+            yield
+            return
+        with self.lock_path.open("a") as lock:
+            # released when the file is closed
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._locked = True
+            try:
+                yield
+            finally:
+                self._locked = False
+
+    def append(self, books: BookList) -> BookList:
+        self._commit(
+            [{"op": "add", "book": book} for book in books],
+            lambda catalog: catalog.add(books),
+        )
+        return books
+
+    def isbn_ids(self, isbns: Iterable[str]) -> Dict[str, int]:
+        catalog = CATALOG_CACHE.get(self._key, self._fingerprint())
+        if catalog is not None:
+            return catalog.isbn_ids(isbns)
+        overlay = self._overlay()
+        with self._indexed_snapshot() as (_, index):
+            return self._isbn_ids(index, list(isbns), overlay)
+
+    def find_isbn(self, isbn: str) -> Optional[Book]:
+        catalog = CATALOG_CACHE.get(self._key, self._fingerprint())
+        if catalog is not None:
+            return next(iter(catalog.find_isbn(isbn)), None)
+        overlay = self._overlay()
+        with self._indexed_snapshot() as (db, index):
+            id = self._isbn_ids(index, [isbn], overlay).get(isbn)
+            return None if id is None else self._books(db, index, [id], overlay)[0]
+
+    def search(self, query: str) -> BookList:
+        catalog = CATALOG_CACHE.get(self._key, self._fingerprint())
+        if catalog is not None:
+            return catalog.search(query)
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        overlay = self._overlay()
+        with self._indexed_snapshot() as (db, index):
+            indexed = any(len(t) >= 3 for t in tokens) and self._search_table(index)
+            where, params = _search_where(tokens, indexed)
+            rows = index.execute(f"SELECT id FROM books WHERE {where}", params)
+            # the journal's deletes and adds are not in the snapshot's index
+            ids = {id for (id,) in rows if not _replaced(overlay.get(id))}
+            added = [change for change in overlay.values() if _added(change)]
+            ids.update(index_books(added).search(query))
+            return self._books(db, index, sorted(ids), overlay)
+
+    def update_statuses(self, ids: Iterable[int], status: Status) -> BookList:
+        ids = list(dict.fromkeys(ids))
+        with self.locked():
+            books = [Book(book, status=status) for book in self._get_books(ids)]
+            self._commit(
+                [{"op": "status", "id": id, "status": status} for id in ids],
+                lambda catalog: [catalog.update_status(id, status) for id in ids],
+            )
+        return books
+
+    def delete_many(self, ids: Iterable[int]) -> BookList:
+        ids = list(dict.fromkeys(ids))
+        with self.locked():
+            books = self._get_books(ids)
+            self._commit(
+                [{"op": "delete", "id": id} for id in ids],
+                lambda catalog: [catalog.remove(id) for id in ids],
+            )
+        return books
+
+    def compact(self) -> BookList:
+        return self.save(self._catalog().books())
+
+    @property
+    def _key(self) -> Path:
+        return self.db_path.absolute()
+
+    def _fingerprint(self) -> Hashable:
+        return stat_fingerprint(self.db_path), stat_fingerprint(self.journal_path)
+
+    def _catalog(self) -> Catalog:
+        fingerprint = self._fingerprint()
+        catalog = CATALOG_CACHE.get(self._key, fingerprint)
+        if catalog is None:
+            overlay, next_id = self._replay()
+            catalog = Catalog(self._parse(overlay))
+            catalog.next_id = max(catalog.next_id, next_id)
+            CATALOG_CACHE.put(self._key, fingerprint, catalog)
+        return catalog
+
+    def _iter_indexed(
+        self, ordering: Ordering, offset: int = 0, limit: int = None
+    ) -> Iterator[Book]:
+        """
+        the books in `ordering`, walked through the snapshot index so that only
+        the books that are yielded are read. the books the journal has changed
+        are sorted on their own and merged in.
+        """
+        overlay = self._overlay()
+        # opened now rather than when the books are consumed, so that a missing
+        # database fails here and not part way through whichever stage reads
+        # them. the stream closes them once it is done.
+        with ExitStack() as stack:
+            db, index = stack.enter_context(self._indexed_snapshot())
+            key = SNAPSHOT_ORDER_BY[Ordering(ordering)]
+            rows = index.execute(
+                f"SELECT {key}, id, offset, length FROM books ORDER BY {key}, id"
+            )
+            ids = [id for id, change in overlay.items() if change is not DELETED]
+            changed = self._books(db, index, ids, overlay)
+            ordering_key = lookup_ordering_key(ordering)
+            changed = sorted((ordering_key(book), book["id"], book) for book in changed)
+            unchanged = (row for row in rows if row[1] not in overlay)
+            merged = heapq.merge(unchanged, changed, key=itemgetter(0, 1))
+            stop = None if limit is None else offset + limit
+            entries = islice(merged, offset, stop)
+            return self._read_entries(stack.pop_all(), db, entries)
+
+    def _read_entries(
+        self, stack: ExitStack, db: BinaryIO, entries: Iterator[tuple]
+    ) -> Iterator[Book]:
+        with stack:
+            for entry in entries:
+                if len(entry) == 3:
+                    yield entry[2]
+                else:
+                    db.seek(entry[2])
+                    yield Book(**self.codec.loads(db.read(entry[3])))
+
+    def _get_books(self, ids: List[int]) -> BookList:
+        """the books with these ids, from the cached catalog or the snapshot index."""
+        catalog = CATALOG_CACHE.get(self._key, self._fingerprint())
+        if catalog is not None:
+            return [catalog.get(id) for id in ids]
+        overlay = self._overlay()
+        with self._indexed_snapshot() as (db, index):
+            return self._books(db, index, ids, overlay)
+
+    def _parse(self, overlay: Dict[int, Any]) -> Iterable[Book]:
+        with self.db_path.open("rb") as db:
+            book_list = self.codec.loads(db.read())
+        return self._apply(book_list, overlay) if overlay else book_list
+
+    def _high_water(self) -> int:
+        catalog = CATALOG_CACHE.get(self._key, self._fingerprint())
+        return catalog.next_id if catalog else self._replay()[1]
+
+    def _commit(
+        self, entries: Iterable[Dict[str, Any]], change: Callable[[Catalog], Any]
+    ) -> None:
+        with self.locked():
+            catalog = CATALOG_CACHE.get(self._key, self._fingerprint())
+            lines = b"".join(self.codec.dumps(entry) + b"\n" for entry in entries)
+            try:
+                self._append_journal(lines)
+            except OSError:
+                CATALOG_CACHE.discard(self._key)
+                raise
+            # the journal has grown by exactly this change, so a cached catalog
+            # stays valid once the change is applied and it is re-keyed. without
+            # one, the journal is all that needs writing.
+            if catalog is not None:
+                change(catalog)
+                CATALOG_CACHE.put(self._key, self._fingerprint(), catalog)
+            limit = min(self.db_path.stat().st_size, self.max_journal)
+            if self._journal_size() > max(self.compact_after, limit):
+                self.compact()
+
+    def _append_journal(self, lines: bytes) -> None:
+        with self.journal_path.open("a+b") as journal:
+            end = journal.seek(0, os.SEEK_END)
+            journal.seek(max(end - 1, 0))
+            if end and journal.read(1) != b"\n":
+                # a write interrupted part way through left an unterminated last
+                # line. it is cut off, or this write would be joined onto it.
+                journal.truncate(self._line_start(journal, end))
+            journal.write(lines)
+
+    @staticmethod
+    def _line_start(journal: BinaryIO, end: int) -> int:
+        """where the last line of the journal, ending at `end`, starts."""
+        while end > 0:
+            start = max(end - CHUNK_SIZE, 0)
+            journal.seek(start)
+            newline = journal.read(end - start).rfind(b"\n")
+            if newline != -1:
+                return start + newline + 1
+            end = start
+        return 0
+
+    @contextmanager
+    def _indexed_snapshot(self) -> Iterator[Tuple[BinaryIO, sqlite3.Connection]]:
+        """
+        the snapshot, open, and a connection to its index, which is rebuilt
+        first if it is missing or was built from a different snapshot. the
+        snapshot is checked through the open file, so the two always agree.
+        """
+        with self.db_path.open("rb") as db:
+            snapshot = stat_fingerprint(db.fileno())
+            index = self.index.open(snapshot)
+            if index is None:
+                positions = list(scan_snapshot(db.read()))
+                next_id = max((book["id"] + 1 for book, _, _ in positions), default=0)
+                next_id = max(next_id, self.index.next_id())
+                self.index.write(snapshot, positions, next_id)
+                index = self.index.open(snapshot)
+            with closing(index):
+                yield db, index
+
+    @staticmethod
+    def _isbn_ids(
+        index: sqlite3.Connection, isbns: List[str], overlay: Dict[int, Any]
+    ) -> Dict[str, int]:
+        ids = {}
+        # stay well under sqlite's limit on the number of bound parameters
+        for start in range(0, len(isbns), SQLITE_MAX_PARAMETERS):
+            chunk = isbns[start : start + SQLITE_MAX_PARAMETERS]
+            rows = index.execute(
+                "SELECT isbn, id FROM books WHERE isbn IN "
+                f"({', '.join('?' * len(chunk))}) ORDER BY id",
+                chunk,
+            )
+            for isbn, id in rows:
+                if not _replaced(overlay.get(id)):
+                    ids.setdefault(isbn, id)
+        wanted = set(isbns)
+        for id, change in overlay.items():
+            if _added(change) and change["isbn"] in wanted:
+                ids[change["isbn"]] = min(ids.get(change["isbn"], id), id)
+        return ids
+
+    def _books(
+        self,
+        db: BinaryIO,
+        index: sqlite3.Connection,
+        ids: Iterable[int],
+        overlay: Dict[int, Any],
+    ) -> BookList:
+        """the books with these ids, read from where they are in the snapshot."""
+        books = []
+        for id in ids:
+            change = overlay.get(id)
+            if change is DELETED:
+                raise id_error(id)
+            if _added(change):
+                books.append(Book(**change))
+                continue
+            row = index.execute(
+                "SELECT offset, length FROM books WHERE id = ?", (id,)
+            ).fetchone()
+            if row is None:
+                raise id_error(id)
+            db.seek(row[0])
+            book = Book(**self.codec.loads(db.read(row[1])))
+            book.update(change or {})
+            books.append(book)
+        return books
+
+    def _search_table(self, index: sqlite3.Connection) -> bool:
+        """
+        whether the snapshot index has its search table, building it for the
+        first search. sqlite builds without one are searched with LIKE alone.
+        """
+        if not self.index.searchable(index):
+            self.index.add_search()
+        return self.index.searchable(index)
+
+    def _journal_size(self) -> int:
+        try:
+            return self.journal_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _truncate_journal(self) -> None:
+        try:
+            self.journal_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _entries(self) -> List[Dict[str, Any]]:
+        try:
+            with self.journal_path.open("rb") as journal:
+                lines = journal.read().split(b"\n")
+        except FileNotFoundError:
+            return []
+        # a write interrupted part way through leaves an unterminated last line.
+        # the mutation it describes never completed, so it is dropped, as is any
+        # line that does not decode.
+        entries = []
+        for line in lines[:-1]:
+            try:
+                entries.append(self.codec.loads(line))
+            except ValueError:
+                continue
+        return entries
+
+    def _overlay(self) -> Dict[int, Any]:
+        return self._replay()[0]
+
+    def _replay(self) -> Tuple[Dict[int, Any], int]:
+        """
+        fold the journal into the final change for each id it touches: a whole
+        book for adds, DELETED for deletes, or a partial {"status": ...} update.
+        changes are keyed by id so that entries already folded into the snapshot
+        by an interrupted compaction are applied idempotently. also returns the
+        id high-water mark, from the snapshot index and the ids added or reserved
+        since it was written. the result is shared until the journal or the
+        index changes, so it must not be modified.
+        """
+        key = stat_fingerprint(self.journal_path), stat_fingerprint(self.index_path)
+        if self._replayed is None or self._replayed[0] != key:
+            self._replayed = key, *self._fold()
+        return self._replayed[1], self._replayed[2]
+
+    def _fold(self) -> Tuple[Dict[int, Any], int]:
+        overlay = {}
+        next_id = self.index.next_id()
+        for entry in self._entries():
+            op = entry["op"]
+            if op == "add":
+                overlay[entry["book"]["id"]] = Book(**entry["book"])
+                next_id = max(next_id, entry["book"]["id"] + 1)
+            elif op == "delete":
+                overlay[entry["id"]] = DELETED
+            elif op == "status" and overlay.get(entry["id"]) is not DELETED:
+                overlay.setdefault(entry["id"], {})["status"] = entry["status"]
+            elif op == "ids":
+                next_id = max(next_id, entry["next_id"])
+        return overlay, next_id
+
+    @staticmethod
+    def _apply(books: Iterable[Book], overlay: Dict[int, Any]) -> Iterator[Book]:
+        # the overlay is shared, so the books it holds are copied, not yielded
+        added = dict.fromkeys(id for id, change in overlay.items() if _added(change))
+        for book in books:
+            change = overlay.get(book["id"])
+            if change is None:
+                yield book
+            elif change is DELETED:
+                continue
+            elif _added(change):
+                added.pop(book["id"], None)
+                yield Book(**change)
+            else:
+                book.update(change)
+                yield book
+        for id in added:
+            yield Book(**overlay[id])
+
+    def _stream(self, db: TextIO, overlay: Dict[int, Any]) -> Iterator[Book]:
+        with db:
+            books = iter_json_array(db, object_hook=lambda d: Book(**d))
+            yield from self._apply(books, overlay)
+
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+BOOK_COLUMNS = ("id", "isbn", "title", "author_fname", "author_lname", "status")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    isbn TEXT,
+    title TEXT,
+    author_fname TEXT,
+    author_lname TEXT,
+    status TEXT,
+    terms TEXT
+);
+CREATE INDEX IF NOT EXISTS books_isbn ON books (isbn);
+CREATE INDEX IF NOT EXISTS books_author ON books (author_lname || ', ' || author_fname);
+CREATE INDEX IF NOT EXISTS books_title ON books (title);
+CREATE INDEX IF NOT EXISTS books_status ON books (status);
+"""
+
+SQLITE_META = "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+
+# an external content fts5 table over the books' casefolded terms, kept in
+# step with them by triggers. the trigram tokenizer matches any substring of
+# three or more characters.
+SQLITE_SEARCH = """
+CREATE VIRTUAL TABLE books_search USING fts5(
+    terms, content='books', content_rowid='id', tokenize='trigram case_sensitive 1'
+);
+CREATE TRIGGER books_search_insert AFTER INSERT ON books BEGIN
+    INSERT INTO books_search (rowid, terms) VALUES (new.id, new.terms);
+END;
+CREATE TRIGGER books_search_delete AFTER DELETE ON books BEGIN
+    INSERT INTO books_search (books_search, rowid, terms)
+    VALUES ('delete', old.id, old.terms);
+END;
+CREATE TRIGGER books_search_update AFTER UPDATE OF terms ON books BEGIN
+    INSERT INTO books_search (books_search, rowid, terms)
+    VALUES ('delete', old.id, old.terms);
+    INSERT INTO books_search (rowid, terms) VALUES (new.id, new.terms);
+END;
+INSERT INTO books_search (books_search) VALUES ('rebuild');
+"""
+
+# PRAGMA user_version of the schema above. databases from before the terms
+# column (version 0) are upgraded when they are opened.
+SQLITE_VERSION = 1
+
+# what an older search table and its triggers are dropped with, to be built
+# again over the terms.
+SQLITE_DROP_SEARCH = """
+DROP TRIGGER IF EXISTS books_search_insert;
+DROP TRIGGER IF EXISTS books_search_delete;
+DROP TRIGGER IF EXISTS books_search_update;
+DROP TABLE IF EXISTS books_search;
+"""
+
+SQLITE_MAX_PARAMETERS = 500
+
+# mirrors listbooks.lookup_ordering_key so that each ordering is served by an index.
+SQLITE_ORDER_BY = {
+    Ordering.DEFAULT: "id",
+    Ordering.AUTHOR: "author_lname || ', ' || author_fname, id",
+    Ordering.TITLE: "title, id",
+    Ordering.ISBN: "isbn, id",
+    Ordering.STATUS: "status, id",
+}
+
+
+class SqliteStorage(Storage):
+    """
+    a sqlite database with indexes on id, isbn, author, title and status, so that
+    status updates and deletes are point operations and listing in any ordering
+    is an index walk.
+    """
+
+    def create(self) -> None:
+        if self.db_path.exists():
+            self.db_path.unlink()
+        with closing(self._connect()) as conn:
+            conn.executescript(
+                SQLITE_SCHEMA
+                + SQLITE_META
+                + f"; PRAGMA user_version = {SQLITE_VERSION};"
+            )
+            self._search_table(conn)
+
+    def load(self, ordering: Optional[Ordering] = None) -> BookList:
+        order_by = SQLITE_ORDER_BY[Ordering(ordering) if ordering else Ordering.DEFAULT]
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT {self._columns} FROM books ORDER BY {order_by}"
+            )
+            books = [self._book(row) for row in rows]
+        return OrderedBookList(books, ordering) if ordering else books
+
+    def iter_books(
+        self, ordering: Optional[Ordering] = None, offset: int = 0, limit: int = None
+    ) -> Iterable[Book]:
+        conn = self._connect()
+        rows = conn.execute(
+            f"SELECT {self._columns} FROM books ORDER BY {self._order_by(ordering)} "
+            "LIMIT ? OFFSET ?",
+            (-1 if limit is None else limit, offset),
+        )
+        return BookStream(self._stream(conn, rows), ordering)
+
+    def save(self, book_list: BookList) -> BookList:
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM books")
+            self._insert_rows(conn, book_list)
+        return book_list
+
+    def next_id(self) -> int:
+        with closing(self._connect()) as conn:
+            return self._next_id(conn)
+
+    def reserve_ids(self, count: int) -> int:
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            next_id = self._next_id(conn)
+            self._set_next_id(conn, next_id + count)
+        return next_id
+
+    def append(self, books: BookList) -> BookList:
+        with closing(self._connect()) as conn, conn:
+            self._insert_rows(conn, books)
+        return books
+
+    def insert(self, books: BookList, check: IsbnCheck = check_unique) -> BookList:
+        # check, allocate and insert in one transaction so concurrent adds
+        # cannot collide.
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            books = check(books, self._isbn_ids(conn, [b.get("isbn") for b in books]))
+            if not books:
+                return books
+            next_id = self._next_id(conn)
+            for offset, book in enumerate(books):
+                book["id"] = next_id + offset
+            self._insert_rows(conn, books)
+            self._set_next_id(conn, next_id + len(books))
+        return books
+
+    def isbn_ids(self, isbns: Iterable[str]) -> Dict[str, int]:
+        with closing(self._connect()) as conn:
+            return self._isbn_ids(conn, list(isbns))
+
+    def find_isbn(self, isbn: str) -> Optional[Book]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                f"SELECT {self._columns} FROM books WHERE isbn = ? ORDER BY id LIMIT 1",
+                (isbn,),
+            ).fetchone()
+        return None if row is None else self._book(row)
+
+    def search(self, query: str) -> BookList:
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        with closing(self._connect()) as conn:
+            indexed = any(len(t) >= 3 for t in tokens) and self._search_table(conn)
+            where, params = _search_where(tokens, indexed)
+            rows = conn.execute(
+                f"SELECT {self._columns} FROM books WHERE {where} ORDER BY id", params
+            )
+            return [self._book(row) for row in rows]
+
+    def update_statuses(self, ids: Iterable[int], status: Status) -> BookList:
+        ids = list(dict.fromkeys(ids))
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # a missing id raises here and rolls the transaction back
+            books = [Book(self._select(conn, id), status=status) for id in ids]
+            conn.executemany(
+                "UPDATE books SET status = ? WHERE id = ?", [(status, id) for id in ids]
+            )
+        return books
+
+    def delete_many(self, ids: Iterable[int]) -> BookList:
+        ids = list(dict.fromkeys(ids))
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            books = [self._select(conn, id) for id in ids]
+            conn.executemany("DELETE FROM books WHERE id = ?", [(id,) for id in ids])
+        return books
+
+    @property
+    def _columns(self) -> str:
+        return ", ".join(BOOK_COLUMNS)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SQLITE_VERSION:
+            self._upgrade(conn)
+        return conn
+
+    @staticmethod
+    def _upgrade(conn: sqlite3.Connection) -> None:
+        """
+        add the casefolded terms that search matches to a database made before
+        they were kept, and build the search table over them again.
+        """
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # another process may have upgraded it, or it may not be a database yet
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= SQLITE_VERSION:
+                return
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(books)")}
+            if not columns:
+                return
+            if "terms" not in columns:
+                conn.execute("ALTER TABLE books ADD COLUMN terms TEXT")
+            rows = conn.execute(f"SELECT {', '.join(BOOK_COLUMNS)} FROM books")
+            conn.executemany(
+                "UPDATE books SET terms = ? WHERE id = ?",
+                [(terms_text(Book(zip(BOOK_COLUMNS, row))), row[0]) for row in rows],
+            )
+            for statement in SQLITE_DROP_SEARCH.split(";"):
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {SQLITE_VERSION}")
+
+    @staticmethod
+    def _order_by(ordering: Optional[Ordering]) -> str:
+        return SQLITE_ORDER_BY[Ordering(ordering) if ordering else Ordering.DEFAULT]
+
+    def _stream(self, conn: sqlite3.Connection, rows: sqlite3.Cursor) -> Iterator[Book]:
+        with closing(conn):
+            for row in rows:
+                yield self._book(row)
+
+    @staticmethod
+    def _isbn_ids(conn: sqlite3.Connection, isbns: List[str]) -> Dict[str, int]:
+        ids = {}
+        # stay well under sqlite's limit on the number of bound parameters
+        for start in range(0, len(isbns), SQLITE_MAX_PARAMETERS):
+            chunk = isbns[start : start + SQLITE_MAX_PARAMETERS]
+            rows = conn.execute(
+                "SELECT isbn, MIN(id) FROM books WHERE isbn IN "
+                f"({', '.join('?' * len(chunk))}) GROUP BY isbn",
+                chunk,
+            )
+            ids.update(rows)
+        return ids
+
+    @staticmethod
+    def _next_id(conn: sqlite3.Connection) -> int:
+        # the high-water mark is kept in meta so deleting the newest book does
+        # not free its id. the max id covers rows saved or appended with ids.
+        conn.execute(SQLITE_META)  # databases created before meta existed
+        row = conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        (max_id,) = conn.execute("SELECT MAX(id) FROM books").fetchone()
+        return max(0 if row is None else row[0], 0 if max_id is None else max_id + 1)
+
+    @staticmethod
+    def _search_table(conn: sqlite3.Connection) -> bool:
+        """
+        whether the fts5 search table exists, creating it for databases made
+        before it did. sqlite builds without fts5 or the trigram tokenizer
+        (3.34+) have none, and are searched with LIKE alone.
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'books_search'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            conn.executescript("BEGIN IMMEDIATE;" + SQLITE_SEARCH + "COMMIT;")
+        except sqlite3.OperationalError:
+            conn.rollback()
+            return False
+        return True
+
+    @staticmethod
+    def _set_next_id(conn: sqlite3.Connection, next_id: int) -> None:
+        conn.execute(
+            "INSERT INTO meta VALUES ('next_id', ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)",
+            (next_id,),
+        )
+
+    def _select(self, conn: sqlite3.Connection, id: int) -> Book:
+        row = conn.execute(
+            f"SELECT {self._columns} FROM books WHERE id = ?", (id,)
+        ).fetchone()
+        if row is None:
+            raise id_error(id)
+        return self._book(row)
+
+    def _insert_rows(self, conn: sqlite3.Connection, books: BookList) -> None:
+        conn.executemany(
+            f"INSERT INTO books ({self._columns}, terms) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (*(book[column] for column in BOOK_COLUMNS), terms_text(book))
+                for book in books
+            ),
+        )
+
+    @staticmethod
+    def _book(row: tuple) -> Book:
+        return Book(zip(BOOK_COLUMNS, row))
+
+
+def _search_where(tokens: Set[str], indexed: bool) -> Tuple[str, List[str]]:
+    """
+    the where clause, and its parameters, for the books with a term containing
+    every token, matched against the casefolded terms column as SearchIndex
+    would match them. indexed says whether the books_search trigram table can
+    be used. it cannot serve tokens shorter than three characters, so those
+    are looked for in the terms of the rows the table narrows to.
+    """
+    matched = [t for t in tokens if len(t) >= 3] if indexed else []
+    params = [t for t in tokens if t not in matched]
+    where = ["instr(terms, ?) > 0"] * len(params)
+    if matched:
+        where.insert(
+            0, "id IN (SELECT rowid FROM books_search WHERE books_search MATCH ?)"
+        )
+        params.insert(0, " AND ".join(f'"{t}"' for t in matched))
+    return " AND ".join(where), params
+
+
+def detect_backend(db_path: Path) -> Backend:
+    try:
+        with Path(db_path).open("rb") as db:
+            header = db.read(len(SQLITE_HEADER))
+    except FileNotFoundError:
+        return Backend.JSON
+    return Backend.SQLITE if header == SQLITE_HEADER else Backend.JSON
+
+
+def open_storage(
+    db_path: Path, backend: Optional[Backend] = None, **options
+) -> Storage:
+    """options are passed on to the json backend and ignored by sqlite."""
+    backend = Backend(backend) if backend else detect_backend(db_path)
+    if backend is Backend.SQLITE:
+        return SqliteStorage(db_path)
+    return JournalStorage(db_path, **options)
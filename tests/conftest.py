@@ -2,12 +2,16 @@ import json
 import random
 import string
 from pathlib import Path
+from typing import Callable
 
 import pkg_resources
 from _pytest.fixtures import fixture
 
 from booker.bookerdataclasses import BookList, Book
+from booker.catalog import CATALOG_CACHE
+from booker.config import SETTINGS, config_file_path
 from booker import __app_name__
+from booker.storage import JournalStorage
 
 
 @fixture(scope="session")
@@ -16,6 +20,17 @@ def mock_dir(tmp_path_factory) -> Path:
     yield base
 
 
+@fixture(autouse=True)
+def clear_catalog_cache():
+    CATALOG_CACHE.clear()
+    SETTINGS.clear()
+    config_file_path.cache.clear()
+    yield
+    CATALOG_CACHE.clear()
+    SETTINGS.clear()
+    config_file_path.cache.clear()
+
+
 @fixture(scope="function")
 def mock_json_db_location(mock_dir, request) -> Path:
     if len(request.param) > 1:
@@ -75,6 +90,19 @@ def mock_book_list(raw_mock_data) -> BookList:
     return json.loads(raw_mock_data, object_hook=lambda d: Book(**d))
 
 
+@fixture
+def journal_storage(tmp_path) -> Callable[..., JournalStorage]:
+    """makes a json database at tmp_path/books.json holding the given books."""
+
+    def make(book_list: BookList, **kwargs) -> JournalStorage:
+        storage = JournalStorage(tmp_path / "books.json", **kwargs)
+        storage.create()
+        storage.save(book_list)
+        return storage
+
+    return make
+
+
 @fixture(scope="session")
 def mock_booker_app(mock_db_file):
     mock_db_file.write_text("[]")
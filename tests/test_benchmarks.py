@@ -0,0 +1,322 @@
+import subprocess
+import sys
+import timeit
+import tracemalloc
+from itertools import islice
+from pathlib import Path
+
+import pytest
+
+from booker.bookerdataclasses import Ordering, Status
+from booker.catalog import CATALOG_CACHE, Catalog
+from booker.codec import StdlibCodec, get_codec
+from booker.control import outcome
+from booker.database import json_to_yaml
+from booker.storage import JournalStorage, SqliteStorage
+
+BENCHMARK_BOOKS = 20000
+
+
+def _allocated_bytes(build) -> int:
+    tracemalloc.start()
+    try:
+        kept = build()
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return allocated
+
+
+def _peak_bytes(run) -> int:
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+@pytest.fixture(scope="module")
+def many_books(mock_book_list):
+    books = mock_book_list * (BENCHMARK_BOOKS // len(mock_book_list) + 1)
+    return [{**book, "id": i} for i, book in enumerate(books[:BENCHMARK_BOOKS])]
+
+
+@pytest.mark.benchmark
+def test_catalog_bytes_per_book(many_books):
+    # both forms reference the fixture's strings, so this compares the
+    # per-book container overhead that parsing a catalog pays for.
+    as_dicts = _allocated_bytes(lambda: [dict(book) for book in many_books])
+    as_records = _allocated_bytes(lambda: Catalog(many_books))
+    print(
+        f"\nbytes per book: dict {as_dicts / BENCHMARK_BOOKS:.0f}, "
+        f"record {as_records / BENCHMARK_BOOKS:.0f}"
+    )
+    assert as_records < as_dicts / 2
+
+
+# how much faster the native codec must dump than the stdlib one. it is
+# usually three times as fast or more, so this only catches a fallback to a
+# slow path, not noise from whatever else the machine is running. loading is
+# only reported: building the dicts dominates it, which neither codec avoids.
+NATIVE_DUMPS_SPEEDUP = 1.5
+
+
+@pytest.mark.benchmark
+def test_native_codec_is_faster_than_stdlib(many_books):
+    codec = get_codec()
+    if codec.name == StdlibCodec.name:
+        pytest.skip("no native json library is installed")
+    stdlib = StdlibCodec()
+    data = stdlib.dumps(many_books, indent=True)
+    timings = {}
+    for candidate in (stdlib, codec):
+        timings[candidate.name] = {
+            "loads": min(
+                timeit.repeat(lambda: candidate.loads(data), number=3, repeat=5)
+            ),
+            "dumps": min(
+                timeit.repeat(
+                    lambda: candidate.dumps(many_books, indent=True),
+                    number=3,
+                    repeat=5,
+                )
+            ),
+        }
+        assert candidate.loads(data) == many_books
+    print(f"\n3 loads and 3 dumps of {BENCHMARK_BOOKS} books: {timings}")
+    native, baseline = timings[codec.name]["dumps"], timings[stdlib.name]["dumps"]
+    assert native * NATIVE_DUMPS_SPEEDUP < baseline
+
+
+# the pure python dumper is slow enough that timing it on fewer books will do.
+YAML_BENCHMARK_BOOKS = 2000
+
+
+def _dump_each_book(books, write_path):
+    import yaml
+
+    with open(write_path, "w") as outfile:
+        for book in books:
+            yaml.dump([book], outfile, default_flow_style=False)
+
+
+@pytest.mark.benchmark
+def test_yaml_export_is_fast_and_streams(many_books, tmp_path):
+    import yaml
+
+    if not yaml.__with_libyaml__:
+        pytest.skip("pyyaml was built without libyaml")
+    write_path = tmp_path / "export.yaml"
+    books = many_books[:YAML_BENCHMARK_BOOKS]
+    timings = {
+        name: min(
+            timeit.repeat(lambda: export(iter(books), write_path), number=1, repeat=3)
+        )
+        for name, export in (("per book", _dump_each_book), ("batched", json_to_yaml))
+    }
+    # the books are generated one at a time, so the peak only grows with the
+    # catalog if the export holds on to what it has already written.
+    peaks = {
+        size: _peak_bytes(
+            lambda: json_to_yaml(({**book} for book in many_books[:size]), write_path)
+        )
+        for size in (YAML_BENCHMARK_BOOKS, YAML_BENCHMARK_BOOKS * 4)
+    }
+    print(f"\nyaml export of {YAML_BENCHMARK_BOOKS} books: {timings}, peaks {peaks}")
+    assert timings["batched"] < timings["per book"] / 3
+    assert peaks[YAML_BENCHMARK_BOOKS * 4] < peaks[YAML_BENCHMARK_BOOKS] * 1.5
+
+
+ID_BENCHMARK_BOOKS = 100_000
+
+
+@pytest.mark.benchmark
+def test_id_allocation_does_not_grow_with_the_catalog(tmp_path, mock_book_list):
+    timings = {}
+    for size in (1_000, ID_BENCHMARK_BOOKS):
+        books = [
+            {**mock_book_list[i % len(mock_book_list)], "id": i, "isbn": f"{i:013}"}
+            for i in range(size)
+        ]
+        storage = JournalStorage(tmp_path / f"{size}.json")
+        storage.save(books)
+        storage.reserve_ids(3)
+
+        def cold_next_id():
+            # as the first call in a new process would be, without a catalog
+            CATALOG_CACHE.clear()
+            return storage.next_id()
+
+        timings[size] = min(timeit.repeat(cold_next_id, number=100, repeat=5))
+        assert cold_next_id() == size + 3
+    print(f"\n100 cold id lookups by catalog size: {timings}")
+    assert timings[ID_BENCHMARK_BOOKS] < timings[1_000] * 3
+
+
+@pytest.mark.benchmark
+def test_cold_update_with_a_full_journal(tmp_path, mock_book_list):
+    books = [
+        {**mock_book_list[i % len(mock_book_list)], "id": i, "isbn": f"{i:013}"}
+        for i in range(ID_BENCHMARK_BOOKS)
+    ]
+    storage = JournalStorage(tmp_path / "books.json")
+    storage.save(books)
+    statuses = ("finished", "reading", "unread")
+
+    def cold_update(i):
+        # as `booker update` in a new process would, without a catalog
+        CATALOG_CACHE.clear()
+        storage.update_status(i % ID_BENCHMARK_BOOKS, statuses[i % 3])
+
+    empty = min(timeit.repeat(lambda: cold_update(0), number=1, repeat=5))
+    # fill the journal to just under the size that compacts it
+    updates = iter(range(1, ID_BENCHMARK_BOOKS))
+    while storage._journal_size() < storage.max_journal - 4096:
+        ids = list(islice(updates, 50))
+        storage.update_statuses(ids, Status.FINISHED)
+    full = min(timeit.repeat(lambda: cold_update(1), number=1, repeat=5))
+    assert storage.journal_path.exists()
+    CATALOG_CACHE.clear()
+    parse = min(
+        timeit.repeat(storage.load, setup=CATALOG_CACHE.clear, number=1, repeat=3)
+    )
+    print(
+        f"\ncold update of {ID_BENCHMARK_BOOKS} books: {empty:.4f}s with an empty "
+        f"journal, {full:.4f}s with a full one, {parse:.4f}s to parse the catalog"
+    )
+    assert full < parse / 10
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("ordering", [Ordering.DEFAULT, Ordering.AUTHOR])
+def test_time_to_first_row_does_not_grow_with_the_catalog(
+    tmp_path, mock_book_list, ordering
+):
+    timings = {}
+    for size in (1_000, ID_BENCHMARK_BOOKS):
+        books = [
+            {**mock_book_list[i % len(mock_book_list)], "id": i, "isbn": f"{i:013}"}
+            for i in range(size)
+        ]
+        storage = JournalStorage(tmp_path / f"{size}.json")
+        storage.save(books)
+        storage.delete(0)
+
+        def first_row():
+            # as `booker list` in a new process would, without a catalog
+            CATALOG_CACHE.clear()
+            return next(iter(storage.iter_books(ordering, 0, 20)))
+
+        timings[size] = min(timeit.repeat(first_row, number=20, repeat=5))
+        assert first_row() == storage.load(ordering)[0]
+    print(f"\n20 cold first rows in {ordering.value} order by catalog size: {timings}")
+    assert timings[ID_BENCHMARK_BOOKS] < timings[1_000] * 3
+
+
+SEARCH_BENCHMARK_BOOKS = 100_000
+
+
+def _unique_word(n: int) -> str:
+    # a different made up word for every n, so no two books share their terms
+    n = n * 2654435761 % 2**32 + 26**5
+    letters = []
+    while n:
+        n, letter = divmod(n, 26)
+        letters.append(chr(ord("a") + letter))
+    return "".join(letters)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("storage_type", [JournalStorage, SqliteStorage])
+def test_search_does_not_grow_with_the_catalog(tmp_path, storage_type):
+    timings, first_searches = {}, {}
+    for size in (1_000, SEARCH_BENCHMARK_BOOKS):
+        books = [
+            {
+                "id": i,
+                "isbn": f"{i:013}",
+                "title": f"{_unique_word(3 * i)} {_unique_word(3 * i + 1)}",
+                "author_fname": "Ann",
+                "author_lname": _unique_word(3 * i + 2),
+                "status": "unread",
+            }
+            for i in range(size)
+        ]
+        books[size // 2]["title"] = "Zyzzyva"
+        storage = storage_type(tmp_path / f"{size}.db")
+        storage.create()
+        storage.save(books)
+
+        def cold_search():
+            # as `booker search` in a new process would, without a catalog
+            CATALOG_CACHE.clear()
+            return storage.search("zyzzyva")
+
+        # the first search builds whatever index the backend searches through
+        first_searches[size] = timeit.timeit(cold_search, number=1)
+        timings[size] = min(timeit.repeat(cold_search, number=100, repeat=3))
+        assert [book["id"] for book in cold_search()] == [size // 2]
+    print(
+        f"\nfirst {storage_type.__name__} search by catalog size: {first_searches}"
+        f"\n100 cold {storage_type.__name__} searches by catalog size: {timings}"
+    )
+    assert timings[SEARCH_BENCHMARK_BOOKS] < timings[1_000] * 3
+
+
+# how many times slower a pipeline-style call of an @outcome stage may be than
+# calling the undecorated function directly.
+OUTCOME_OVERHEAD_BUDGET = 20
+
+
+def _isbn_of(book):
+    return book["isbn"]
+
+
+@pytest.mark.benchmark
+def test_outcome_call_overhead(mock_book_list):
+    stage = outcome(requires=("book",), returns="isbn")(_isbn_of)
+    book = mock_book_list[0]
+    raw = min(timeit.repeat(lambda: _isbn_of(book), number=100_000, repeat=3))
+    decorated = min(timeit.repeat(lambda: stage(book=book), number=100_000, repeat=3))
+    print(f"\n@outcome call overhead: {decorated / raw:.1f}x a raw call")
+    assert decorated < raw * OUTCOME_OVERHEAD_BUDGET
+
+
+# cumulative microseconds `python -X importtime` may report for booker.cli,
+# which is everything a cold `booker list` loads before it reads the database.
+STARTUP_BUDGET_US = 200_000
+EXPORT_ONLY_MODULES = ("yaml", "requests", "bs4", "rich")
+# only async pipelines need these, and asyncio brings ssl with it.
+ASYNC_ONLY_MODULES = ("asyncio", "ssl")
+
+
+def _import_cli(*flags: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *flags, "-c", "import sys, booker.cli; print(*sys.modules)"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).parent.parent,
+    )
+
+
+# not a timing, so it runs with the rest of the suite and guards every change.
+def test_cli_startup_skips_export_dependencies():
+    loaded = set(_import_cli().stdout.split())
+    assert loaded.isdisjoint(EXPORT_ONLY_MODULES)
+    assert loaded.isdisjoint(ASYNC_ONLY_MODULES)
+
+
+@pytest.mark.benchmark
+def test_cli_startup_time_budget():
+    _import_cli()  # make sure bytecode is cached so only import work is timed
+    timings = []
+    for _ in range(3):
+        report = _import_cli("-X", "importtime").stderr.splitlines()
+        cli = next(line for line in report if line.endswith("| booker.cli"))
+        timings.append(int(cli.split("|")[1]))
+    print(f"\nbooker.cli import time: {min(timings)}us")
+    assert min(timings) < STARTUP_BUDGET_US
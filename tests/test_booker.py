@@ -3,8 +3,8 @@ from unittest.mock import patch
 import pytest
 
 from booker import config
-from booker.booker import add, get_list
-from booker.bookerdataclasses import Ordering
+from booker.booker import add, get_list, update_status, delete_book
+from booker.bookerdataclasses import Ordering, Backend, Status
 from booker.database import read_books, write_books
 
 
@@ -29,3 +29,26 @@ def test_list_all(mock_config_dir, mock_db_file, mock_book_list):
         outcome = get_list(Ordering.DEFAULT)
         assert outcome.succeeded()
         assert len(outcome.get_key("table_args")[1]) == len(mock_book_list)
+
+
+def test_sqlite_backend(mock_single_book, mock_config_dir, mock_dir):
+    with patch.object(config, "config_dir_path") as cfig:
+        cfig.return_value = mock_config_dir
+        config.init_app(mock_dir / "mock_books.db", None, Backend.SQLITE)
+        added = add(**mock_single_book).resolve()[0]
+        assert update_status(added["id"], Status.FINISHED).succeeded()
+        listed = get_list(Ordering.AUTHOR)
+        assert listed.get_key("book_list").ordering == Ordering.AUTHOR
+        assert listed.get_key("table_args")[1][0][4] == "finished"
+        assert delete_book(added["id"]).succeeded()
+        assert len(read_books().resolve()) == 0
+
+
+def test_list_limit_and_offset(mock_config_dir, mock_db_file, mock_book_list):
+    with patch.object(config, "config_dir_path") as cfig:
+        cfig.return_value = mock_config_dir
+        config.init_app(mock_db_file)
+        write_books(mock_book_list, mock_db_file)
+        _, body = get_list(Ordering.TITLE, 3, 2).get_key("table_args")
+        _, everything = get_list(Ordering.TITLE).get_key("table_args")
+        assert body == everything[2:5]
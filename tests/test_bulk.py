@@ -0,0 +1,94 @@
+import json
+from unittest.mock import patch
+
+import pytest
+from _pytest.python_api import raises
+
+from booker.bulk import import_books, batched, validate_row
+from booker.storage import JournalStorage, SqliteStorage
+
+HEADER = "title,isbn,author_fname,author_lname,status\n"
+
+
+def _csv(tmp_path, rows: str):
+    csv_path = tmp_path / "books.csv"
+    csv_path.write_text(HEADER + rows)
+    return csv_path
+
+
+def test_import_books_assigns_contiguous_ids(tmp_path, mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    rows = "".join(f"title {i},{i:013},First,Last,unread\n" for i in range(5))
+    imported, rejected = import_books(_csv(tmp_path, rows), 2, storage.db_path)
+    assert (imported, rejected) == (5, [])
+    first = max(book["id"] for book in mock_book_list) + 1
+    assert [book["id"] for book in storage.load()[-5:]] == list(range(first, first + 5))
+
+
+@pytest.mark.parametrize("storage_type", [JournalStorage, SqliteStorage])
+def test_import_books_writes_once_per_batch(tmp_path, storage_type):
+    storage = storage_type(tmp_path / "books.db")
+    storage.create()
+    rows = "".join(f"title {i},{i:013},First,Last,\n" for i in range(7))
+    rows += "repeat,0000000000000,First,Last,\n"
+    with patch.object(
+        storage_type, "insert", autospec=True, side_effect=storage_type.insert
+    ) as insert, patch.object(
+        storage_type, "reserve_ids", side_effect=AssertionError
+    ), patch.object(
+        storage_type, "append", autospec=True, side_effect=storage_type.append
+    ) as append:
+        report = import_books(_csv(tmp_path, rows), 3, storage.db_path)
+    assert report.imported == 7 and [line for line, _ in report.rejected] == [9]
+    # the isbns are checked and the ids allocated inside each batch's write
+    assert insert.call_count == 3
+    if storage_type is JournalStorage:
+        assert [len(call.args[1]) for call in append.call_args_list] == [3, 3, 1]
+        entries = storage.journal_path.read_text().splitlines()
+        assert [json.loads(entry)["op"] for entry in entries] == ["add"] * 7
+    assert [book["id"] for book in storage.load()] == list(range(7))
+
+
+def test_import_books_rejects_invalid_rows(tmp_path, journal_storage):
+    storage = journal_storage([])
+    rows = "a,1,b,c,unread\n,2,b,c,unread\nd,3,e,f,lost\n"
+    imported, rejected = import_books(_csv(tmp_path, rows), 10, storage.db_path)
+    assert imported == 1
+    assert [line for line, _ in rejected] == [3, 4]
+    assert rejected[0][1] == "missing title"
+
+
+def test_import_books_rejects_duplicate_isbns(
+    tmp_path, mock_book_list, journal_storage
+):
+    storage = journal_storage(mock_book_list[:1])
+    taken = mock_book_list[0]["isbn"]
+    rows = f"a,{taken},b,c,\nd,2,e,f,\ng,2,h,i,\n"
+    imported, rejected = import_books(_csv(tmp_path, rows), 1, storage.db_path)
+    assert imported == 1
+    assert rejected == [
+        (
+            2,
+            f"there is already a book with isbn {taken} (id {mock_book_list[0]['id']})",
+        ),
+        (4, f"there is already a book with isbn 2 (id {mock_book_list[0]['id'] + 1})"),
+    ]
+
+
+def test_import_books_requires_columns(tmp_path, journal_storage):
+    csv_path = tmp_path / "books.csv"
+    csv_path.write_text("title,isbn\n")
+    with raises(ValueError) as context:
+        import_books(csv_path, 10, journal_storage([]).db_path)
+    assert "author_fname, author_lname" in context.value.__str__()
+
+
+def test_validate_row_defaults_status():
+    book = validate_row(
+        {"title": "t", "isbn": "1", "author_fname": "a", "author_lname": "b"}
+    )
+    assert book["status"] == "unread"
+
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
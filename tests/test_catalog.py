@@ -0,0 +1,84 @@
+import json
+from unittest.mock import patch
+
+from _pytest.python_api import raises
+
+from booker.bookerdataclasses import Status, Ordering
+from booker.catalog import CATALOG_CACHE, Catalog
+from booker.listbooks import order_books
+
+
+def test_repeated_loads_skip_parsing(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    CATALOG_CACHE.clear()
+    with patch.object(storage.codec, "loads", wraps=storage.codec.loads) as parse:
+        assert storage.load() == mock_book_list
+        assert storage.load() == mock_book_list
+        assert list(storage.iter_books()) == mock_book_list
+    # only the snapshot: the id high-water mark is read from its index
+    assert parse.call_count == 1
+    assert CATALOG_CACHE.hits == 2
+
+
+def test_cache_is_invalidated_by_external_writes(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    storage.load()
+    storage.db_path.write_text(json.dumps(mock_book_list[:1]))
+    assert storage.load() == mock_book_list[:1]
+
+
+def test_mutations_write_through_the_cache(
+    mock_book_list, mock_single_book, journal_storage
+):
+    storage = journal_storage(mock_book_list)
+    storage.load()
+    added = storage.insert([{**mock_single_book, "status": Status.UNREAD}])[0]
+    storage.update_status(mock_book_list[0]["id"], Status.FINISHED)
+    storage.delete(mock_book_list[1]["id"])
+    with patch.object(storage.codec, "loads") as parse:
+        cached = storage.load()
+    parse.assert_not_called()
+    CATALOG_CACHE.clear()
+    assert cached == storage.load()
+    assert type(cached[-1]["status"]) is str and cached[-1]["id"] == added["id"]
+
+
+def test_callers_cannot_mutate_the_cache(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    book_list = storage.load()
+    book_list[0]["status"] = "lost"
+    book_list.pop()
+    assert storage.load() == mock_book_list
+
+
+def test_catalog_indexes(mock_book_list):
+    catalog = Catalog({**book} for book in mock_book_list)
+    book = mock_book_list[0]
+    assert catalog.find_isbn(book["isbn"]) == [book]
+    catalog.remove(book["id"])
+    assert catalog.find_isbn(book["isbn"]) == []
+    catalog.add([book])
+    assert catalog.get(book["id"]) == book
+    assert catalog.find_isbn(book["isbn"]) == [book]
+    with raises(KeyError):
+        catalog.get(-1)
+
+
+def test_ordering_indexes_match_order_books(mock_book_list, mock_single_book):
+    catalog = Catalog({**book} for book in mock_book_list)
+    for ordering in Ordering:
+        assert catalog.books(ordering) == order_books(catalog.books(), ordering)
+    catalog.add([{**mock_single_book, "id": 10**6}])
+    catalog.update_status(mock_book_list[0]["id"], Status.FINISHED)
+    catalog.remove(mock_book_list[1]["id"])
+    catalog.add([{**mock_book_list[2], "title": "renamed"}])
+    for ordering in Ordering:
+        assert catalog.books(ordering) == order_books(catalog.books(), ordering)
+
+
+def test_ordered_loads_are_marked_sorted(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    stream = storage.iter_books(Ordering.AUTHOR)
+    assert stream.ordering == Ordering.AUTHOR
+    assert order_books(stream, Ordering.AUTHOR) is stream
+    assert list(stream) == order_books(mock_book_list, Ordering.AUTHOR)
@@ -1,3 +1,4 @@
+import json
 from unittest.mock import patch
 
 import pytest
@@ -5,6 +6,7 @@ from typer.testing import CliRunner
 
 from booker.booker import init
 from booker import __app_name__, __version__, cli, config
+from booker.database import storage, write_books
 
 runner = CliRunner()
 
@@ -57,3 +59,142 @@ def test_add(flags, mock_config_dir, mock_db_file):
         init(mock_db_file)
         result = runner.invoke(cli.app, flags)
         assert result.exit_code == 0
+
+
+@pytest.mark.integration
+def test_bulk_import(mock_config_dir, mock_db_file, tmp_path):
+    csv_path = tmp_path / "books.csv"
+    csv_path.write_text(
+        "title,isbn,author_fname,author_lname,status\n"
+        "Life of Pi,2052822823852,Hale,Vedyaev,unread\n"
+    )
+    with patch.object(config, "config_dir_path") as cfig:
+        cfig.return_value = mock_config_dir
+        init(mock_db_file)
+        result = runner.invoke(cli.app, ["bulk", "import", str(csv_path)])
+        assert result.exit_code == 0
+        assert "1 books were added to the database" in result.stdout
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize(
+    "flags", [["list", "--limit", "2", "--offset", "1"], ["list", "--lazy"]]
+)
+def test_list(flags, mock_config_dir, mock_db_file, mock_book_list):
+    with patch.object(config, "config_dir_path") as cfig:
+        cfig.return_value = mock_config_dir
+        init(mock_db_file)
+        write_books(mock_book_list[:3], mock_db_file)
+        result = runner.invoke(cli.app, flags)
+        assert result.exit_code == 0
+        isbns = [book["isbn"] for book in mock_book_list[:3]]
+        shown = [isbn for isbn in isbns if isbn in result.stdout]
+        assert shown == (isbns[1:3] if "--limit" in flags else isbns)
+
+
+@pytest.mark.integration
+def test_list_past_the_end(mock_config_dir, mock_db_file):
+    with patch.object(config, "config_dir_path") as cfig:
+        cfig.return_value = mock_config_dir
+        init(mock_db_file)
+        result = runner.invoke(cli.app, ["list", "--lazy", "--offset", "5"])
+        assert "There are no books after the first 5" in result.stdout
+
+
+@pytest.mark.integration
+def test_profile(mock_config_dir, mock_db_file, tmp_path):
+    trace_path = tmp_path / "trace.json"
+    with patch.object(config, "config_dir_path") as cfig:
+        cfig.return_value = mock_config_dir
+        init(mock_db_file)
+        result = runner.invoke(
+            cli.app, ["--profile", "--profile-trace", str(trace_path), "list"]
+        )
+        assert result.exit_code == 0
+        assert "stream_books" in result.stdout
+        events = json.loads(trace_path.read_text())["traceEvents"]
+        assert [event["name"] for event in events] == ["stream_books", "fmt_table"]
+
+
+@pytest.mark.integration
+def test_get(mock_config_dir, mock_db_file, mock_book_list):
+    with patch.object(config, "config_dir_path") as cfig:
+        cfig.return_value = mock_config_dir
+        init(mock_db_file)
+        write_books(mock_book_list[:3], mock_db_file)
+        result = runner.invoke(cli.app, ["get", "--isbn", mock_book_list[1]["isbn"]])
+        assert result.exit_code == 0
+        assert mock_book_list[1]["isbn"] in result.stdout
+        assert mock_book_list[0]["isbn"] not in result.stdout
+        result = runner.invoke(cli.app, ["get", "--isbn", "missing"])
+        assert result.exit_code == 1
+        assert "there is no book with isbn missing" in result.stdout
+
+
+@pytest.mark.integration
+def test_update_and_delete_several_books(mock_config_dir, mock_db_file, mock_book_list):
+    with patch.object(config, "config_dir_path") as cfig:
+        cfig.return_value = mock_config_dir
+        init(mock_db_file)
+        write_books(mock_book_list[:3], mock_db_file)
+        ids = [str(book["id"]) for book in mock_book_list[:2]]
+        result = runner.invoke(
+            cli.app, ["update", "--id", ids[0], "--id", ids[1], "--status", "finished"]
+        )
+        assert result.exit_code == 0
+        assert [book["status"] for book in storage().load()[:2]] == ["finished"] * 2
+        result = runner.invoke(cli.app, ["delete", "--id", ids[0], "--id", ids[1]])
+        assert result.exit_code == 0
+        assert [book["isbn"] for book in storage().load()] == [
+            mock_book_list[2]["isbn"]
+        ]
+        result = runner.invoke(cli.app, ["delete"])
+        assert result.exit_code == 1
+        assert "include the --id flag." in result.stdout
+
+
+@pytest.mark.integration
+def test_export_ndjson_to_stdout(mock_config_dir, mock_db_file, mock_book_list):
+    with patch.object(config, "config_dir_path") as cfig:
+        cfig.return_value = mock_config_dir
+        init(mock_db_file)
+        write_books(mock_book_list[:3], mock_db_file)
+        result = runner.invoke(cli.app, ["export", "ndjson", "--output", "-"])
+        assert result.exit_code == 0
+        lines = result.stdout.splitlines()
+        assert [json.loads(line) for line in lines] == mock_book_list[:3]
+
+
+@pytest.mark.integration
+def test_search(mock_config_dir, mock_db_file, mock_book_list):
+    with patch.object(config, "config_dir_path") as cfig:
+        cfig.return_value = mock_config_dir
+        init(mock_db_file)
+        write_books(mock_book_list, mock_db_file)
+        result = runner.invoke(cli.app, ["search", "life", "PI"])
+        assert result.exit_code == 0
+        assert "Life of Pi" in result.stdout
+        assert "Vedyaev" in result.stdout
+        result = runner.invoke(cli.app, ["search", "zzzz"])
+        assert "No books match the search" in result.stdout
+
+
+@pytest.mark.integration
+def test_update_before_init(tmp_path):
+    with patch.object(config, "config_dir_path") as cfig:
+        cfig.return_value = tmp_path
+        result = runner.invoke(cli.app, ["update", "--id", "1", "--status", "finished"])
+        assert result.exit_code == 1
+        assert "does not exist" in result.stdout
+        assert f"run `{__app_name__} init`" in result.stdout
+        assert "id supplied" not in result.stdout
+
+
+@pytest.mark.integration
+def test_export_before_init_reports_once(tmp_path):
+    with patch.object(config, "config_dir_path") as cfig:
+        cfig.return_value = tmp_path
+        result = runner.invoke(cli.app, ["export", "csv", "--output", "-"])
+        assert result.exit_code == 1
+        assert f"run `{__app_name__} init`" in result.stdout
+        assert "Something unexpected went wrong" not in result.stdout
@@ -0,0 +1,56 @@
+import io
+import json
+
+import pytest
+from _pytest.python_api import raises
+
+from booker.codec import CODECS, get_codec
+from booker.snapshot import scan_snapshot, write_snapshot
+from booker.storage import JournalStorage
+
+
+def _installed_codecs():
+    codecs = []
+    for name in CODECS:
+        try:
+            codecs.append(get_codec(name))
+        except ImportError:
+            pass
+    return codecs
+
+
+@pytest.fixture(params=_installed_codecs(), ids=lambda codec: codec.name)
+def codec(request):
+    return request.param
+
+
+def test_codecs_write_identical_documents(codec, mock_book_list):
+    tricky = [*mock_book_list, {"title": 'città 😀 \x1f\x7f"/', "id": None}]
+    assert codec.dumps(tricky, indent=True) == json.dumps(tricky, indent=2).encode()
+    compact = json.dumps(tricky, separators=(",", ":")).encode()
+    assert codec.dumps(tricky) == compact
+    assert codec.loads(compact) == tricky
+
+
+def test_codecs_raise_json_decode_errors(codec, malformed_data_path):
+    with raises(json.JSONDecodeError):
+        codec.loads(malformed_data_path.read_bytes())
+
+
+def test_compact_snapshot_reads_back(codec, tmp_path, mock_book_list):
+    storage = JournalStorage(tmp_path / "books.json", codec=codec, compact=True)
+    storage.save(mock_book_list)
+    assert b"\n" not in storage.db_path.read_bytes()
+    assert JournalStorage(storage.db_path).load() == mock_book_list
+
+
+@pytest.mark.parametrize("indent", [True, False])
+def test_snapshots_are_written_as_dumps_would(codec, mock_book_list, indent):
+    for books in (mock_book_list, mock_book_list[:1], []):
+        fp = io.BytesIO()
+        positions = write_snapshot(fp, books, codec, indent)
+        data = fp.getvalue()
+        assert data == codec.dumps(books, indent=indent)
+        for book, offset, length in positions:
+            assert codec.loads(data[offset : offset + length]) == book
+        assert positions == list(scan_snapshot(data))
@@ -4,6 +4,7 @@ from unittest.mock import patch
 from _pytest.python_api import raises
 
 from booker import config
+from booker.bookerdataclasses import Backend
 
 
 def test_init_config_file_with_config_dir_os_error_returns_config_dir_error_code(
@@ -34,7 +35,7 @@ def test_add_database_config_succeeds(mock_config_dir, mock_db_file):
     config._add_database_config(mock_db_file, mock_config_dir)
     assert (
         config.config_file_path(mock_config_dir).read_text().strip()
-        == f"[General]\ndatabase = {mock_db_file}"
+        == f"[General]\ndatabase = {mock_db_file}\nbackend = json"
     )
 
 
@@ -56,5 +57,36 @@ def test_init_app_succeeds(mock_config_dir, mock_db_file):
         assert outcome.succeeded()
         assert (
             config.config_file_path(mock_config_dir).read_text().strip()
-            == f"[General]\ndatabase = {mock_db_file}"
+            == f"[General]\ndatabase = {mock_db_file}\nbackend = json"
         )
+
+
+def test_settings_are_read_again_when_the_config_changes(tmp_path):
+    config_file = tmp_path / "config.ini"
+    config_file.write_text("[General]\ndatabase = first.json\n")
+    settings = config.SettingsCache()
+    assert settings.get(config_file).database == Path("first.json")
+    assert settings.get(config_file).backend is None
+    assert (settings.hits, settings.misses) == (1, 1)
+    config_file.write_text("[General]\ndatabase = second.json\nbackend = sqlite\n")
+    assert settings.get(config_file) == config.read_settings(config_file)
+    assert settings.get(config_file).backend is Backend.SQLITE
+    assert (settings.hits, settings.misses) == (2, 2)
+
+
+def test_settings_database_env_var(monkeypatch, tmp_path):
+    monkeypatch.setenv(config.DATABASE_ENV_VAR, str(tmp_path / "books.json"))
+    with patch.object(config, "config_dir_path") as cfig:
+        assert config.SettingsCache().get().database == tmp_path / "books.json"
+        cfig.assert_not_called()
+
+
+def test_config_file_path_is_cached(tmp_path):
+    cache = config.config_file_path.cache
+    with patch.object(config, "config_dir_path", wraps=config.config_dir_path) as dir:
+        assert config.config_file_path(tmp_path) == tmp_path / "config.ini"
+        assert config.config_file_path(path=tmp_path).resolve() == (
+            tmp_path / "config.ini"
+        )
+        dir.assert_called_once_with(tmp_path)
+    assert (cache.hits, cache.misses) == (1, 1)
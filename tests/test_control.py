@@ -0,0 +1,274 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+
+import pytest
+import typer
+
+from booker.control import (
+    AsyncPipeline,
+    DagPipeline,
+    GraphError,
+    stage_dependencies,
+    Argument,
+    GenericError,
+    Pipeline,
+    Profiler,
+    outcome,
+    SUCCESS,
+    StageCache,
+    fail_stage,
+)
+from booker.error import ID_ERROR
+
+
+@outcome(returns="numbers")
+def make_numbers() -> list:
+    return list(range(10_000))
+
+
+@outcome(requires=("numbers",), returns="total")
+def total(numbers: list) -> int:
+    return sum(numbers)
+
+
+@outcome(returns="total")
+def nested() -> int:
+    return (~(Pipeline(initial_args={}) << make_numbers << total)).get_key("total")
+
+
+def test_pipeline_without_profiler():
+    result = ~(Pipeline(initial_args={}) << make_numbers << total)
+    assert isinstance(result, SUCCESS)
+    assert result.get_key("total") == sum(range(10_000))
+
+
+def test_profiler_records_stages():
+    with Profiler() as profiler:
+        ~(Pipeline(initial_args={}) << make_numbers << total)
+    assert [record.name for record in profiler.records] == ["make_numbers", "total"]
+    assert all(record.depth == 0 for record in profiler.records)
+    assert profiler.records[0].peak > 10_000 * 8
+    assert all(record.wall >= 0 and record.cpu >= 0 for record in profiler.records)
+
+
+def test_profiler_nests_inner_pipelines():
+    with Profiler() as profiler:
+        result = ~(Pipeline(initial_args={}) << nested)
+    assert result.get_key("total") == sum(range(10_000))
+    by_name = {record.name: record for record in profiler.records}
+    assert by_name["nested"].depth == 0
+    assert by_name["make_numbers"].depth == by_name["total"].depth == 1
+    # the outer stage includes everything the inner pipeline did
+    assert by_name["nested"].wall >= by_name["make_numbers"].wall
+    assert by_name["nested"].peak >= by_name["make_numbers"].peak
+    lines = profiler.report().splitlines()
+    assert [line.split()[0] for line in lines[1:]] == [
+        "nested",
+        "make_numbers",
+        "total",
+    ]
+    assert lines[2].startswith("  make_numbers")
+
+
+def test_profiler_stops_recording(tmp_path):
+    with Profiler(trace_memory=False) as profiler:
+        ~(Pipeline(initial_args={}) << make_numbers)
+    ~(Pipeline(initial_args={}) << make_numbers)
+    assert len(profiler.records) == 1
+    assert profiler.records[0].peak == 0
+    trace_path = tmp_path / "trace.json"
+    profiler.write_chrome_trace(trace_path)
+    (event,) = json.loads(trace_path.read_text())["traceEvents"]
+    assert event["name"] == "make_numbers" and event["ph"] == "X"
+
+
+@outcome(requires=("numbers",), returns="numbers")
+def double(numbers: list) -> list:
+    return [n * 2 for n in numbers]
+
+
+def test_stage_arguments_override_context():
+    pipeline = (Pipeline(initial_args={}) << make_numbers << total) + {
+        "numbers": [1, 2]
+    }
+    assert (~pipeline).get_key("total") == 3
+
+
+def test_context_keeps_existing_values():
+    result = ~(Pipeline(initial_args={"numbers": [1, 2]}) << double << total)
+    assert result.get_key("total") == 3
+
+
+def test_long_pipeline_shares_context():
+    initial_args = {"numbers": [1, 2]}
+    pipeline = Pipeline(initial_args=initial_args)
+    for _ in range(1_000):
+        pipeline = pipeline << total
+    result = ~pipeline
+    assert result.get_key("total") == 3
+    assert pipeline.completed[1].get_context() is result.get_context()
+    assert initial_args == {"numbers": [1, 2]}
+
+
+@outcome(
+    requires=("id", Argument("numbers", use_default=True, default=[])),
+    returns="number",
+    registers={LookupError: ID_ERROR},
+)
+def pick(id: int, numbers: list) -> int:
+    if id < 0:
+        raise ValueError(id)
+    return numbers[id]
+
+
+def test_outcome_binds_arguments():
+    assert pick(id=1, numbers=[4, 5]).resolve() == 5
+    assert pick(1, [4, 5]) == 5
+
+
+def test_outcome_maps_registered_errors():
+    # IndexError is only registered through its LookupError base class
+    assert isinstance(pick(id=0), ID_ERROR)
+    assert isinstance(pick(id=-1), GenericError)
+
+
+@outcome(requires=("delay",), returns="first")
+async def slow_first(delay: float) -> float:
+    await asyncio.sleep(delay)
+    return time.perf_counter()
+
+
+@outcome(requires=("delay",), returns="second")
+def slow_second(delay: float) -> float:
+    time.sleep(delay)  # blocking stages run in a worker thread
+    return time.perf_counter()
+
+
+@outcome(requires=("first", "second"), returns="both")
+async def both(first: float, second: float) -> Tuple[float, float]:
+    return first, second
+
+
+def test_stage_dependencies():
+    stages = [(slow_first, {}), (slow_second, {}), (both, {}), (total, {})]
+    assert stage_dependencies(stages) == [set(), set(), {0, 1}, set()]
+    # a plain callable declares nothing, so it is a barrier
+    stages.insert(1, (lambda **_: SUCCESS(), {}))
+    assert stage_dependencies(stages) == [set(), {0}, {1}, {0, 1, 2}, {1}]
+
+
+def test_async_pipeline_runs_independent_stages_concurrently():
+    pipeline = AsyncPipeline(initial_args={"delay": 0.2})
+    pipeline = pipeline << slow_first << slow_second << both
+    start = time.perf_counter()
+    result = asyncio.run(~pipeline)
+    assert time.perf_counter() - start < 0.35
+    assert isinstance(result, SUCCESS)
+    first, second = result.resolve()
+    assert max(first, second) - start >= 0.2
+
+
+def test_async_pipeline_stops_on_failure():
+    pipeline = AsyncPipeline(initial_args={"id": -1}, error_handler=None) << pick
+    result = asyncio.run(~pipeline)
+    assert isinstance(result, GenericError)
+    assert not pipeline.success
+
+
+@outcome(requires=("numbers",), returns="count")
+def count(numbers: list) -> int:
+    return len(numbers)
+
+
+@outcome(requires=("count", "total"), returns="mean")
+def mean(count: int, total: int) -> float:
+    return total / count
+
+
+@outcome(requires=("mean",), returns="numbers")
+def from_mean(mean: float) -> list:
+    return [mean]
+
+
+def test_dag_pipeline_orders_stages_by_their_inputs():
+    pipeline = DagPipeline(initial_args={}) << mean << total << count << make_numbers
+    assert pipeline.validate() == [{1, 2}, {3}, {3}, set()]
+    result = ~pipeline
+    assert isinstance(result, SUCCESS)
+    assert result.get_key("mean") == sum(range(10_000)) / 10_000
+
+
+def test_dag_pipeline_runs_in_processes():
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        pipeline = DagPipeline(executor=executor, initial_args={})
+        result = ~(pipeline << make_numbers << total << count << mean)
+    assert result.get_key("count") == 10_000
+
+
+@pytest.mark.parametrize(
+    "stages, error",
+    [
+        ([total], "nothing provides numbers for total"),
+        ([make_numbers, double], "make_numbers and double both return numbers"),
+        ([mean, count, total, from_mean], "depend on each other: count, from_mean"),
+    ],
+)
+def test_dag_pipeline_rejects_bad_graphs(stages, error):
+    pipeline = DagPipeline(initial_args={})
+    for stage in stages:
+        pipeline = pipeline << stage
+    with pytest.raises(GraphError, match=error):
+        ~pipeline
+
+
+def test_stage_cache():
+    calls = []
+
+    @outcome(requires=("numbers",), returns="total", cache=StageCache(maxsize=2))
+    def cached_total(numbers: list) -> int:
+        calls.append(numbers)
+        return sum(numbers)
+
+    first, second, third = [1], [2], [3]
+    assert cached_total(numbers=first).resolve() == 1
+    assert cached_total(first) == 1  # positional calls share the entries
+    assert cached_total(numbers=second).resolve() == 2
+    assert cached_total(numbers=third).resolve() == 3
+    # lists are keyed by identity, and the least recently used one was evicted
+    assert cached_total(numbers=[1]).resolve() == 1
+    assert cached_total(numbers=first).resolve() == 1
+    assert len(calls) == 5
+    assert (cached_total.cache.hits, cached_total.cache.misses) == (1, 5)
+
+
+def test_stage_cache_skips_errors():
+    @outcome(requires=("id",), returns="number", cache=True)
+    def cached_pick(id: int) -> int:
+        return [4, 5][id]
+
+    assert isinstance(cached_pick(id=2), GenericError)
+    assert cached_pick(id=1).resolve() == cached_pick(id=1).resolve() == 5
+    assert (cached_pick.cache.hits, len(cached_pick.cache.entries)) == (1, 1)
+
+
+@outcome(requires=("id",), returns="number", registers={IndexError: ID_ERROR})
+def pick_number(id: int) -> int:
+    return [4, 5][id]
+
+
+@outcome(requires=("id",), returns="number")
+def nested_pick(id: int) -> int:
+    inner = Pipeline(error_handler=fail_stage, initial_args={"id": id}) << pick_number
+    return (~inner).resolve()
+
+
+def test_failing_nested_pipeline_is_reported_once(capsys):
+    assert (~(Pipeline(initial_args={"id": 1}) << nested_pick)).resolve() == 5
+    with pytest.raises(typer.Exit):
+        ~(Pipeline(initial_args={"id": 2}) << nested_pick)
+    # the inner pipeline's failure is the outer one's, not a generic error
+    (report,) = capsys.readouterr().out.splitlines()
+    assert report == str(ID_ERROR(IndexError("list index out of range")))
@@ -1,18 +1,23 @@
+import csv
 import json
 from json import JSONDecodeError
 from pathlib import Path
 from unittest.mock import patch
 
+import pytest
+import yaml
 from _pytest.python_api import raises
 
 from booker import config
 from booker.database import (
     write_books,
     read_books,
-    incr_id,
-    _update_status,
     export_yaml,
-    delete_book_id,
+    stream_books,
+    json_to_yaml,
+    books_to_csv,
+    books_to_ndjson,
+    books_to_parquet,
 )
 
 
@@ -55,47 +60,52 @@ def test_write_books_fails_on_none_booklist(mock_db_file):
     assert context.value.__str__() == "empty json file supplied"
 
 
-def test_incr_id_empty(mock_single_book):
-    assert incr_id([]) == 0
+def test_yaml():
+    write_path = Path().home() / "book_export.yaml"
+    export_yaml()
+    # assert write_path.exists()
+    # write_path.unlink()
 
 
-def test_incr_id_with_values(mock_book_list):
-    sub = mock_book_list[:10]
-    mx = sorted(sub, key=lambda x: x["id"])[-1]["id"]
-    assert incr_id(sub) == mx + 1
+def test_stream_books_matches_read_books(mock_data_path):
+    assert list(stream_books(mock_data_path)) == read_books(mock_data_path)
 
 
-def test_update_book_status(mock_book_list):
-    to_mod = {**mock_book_list[0]}
-    mod_id = to_mod["id"]
-    post_mod = _update_status(mock_book_list, mod_id, "test_status")[0]
-    assert to_mod["id"] == post_mod["id"]
-    assert to_mod["status"] != post_mod["status"]
+def test_json_to_yaml_streams_books(mock_book_list, tmp_path):
+    write_path = tmp_path / "export.yaml"
+    with patch("booker.database.YAML_BATCH_SIZE", 7):
+        json_to_yaml(iter(mock_book_list), write_path)
+    assert yaml.safe_load(write_path.read_text()) == mock_book_list
+    json_to_yaml(iter([]), write_path)
+    assert yaml.safe_load(write_path.read_text()) == []
 
 
-def test_update_book_status_throws_key_error_for_non_existent_key(mock_book_list):
-    with raises(KeyError) as context:
-        _update_status(mock_book_list, -1, "test_status")
-    assert context.value.__str__() == "'include the --id flag.'"
+def test_json_to_yaml_writes_to_stdout(mock_book_list, capsys):
+    json_to_yaml(iter(mock_book_list[:3]), "-")
+    assert yaml.safe_load(capsys.readouterr().out) == mock_book_list[:3]
 
 
-def test_yaml():
-    write_path = Path().home() / "book_export.yaml"
-    export_yaml()
-    #assert write_path.exists()
-    #write_path.unlink()
+def test_books_to_csv(mock_book_list, tmp_path):
+    write_path = tmp_path / "export.csv"
+    books_to_csv(iter(mock_book_list), write_path)
+    with write_path.open(newline="") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert rows == [
+        {key: str(value) for key, value in book.items()} for book in mock_book_list
+    ]
 
 
-def test_delete_book(mock_book_list):
-    to_del = {**mock_book_list[0]}
-    del_id = to_del["id"]
-    pre_del_len = len(mock_book_list)
-    post_del = delete_book_id(mock_book_list, del_id)
-    assert pre_del_len == len(post_del) + 1
-    assert all(x["id"] != del_id for x in post_del)
+def test_books_to_ndjson(mock_book_list, tmp_path):
+    write_path = tmp_path / "export.ndjson"
+    books_to_ndjson(iter(mock_book_list), write_path)
+    lines = write_path.read_text().splitlines()
+    assert [json.loads(line) for line in lines] == mock_book_list
 
 
-def test_delete_book_throws_key_error_for_non_existent_key(mock_book_list):
-    with raises(KeyError) as context:
-        delete_book_id(mock_book_list, -1)
-    assert context.value.__str__() == "'include the --id flag.'"
+def test_books_to_parquet(mock_book_list, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    write_path = tmp_path / "export.parquet"
+    books_to_parquet(iter(mock_book_list), write_path)
+    table = pq.read_table(write_path)
+    assert str(table.schema.field("status").type).startswith("dictionary")
+    assert table.to_pylist() == [dict(book) for book in mock_book_list]
@@ -1,6 +1,17 @@
+import gzip
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from unittest.mock import patch
+
+import pytest
 import responses
 from _pytest.python_api import raises
+from requests import Response
 
+from booker import pantry
+from booker.bookerdataclasses import Book
 from booker.pantry import upload, get_url
 
 test_id = "15e240e3-5f4c-413b-bf7b-88c8e0dd10ef"
@@ -54,3 +65,200 @@ def test_pantry_upload_fails_server_error(mock_single_book):
     with raises(Exception) as context:
         upload("a", "b", mock_single_book)
     assert '"Failed to update: b". Error Code: 400' == context.value.__str__()
+
+
+class PantryStub(ThreadingHTTPServer):
+    """
+    a local stand-in for pantry that answers with the queued statuses, then
+    200, and records what it was sent.
+    """
+
+    def __init__(self, statuses=()):
+        super().__init__(("127.0.0.1", 0), PantryHandler)
+        self.statuses = list(statuses)
+        self.requests = []
+        self.connections = set()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/apiv1/pantry"
+
+
+class PantryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_POST(self):
+        start = time.perf_counter()
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            books = json.loads(gzip.decompress(body))
+        else:
+            books = json.loads(body)
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        reply = f"Your Pantry was updated with basket: {len(books['reading_list'])}!"
+        reply = reply.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+        self.server.connections.add(self.client_address)
+        self.server.requests.append(
+            {
+                "method": self.command,
+                "books": books["reading_list"],
+                "version": books.get("version"),
+                "bytes": len(body),
+                "seconds": time.perf_counter() - start,
+            }
+        )
+
+    do_PUT = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def pantry_stub():
+    def serve(statuses=()):
+        server = PantryStub(statuses)
+        servers.append(server)
+        Thread(target=server.serve_forever, daemon=True).start()
+        pantry.BASE_URL = server.base_url
+        return server
+
+    servers = []
+    base_url = pantry.BASE_URL
+    yield serve
+    pantry.close_session()
+    pantry.BASE_URL = base_url
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_uploads_reuse_one_connection(pantry_stub, mock_book_list):
+    server = pantry_stub()
+    for _ in range(3):
+        assert upload("a", "b", mock_book_list) == (
+            f"Your Pantry was updated with basket: {len(mock_book_list)}!"
+        )
+    assert len(server.requests) == 3
+    assert len(server.connections) == 1
+
+
+def test_upload_retries_server_errors(pantry_stub, mock_book_list):
+    server = pantry_stub(statuses=[503])
+    with patch.object(pantry, "BACKOFF_FACTOR", 0):
+        upload("a", "b", mock_book_list)
+    assert len(server.requests) == 2
+
+
+def test_upload_gives_up_after_the_retries(pantry_stub, mock_book_list):
+    server = pantry_stub(statuses=[500] * (pantry.RETRIES + 1))
+    with patch.object(pantry, "BACKOFF_FACTOR", 0), raises(Exception) as context:
+        upload("a", "b", mock_book_list)
+    assert str(context.value) == (
+        "Pantry is experiencing internal issues. Error Code: 500"
+    )
+    assert len(server.requests) == pantry.RETRIES + 1
+
+
+def test_gzip_upload_sends_fewer_bytes(pantry_stub, mock_book_list):
+    server = pantry_stub()
+    upload("a", "b", mock_book_list)
+    upload("a", "b", mock_book_list, True)
+    plain, compressed = server.requests
+    assert compressed["bytes"] < plain["bytes"] / 2
+
+
+def test_html_responses_are_flattened():
+    res = Response()
+    res.status_code = 200
+    res._content = b"<html><body><p>updated</p>\n<p>basket b</p></body></html>"
+    res.headers["Content-Type"] = "text/html; charset=utf-8"
+    assert pantry.response_text(res) == "updated. basket b"
+
+
+def test_sync_sends_only_the_changes(pantry_stub, mock_book_list, tmp_path):
+    server = pantry_stub()
+    manifest = tmp_path / "books.json.pantry"
+    books = [Book(**book) for book in mock_book_list]
+    pantry.sync("a", books, manifest)
+    first = server.requests[-1]
+    assert first["method"] == "POST"
+    assert len(first["books"]) == len(books)
+    basket = pantry.read_manifest(manifest)["a"]["basket"]
+
+    assert pantry.sync("a", books, manifest) == (
+        f"Nothing changed since the last export to {basket}."
+    )
+    assert len(server.requests) == 1
+
+    books[0]["status"] = "finished"
+    deleted = books.pop(1)
+    books.append(Book(**{**books[2], "id": 10**6, "isbn": "0000000000000"}))
+    assert pantry.sync("a", books, manifest) == (
+        f"Exported 3 changed books to {basket}."
+    )
+    delta = server.requests[-1]
+    assert delta["method"] == "PUT"
+    assert delta["books"] == {
+        str(books[0]["id"]): books[0],
+        str(deleted["id"]): None,
+        str(10**6): books[-1],
+    }
+    assert delta["version"] == first["version"] == pantry.BASKET_VERSION
+    assert delta["bytes"] * 20 < first["bytes"]
+
+    pantry.sync("a", books, manifest, None, True)
+    assert server.requests[-1]["method"] == "POST"
+    assert len(server.requests[-1]["books"]) == len(books)
+
+
+def test_lists_are_uploaded_without_a_version(pantry_stub, mock_book_list):
+    server = pantry_stub()
+    upload("a", "b", mock_book_list)
+    assert server.requests[-1]["version"] is None
+    assert server.requests[-1]["books"] == mock_book_list
+
+
+def test_sync_prunes_deleted_books_with_a_full_export(
+    pantry_stub, mock_book_list, tmp_path
+):
+    server = pantry_stub()
+    manifest = tmp_path / "books.json.pantry"
+    books = [Book(**book) for book in mock_book_list[:20]]
+    pantry.sync("a", books, manifest)
+    for _ in range(4):
+        books.pop()
+        pantry.sync("a", books, manifest)
+    assert [request["method"] for request in server.requests] == ["POST"] + ["PUT"] * 4
+    assert pantry.read_manifest(manifest)["a"]["tombstones"] == 4
+
+    # a fifth null would be more than a quarter of the 15 books left
+    books.pop()
+    pantry.sync("a", books, manifest)
+    pruned = server.requests[-1]
+    assert pruned["method"] == "POST"
+    assert None not in pruned["books"].values()
+    assert len(pruned["books"]) == len(books)
+    assert pantry.read_manifest(manifest)["a"]["tombstones"] == 0
+
+
+def test_sync_to_another_basket_is_a_full_export(pantry_stub, mock_book_list, tmp_path):
+    server = pantry_stub()
+    manifest = tmp_path / "books.json.pantry"
+    pantry.sync("a", mock_book_list, manifest, "first")
+    pantry.sync("a", mock_book_list, manifest, "second")
+    assert [request["method"] for request in server.requests] == ["POST", "POST"]
+    assert pantry.read_manifest(manifest)["a"]["basket"] == "second"
+
+
+def test_failed_sync_keeps_the_manifest(pantry_stub, mock_book_list, tmp_path):
+    pantry_stub(statuses=[400])
+    manifest = tmp_path / "books.json.pantry"
+    with raises(Exception):
+        pantry.sync("a", mock_book_list, manifest)
+    assert not manifest.exists()
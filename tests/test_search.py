@@ -0,0 +1,51 @@
+from booker.bookerdataclasses import Book
+from booker.search import SearchIndex, book_terms, index_books, tokenize
+
+
+def test_tokenize_casefolds_words():
+    assert tokenize("Jungle de Ikou (JUNGRE-de-ikou)") == [
+        "jungle",
+        "de",
+        "ikou",
+        "jungre",
+        "de",
+        "ikou",
+    ]
+    assert tokenize(None) == []
+
+
+LIFE_OF_PI = Book(
+    id=1,
+    isbn="2052822823852",
+    title="Life of Pi",
+    author_fname="Hale",
+    author_lname="Vedyaev",
+    status="in progress",
+)
+
+
+def test_book_terms_cover_title_and_author():
+    assert book_terms(LIFE_OF_PI) == {"life", "of", "pi", "hale", "vedyaev"}
+
+
+def test_search_matches_substrings_of_terms():
+    index = SearchIndex({"tolkien": [1], "tolstoy": [2], "hobbit": [1, 3]})
+    assert index.search("TOL") == {1, 2}
+    assert index.search("olki") == {1}
+    assert index.search("to") == {1, 2}
+    assert index.search("bit tol") == {1}
+    assert index.search("zzz") == set()
+    assert index.search("") == set()
+
+
+def test_search_index_is_maintained(mock_book_list):
+    books = [LIFE_OF_PI, *mock_book_list[1:10]]
+    index = index_books(books)
+    first = books[0]
+    index.remove(first["id"], book_terms(first))
+    assert first["id"] not in index.search("vedyaev")
+    assert "vedyaev" not in index.postings
+    assert "vedyaev" not in index.by_gram.get("ved", set())
+    index.add(first["id"], book_terms(first))
+    assert index.search("vedyaev pi") == {first["id"]}
+    assert index.to_postings() == index_books(books).to_postings()
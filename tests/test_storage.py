@@ -0,0 +1,579 @@
+import io
+import json
+import sqlite3
+from contextlib import closing
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+from unittest.mock import patch
+
+import pytest
+from _pytest.python_api import raises
+
+from booker.bookerdataclasses import Book, Status, Ordering, Backend
+from booker.catalog import CATALOG_CACHE
+from booker.listbooks import order_books
+from booker.search import book_terms, tokenize
+from booker.snapshot import SnapshotIndex
+from booker.storage import (
+    BOOK_COLUMNS,
+    JournalStorage,
+    SqliteStorage,
+    open_storage,
+    iter_json_array,
+)
+
+
+def _sqlite_storage(tmp_path, book_list) -> SqliteStorage:
+    storage = SqliteStorage(tmp_path / "books.db")
+    storage.create()
+    storage.save([{**book} for book in book_list])
+    return storage
+
+
+def test_insert_appends_to_journal_without_rewriting_snapshot(
+    mock_book_list, mock_single_book, journal_storage
+):
+    storage = journal_storage(mock_book_list)
+    snapshot = storage.db_path.read_text()
+    added = storage.insert([{**mock_single_book}])[0]
+    assert storage.db_path.read_text() == snapshot
+    assert added["id"] == max(book["id"] for book in mock_book_list) + 1
+    assert storage.load()[-1] == added
+
+
+def test_journal_replays_status_updates_and_deletes(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    first, second = mock_book_list[0]["id"], mock_book_list[1]["id"]
+    storage.update_status(first, Status.FINISHED)
+    storage.delete(second)
+    book_list = storage.load()
+    assert len(book_list) == len(mock_book_list) - 1
+    assert all(book["id"] != second for book in book_list)
+    assert next(b for b in book_list if b["id"] == first)["status"] == "finished"
+
+
+def test_cold_writes_do_not_parse_the_snapshot(
+    mock_book_list, mock_single_book, journal_storage
+):
+    storage = journal_storage(mock_book_list)
+    first, second = mock_book_list[0], mock_book_list[1]
+    CATALOG_CACHE.clear()
+    with patch.object(JournalStorage, "_parse", side_effect=AssertionError), patch(
+        "booker.storage.scan_snapshot", side_effect=AssertionError
+    ):
+        added = storage.insert([{**mock_single_book}])[0]
+        assert storage.update_statuses([first["id"], added["id"]], Status.FINISHED) == [
+            {**first, "status": Status.FINISHED},
+            {**added, "status": Status.FINISHED},
+        ]
+        assert storage.delete(second["id"]) == second
+        with raises(KeyError):
+            storage.delete(second["id"])
+        with raises(ValueError):
+            storage.insert([{**first}])
+        assert storage.reserve_ids(2) == added["id"] + 1
+    assert CATALOG_CACHE.entries == {}
+    book_list = storage.load()
+    assert [book["id"] for book in book_list] == [
+        book["id"] for book in mock_book_list if book is not second
+    ] + [added["id"]]
+    assert book_list[0]["status"] == book_list[-1]["status"] == "finished"
+
+
+@pytest.mark.parametrize("ordering", list(Ordering))
+def test_cold_listing_walks_the_index(
+    mock_book_list, mock_single_book, ordering, journal_storage
+):
+    # written out of id order, which the listing must not follow
+    storage = journal_storage(mock_book_list[::-1])
+    storage.update_status(mock_book_list[2]["id"], Status.FINISHED)
+    storage.delete(mock_book_list[3]["id"])
+    storage.insert([{**mock_single_book}])
+    expected = storage.load(ordering)
+    assert expected == order_books(list(expected), ordering)
+    for offset, limit in ((0, None), (0, 5), (2, 3), (len(expected) - 1, 5)):
+        CATALOG_CACHE.clear()
+        with patch.object(JournalStorage, "_parse", side_effect=AssertionError):
+            books = storage.iter_books(ordering, offset, limit)
+            assert books.ordering is ordering
+            stop = None if limit is None else offset + limit
+            assert list(books) == expected[offset:stop]
+
+
+def test_cold_listing_by_author_without_a_first_name(
+    mock_book_list, mock_single_book, journal_storage
+):
+    # `booker add` leaves out a first name that is not given
+    books = [{**book} for book in mock_book_list]
+    books[0]["author_fname"] = None
+    storage = journal_storage(books)
+    storage.insert([{**mock_single_book, "author_fname": None}])
+    expected = storage.load(Ordering.AUTHOR)
+    CATALOG_CACHE.clear()
+    assert list(storage.iter_books(Ordering.AUTHOR)) == expected
+
+
+def test_journal_missing_id_raises_key_error(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    with raises(KeyError) as context:
+        storage.delete(-1)
+    assert context.value.__str__() == "'include the --id flag.'"
+    assert not storage.journal_path.exists()
+
+
+def test_journal_is_compacted_once_it_outgrows_snapshot(
+    mock_single_book, journal_storage
+):
+    storage = journal_storage([], compact_after=0)
+    storage.insert([{**mock_single_book}])
+    assert not storage.journal_path.exists()
+    assert (
+        json.loads(storage.db_path.read_text())[0]["title"] == mock_single_book["title"]
+    )
+
+
+def test_journal_is_compacted_past_its_cap(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list, compact_after=0)
+    storage.update_status(mock_book_list[0]["id"], Status.FINISHED)
+    # far smaller than the snapshot, which would otherwise be the limit
+    storage.max_journal = 2 * storage.journal_path.stat().st_size
+    storage.update_status(mock_book_list[1]["id"], Status.FINISHED)
+    assert storage.journal_path.exists()
+    storage.update_status(mock_book_list[2]["id"], Status.FINISHED)
+    assert not storage.journal_path.exists()
+    assert [book["status"] for book in storage.load()[:3]] == ["finished"] * 3
+
+
+def test_cold_writes_replay_the_journal_once(
+    mock_book_list, mock_single_book, journal_storage
+):
+    storage = journal_storage(mock_book_list)
+    storage.delete(mock_book_list[0]["id"])
+    CATALOG_CACHE.clear()
+    with patch.object(JournalStorage, "_fold", wraps=storage._fold) as fold:
+        storage.insert([{**mock_single_book}])
+        assert fold.call_count == 1
+        storage.update_status(mock_book_list[1]["id"], Status.FINISHED)
+        assert fold.call_count == 2
+    assert len(storage.load()) == len(mock_book_list)
+
+
+def test_save_discards_journal(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    storage.delete(mock_book_list[0]["id"])
+    storage.save(mock_book_list)
+    assert not storage.journal_path.exists()
+    assert len(storage.load()) == len(mock_book_list)
+
+
+def test_replay_ignores_interrupted_entry(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    storage.journal_path.write_text('{"op": "delete", "id": ')
+    assert len(storage.load()) == len(mock_book_list)
+
+
+def test_write_after_interrupted_entry(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    first, second = mock_book_list[0]["id"], mock_book_list[1]["id"]
+    storage.delete(first)
+    with storage.journal_path.open("a") as journal:
+        journal.write('{"op": "delete", "id": ')
+    CATALOG_CACHE.clear()
+    storage.delete(second)
+    CATALOG_CACHE.clear()
+    ids = [book["id"] for book in storage.load()]
+    assert ids == [book["id"] for book in mock_book_list[2:]]
+    assert len(storage.journal_path.read_text().splitlines()) == 2
+
+
+def test_replay_skips_lines_that_do_not_decode(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    first = mock_book_list[0]["id"]
+    storage.journal_path.write_text(
+        f'{{"op": "delete", "id": \n{{"op": "delete", "id": {first}}}\n'
+    )
+    assert len(storage.load()) == len(mock_book_list) - 1
+
+
+def test_replay_is_idempotent_over_compacted_entries(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    added = storage.insert([{**mock_book_list[0], "isbn": "0000000000000"}])[0]
+    journal = storage.journal_path.read_text()
+    storage.compact()
+    storage.journal_path.write_text(journal)
+    assert [book["id"] for book in storage.load()].count(added["id"]) == 1
+
+
+def test_sqlite_round_trips_book_list(tmp_path, mock_book_list):
+    storage = _sqlite_storage(tmp_path, mock_book_list)
+    assert storage.load() == sorted(mock_book_list, key=lambda book: book["id"])
+
+
+def test_sqlite_load_is_ordered_by_index(tmp_path, mock_book_list):
+    storage = _sqlite_storage(tmp_path, mock_book_list)
+    for ordering in Ordering:
+        book_list = storage.load(ordering)
+        assert book_list.ordering == ordering
+        assert book_list == order_books(list(book_list), ordering)
+
+
+def test_sqlite_point_operations(tmp_path, mock_book_list, mock_single_book):
+    storage = _sqlite_storage(tmp_path, mock_book_list)
+    added = storage.insert([{**mock_single_book}])[0]
+    assert added["id"] == max(book["id"] for book in mock_book_list) + 1
+    assert storage.update_status(added["id"], Status.FINISHED)["status"] == "finished"
+    assert storage.delete(added["id"])["id"] == added["id"]
+    assert len(storage.load()) == len(mock_book_list)
+
+
+def test_sqlite_missing_id_raises_key_error(tmp_path, mock_book_list):
+    storage = _sqlite_storage(tmp_path, mock_book_list)
+    with raises(KeyError) as context:
+        storage.update_status(-1, Status.FINISHED)
+    assert context.value.__str__() == "'include the --id flag.'"
+    with raises(KeyError):
+        storage.delete(10**9)
+
+
+def test_journal_find_isbn_uses_the_index(
+    mock_book_list, mock_single_book, journal_storage
+):
+    storage = journal_storage(mock_book_list)
+    first, last = mock_book_list[0], mock_book_list[-1]
+    storage.update_status(last["id"], Status.FINISHED)
+    storage.delete(first["id"])
+    added = storage.insert([{**mock_single_book}])[0]
+    CATALOG_CACHE.clear()
+    assert storage.find_isbn(last["isbn"]) == {**last, "status": "finished"}
+    assert storage.find_isbn(added["isbn"]) == added
+    assert storage.find_isbn(first["isbn"]) is None
+    # a cold lookup never builds the catalog
+    assert CATALOG_CACHE.entries == {}
+
+
+def test_journal_rebuilds_stale_isbn_index(mock_book_list, journal_storage):
+    storage = journal_storage([])
+    # non-ascii text puts byte and character offsets out of step
+    books = [{**book, "title": f"{book['title']} ünïcode"} for book in mock_book_list]
+    storage.db_path.write_text(json.dumps(books, ensure_ascii=False), "utf-8")
+    assert storage.find_isbn(books[3]["isbn"]) == books[3]
+    assert storage.find_isbn(books[-1]["isbn"]) == books[-1]
+    with closing(sqlite3.connect(storage.index_path)) as index:
+        assert index.execute("SELECT COUNT(*) FROM books").fetchone() == (len(books),)
+    assert storage.next_id() == max(book["id"] for book in books) + 1
+
+
+def test_journal_isbn_lookups_read_only_the_book(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    CATALOG_CACHE.clear()
+    isbns = [book["isbn"] for book in mock_book_list[:5]] + ["missing"]
+    with patch("booker.storage.scan_snapshot") as scan, patch(
+        "booker.storage.iter_json_array"
+    ) as stream:
+        assert storage.isbn_ids(isbns) == {
+            book["isbn"]: book["id"] for book in mock_book_list[:5]
+        }
+        assert storage.find_isbn(mock_book_list[7]["isbn"]) == mock_book_list[7]
+    assert not scan.called and not stream.called
+    assert CATALOG_CACHE.entries == {}
+
+
+def test_insert_rejects_duplicate_isbns(
+    tmp_path, mock_book_list, mock_single_book, journal_storage
+):
+    for storage in (
+        journal_storage(mock_book_list),
+        _sqlite_storage(tmp_path, mock_book_list),
+    ):
+        with raises(ValueError) as context:
+            storage.insert([{**mock_book_list[1]}])
+        assert f"(id {mock_book_list[1]['id']})" in context.value.__str__()
+        with raises(ValueError):
+            storage.insert([{**mock_single_book}, {**mock_single_book}])
+        assert len(storage.load()) == len(mock_book_list)
+
+
+def test_sqlite_find_isbn(tmp_path, mock_book_list):
+    storage = _sqlite_storage(tmp_path, mock_book_list)
+    assert storage.find_isbn(mock_book_list[5]["isbn"]) == mock_book_list[5]
+    assert storage.find_isbn("missing") is None
+    isbns = [book["isbn"] for book in mock_book_list] + ["missing"]
+    assert len(storage.isbn_ids(isbns)) == len(mock_book_list)
+
+
+def _insert_many(db_path, start: int) -> List[int]:
+    storage = open_storage(db_path)
+    books = [
+        Book(
+            isbn=f"{start + i:013}",
+            title="t",
+            author_fname="a",
+            author_lname="b",
+            status="unread",
+        )
+        for i in range(20)
+    ]
+    return [storage.insert([book])[0]["id"] for book in books]
+
+
+def test_ids_are_not_reused_after_deletes(
+    tmp_path, mock_book_list, mock_single_book, journal_storage
+):
+    for storage in (
+        journal_storage(mock_book_list),
+        _sqlite_storage(tmp_path, mock_book_list),
+    ):
+        newest = storage.insert([{**mock_single_book}])[0]["id"]
+        storage.delete(newest)
+        if isinstance(storage, JournalStorage):
+            storage.compact()
+        CATALOG_CACHE.clear()
+        assert storage.next_id() == newest + 1
+        assert storage.reserve_ids(3) == newest + 1
+        assert storage.insert([{**mock_single_book}])[0]["id"] == newest + 4
+
+
+@pytest.mark.parametrize("name", ["books.json", "books.db"])
+def test_concurrent_writers_get_unique_ids(tmp_path, name):
+    db_path = tmp_path / name
+    open_storage(db_path, Backend.SQLITE if name.endswith(".db") else None).create()
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(_insert_many, db_path, i * 100) for i in range(4)]
+        ids = [id for future in futures for id in future.result()]
+    assert sorted(ids) == list(range(80))
+    assert [book["id"] for book in open_storage(db_path).load()] == sorted(ids)
+
+
+def _matches(books, query) -> List[int]:
+    tokens = tokenize(query)
+    return [
+        book["id"]
+        for book in books
+        if tokens
+        and all(any(token in term for term in book_terms(book)) for token in tokens)
+    ]
+
+
+SEARCHES = (
+    *("life", "PI", "de ikou", "ikou jungle", "a", "ed", "zzz", "", "stan"),
+    # only found once casefolded, which sqlite's LIKE and fts5 do not do
+    *("é", "CAFÉ", "öl", "ölm", "strasse", "STRAẞE", "ss", "weiss", "zoë"),
+)
+
+UNICODE_BOOKS = (
+    ("Café Society", "Émile", "Ölmann"),
+    ("Die Straße", "Jörg", "Weiß"),
+    ("STRASSE", "Zoë", "Öl"),
+)
+
+
+def _with_unicode_books(book_list) -> List[Book]:
+    next_id = max(book["id"] for book in book_list) + 1
+    return [{**book} for book in book_list] + [
+        Book(
+            id=next_id + i,
+            isbn=f"{i:013}",
+            title=title,
+            author_fname=fname,
+            author_lname=lname,
+            status=Status.UNREAD,
+        )
+        for i, (title, fname, lname) in enumerate(UNICODE_BOOKS)
+    ]
+
+
+def test_search_matches_a_scan_on_both_backends(
+    tmp_path, mock_book_list, journal_storage
+):
+    books = _with_unicode_books(mock_book_list)
+    # some of the books are only in the journal, the rest in the snapshot
+    journal = journal_storage(books[:-2])
+    journal.append([{**book} for book in books[-2:]])
+    sqlite = _sqlite_storage(tmp_path, books)
+    for query in SEARCHES:
+        expected = _matches(books, query)
+        assert [book["id"] for book in journal.search(query)] == expected, query
+        CATALOG_CACHE.clear()
+        assert [book["id"] for book in journal.search(query)] == expected, query
+        assert [book["id"] for book in sqlite.search(query)] == expected, query
+    # and the same books are found once they are all in the snapshot
+    journal.compact()
+    CATALOG_CACHE.clear()
+    for query in SEARCHES:
+        expected = _matches(books, query)
+        assert [book["id"] for book in journal.search(query)] == expected, query
+
+
+def test_search_follows_writes(
+    tmp_path, mock_book_list, mock_single_book, journal_storage
+):
+    books = mock_book_list[:20]
+    new_book = Book(mock_single_book, isbn="0000000000000", title="Zyzzyva Tales")
+    for storage in (
+        journal_storage(books),
+        _sqlite_storage(tmp_path, books),
+    ):
+        for cold in (False, True):
+            if cold:
+                CATALOG_CACHE.clear()
+            storage.search("life")  # build the index before writing
+            (added,) = storage.insert([Book(**new_book)])
+            storage.update_status(books[0]["id"], Status.FINISHED)
+            storage.delete(books[1]["id"])
+            if cold:
+                CATALOG_CACHE.clear()
+            assert storage.search("zyzzyva") == [added]
+            updated = storage.search(f"{books[0]['title']} {books[0]['author_lname']}")
+            assert {book["id"]: book["status"] for book in updated}[
+                books[0]["id"]
+            ] == Status.FINISHED
+            assert storage.search(books[1]["author_lname"]) == []
+            storage.save([{**book} for book in books])
+
+
+def test_journal_search_index_is_persisted(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    CATALOG_CACHE.clear()
+    assert not storage.index.has_search()
+    storage.search("life")
+    assert storage.index.has_search()
+    storage.compact()  # a new snapshot keeps the search table once it is used
+    CATALOG_CACHE.clear()
+    with patch.object(
+        SnapshotIndex, "add_search", side_effect=AssertionError
+    ), patch.object(JournalStorage, "_parse", side_effect=AssertionError):
+        for query in SEARCHES:
+            assert [book["id"] for book in storage.search(query)] == _matches(
+                mock_book_list, query
+            )
+    assert CATALOG_CACHE.entries == {}
+
+
+def test_sqlite_databases_without_terms_are_upgraded(tmp_path, mock_book_list):
+    books = _with_unicode_books(mock_book_list)
+    db_path = tmp_path / "books.db"
+    # the schema, and search table, of a database from before the terms column
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        conn.executescript(
+            "CREATE TABLE books (id INTEGER PRIMARY KEY, isbn TEXT, title TEXT,"
+            " author_fname TEXT, author_lname TEXT, status TEXT);"
+            "CREATE VIRTUAL TABLE books_search USING fts5(title, author_fname,"
+            " author_lname, content='books', content_rowid='id', tokenize='trigram');"
+        )
+        conn.executemany(
+            "INSERT INTO books VALUES (?, ?, ?, ?, ?, ?)",
+            [tuple(book[column] for column in BOOK_COLUMNS) for book in books],
+        )
+    storage = SqliteStorage(db_path)
+    for query in SEARCHES:
+        assert [book["id"] for book in storage.search(query)] == _matches(
+            books, query
+        ), query
+    assert storage.load() == books
+
+
+def test_sqlite_search_table_is_added_to_old_databases(tmp_path, mock_book_list):
+    storage = _sqlite_storage(tmp_path, mock_book_list)
+    with closing(sqlite3.connect(storage.db_path)) as conn:
+        conn.executescript(
+            "DROP TABLE books_search; DROP TRIGGER IF EXISTS books_search_insert;"
+            "DROP TRIGGER IF EXISTS books_search_delete;"
+            "DROP TRIGGER IF EXISTS books_search_update;"
+        )
+    assert [book["id"] for book in storage.search("life")] == _matches(
+        mock_book_list, "life"
+    )
+    storage.delete(_matches(mock_book_list, "life")[0])
+    assert [book["id"] for book in storage.search("life")] == _matches(
+        mock_book_list, "life"
+    )[1:]
+
+
+def test_batch_updates_and_deletes(tmp_path, mock_book_list, journal_storage):
+    ids = [book["id"] for book in mock_book_list[:3]]
+    for storage in (
+        journal_storage(mock_book_list),
+        _sqlite_storage(tmp_path, mock_book_list),
+    ):
+        updated = storage.update_statuses(ids, Status.FINISHED)
+        assert [book["id"] for book in updated] == ids
+        with raises(KeyError):
+            storage.delete_many([ids[0], 10**9])
+        assert len(storage.load()) == len(mock_book_list)
+        assert [book["id"] for book in storage.delete_many(ids + ids)] == ids
+        assert [book["id"] for book in storage.load()] == [
+            book["id"] for book in mock_book_list[3:]
+        ]
+
+
+def test_journal_batch_is_one_write(mock_book_list, journal_storage):
+    storage = journal_storage(mock_book_list)
+    with patch.object(JournalStorage, "_commit", wraps=storage._commit) as commit:
+        storage.delete_many([book["id"] for book in mock_book_list[:10]])
+    assert commit.call_count == 1
+    assert len(storage.journal_path.read_text().splitlines()) == 10
+
+
+def test_open_storage_detects_backend(tmp_path, mock_book_list, journal_storage):
+    _sqlite_storage(tmp_path, mock_book_list)
+    journal_storage(mock_book_list)
+    assert isinstance(open_storage(tmp_path / "books.db"), SqliteStorage)
+    assert isinstance(open_storage(tmp_path / "books.json"), JournalStorage)
+    assert isinstance(open_storage(tmp_path / "x", Backend.SQLITE), SqliteStorage)
+
+
+def test_iter_json_array_matches_json_load(raw_mock_data):
+    expected = json.loads(raw_mock_data)
+    for chunk_size in (1, 7, 4096):
+        decoded = iter_json_array(io.StringIO(raw_mock_data), chunk_size=chunk_size)
+        assert list(decoded) == expected
+    assert list(iter_json_array(io.StringIO(" [ 1, 22 ,333 ] "), chunk_size=2)) == [
+        1,
+        22,
+        333,
+    ]
+    assert list(iter_json_array(io.StringIO("[]"))) == []
+
+
+def test_iter_json_array_raises_on_malformed_input(malformed_data_path):
+    for contents in ("", "{}", "[1 2]", malformed_data_path.read_text()):
+        with raises(json.JSONDecodeError):
+            list(iter_json_array(io.StringIO(contents), chunk_size=16))
+
+
+def test_iter_books_matches_load(
+    tmp_path, mock_book_list, mock_single_book, journal_storage
+):
+    storage = journal_storage(mock_book_list)
+    storage.insert([{**mock_single_book}])
+    storage.update_status(mock_book_list[0]["id"], Status.FINISHED)
+    storage.delete(mock_book_list[1]["id"])
+    assert list(storage.iter_books()) == storage.load()
+    sqlite = _sqlite_storage(tmp_path, mock_book_list)
+    assert list(sqlite.iter_books(Ordering.TITLE)) == sqlite.load(Ordering.TITLE)
+
+
+def test_iter_books_memory_is_bounded(mock_book_list, journal_storage):
+    many = [{**book, "id": i} for i, book in enumerate(mock_book_list * 200)]
+    storage = journal_storage(many)
+    tracemalloc.start()
+    try:
+        for _ in storage.iter_books():
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < storage.db_path.stat().st_size / 4
+
+
+def test_iter_books_offset_and_limit(tmp_path, mock_book_list, journal_storage):
+    for storage in (
+        journal_storage(mock_book_list),
+        _sqlite_storage(tmp_path, mock_book_list),
+    ):
+        for ordering in (None, Ordering.TITLE):
+            page = list(storage.iter_books(ordering, 2, 3))
+            assert page == storage.load(ordering)[2:5]
+        CATALOG_CACHE.clear()
+        assert list(storage.iter_books(None, 4)) == storage.load()[4:]